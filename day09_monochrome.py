@@ -21,15 +21,16 @@
 # %%
 import pygmt
 
+from mapchallenge.cache import fetch
+
 # %% [markdown]
 # Download the Landsat 9 First Light image
 # over Kimberley Coast in Western Australia
 # from https://svs.gsfc.nasa.gov/13987.
 
 # %%
-tif_file = pygmt.which(
-    fname="https://svs.gsfc.nasa.gov/vis/a010000/a013900/a013987/L9_Australia_20211031_p109r070-lrg.tif",
-    download=True,
+tif_file = fetch(
+    url="https://svs.gsfc.nasa.gov/vis/a010000/a013900/a013987/L9_Australia_20211031_p109r070-lrg.tif"
 )
 
 # %%
@@ -20,8 +20,8 @@
 
 # %%
 import pygmt
-import requests
-import shutil
+
+from mapchallenge.cache import fetch
 
 # %% [markdown]
 # Download MODIS Terra true colour imagery
@@ -31,9 +31,7 @@ import shutil
 
 # %%
 url = "https://wvs.earthdata.nasa.gov/api/v1/snapshot?REQUEST=GetSnapshot&LAYERS=MODIS_Terra_CorrectedReflectance_TrueColor&CRS=EPSG:4326&TIME=2021-11-09&WRAP=DAY&BBOX=55,-5.5,56.45,-3.55&FORMAT=image/tiff&WIDTH=887&HEIGHT=660&AUTOSCALE=TRUE&ts=1636541620482"
-response = requests.get(url=url, stream=True)
-with open("modis_img.tif", "wb") as out_file:
-    shutil.copyfileobj(response.raw, out_file)
+fetch(url=url, fname="modis_img.tif")
 
 # %%
 # Inspect the GeoTIFF file's metadata
@@ -21,7 +21,9 @@
 # %%
 import pygmt
 import rioxarray
-import xarray as xr
+
+from mapchallenge.cache import fetch
+from mapchallenge.raster import reproject_window, stretch_to_uint8
 
 # %% [markdown]
 # ## Download Digital Elevation Model (DEM) over Scott Base, Antarctica
@@ -34,9 +36,8 @@ import xarray as xr
 # - Fountain, A. G., Fernandez-Diaz, J. C., Obryk, M., Levy, J., Gooseff, M., Van Horn, D. J., Morin, P., and Shrestha, R.: High-resolution elevation mapping of the McMurdo Dry Valleys, Antarctica, and surrounding regions, Earth Syst. Sci. Data, 9, 435-443, https://doi.org/10.5194/essd-9-435-2017, 2017
 
 # %%
-dem_file: str = pygmt.which(
-    fname="https://opentopography.s3.sdsc.edu/raster/MDV_2014/MDV_2014_be/Capes_MCMD_Pegasus/Mcmd.tif",
-    download=True,
+dem_file: str = fetch(
+    url="https://opentopography.s3.sdsc.edu/raster/MDV_2014/MDV_2014_be/Capes_MCMD_Pegasus/Mcmd.tif"
 )
 
 # %%
@@ -65,37 +66,22 @@ with rioxarray.open_rasterio(filename="Mcmd.tif") as dem_ds:
 # to find out how the links to the Cloud Optimized GeoTiff files are obtained.
 
 # %%
-band4 = rioxarray.open_rasterio(
-    filename="https://sentinel-cogs.s3.us-west-2.amazonaws.com/sentinel-s2-l2a-cogs/58/C/EU/2021/11/S2B_58CEU_20211109_0_L2A/B04.tif",
-    masked=True,
-)
-band4["band"] = 4 * band4.band
-band3 = rioxarray.open_rasterio(
-    filename="https://sentinel-cogs.s3.us-west-2.amazonaws.com/sentinel-s2-l2a-cogs/58/C/EU/2021/11/S2B_58CEU_20211109_0_L2A/B03.tif",
+# Reproject the Red (4), Green (3) and Blue (2) bands from EPSG:32758 to
+# EPSG:3294, reading and warping only the part covering the DEM extent
+b432 = reproject_window(
+    filenames=[
+        f"https://sentinel-cogs.s3.us-west-2.amazonaws.com/sentinel-s2-l2a-cogs/58/C/EU/2021/11/S2B_58CEU_20211109_0_L2A/{band}.tif"
+        for band in ["B04", "B03", "B02"]
+    ],
+    dst_crs="EPSG:3294",
+    bounds=(minx, miny, maxx, maxy),
+    bands=[4, 3, 2],
     masked=True,
 )
-band3["band"] = 3 * band3.band
-band2 = rioxarray.open_rasterio(
-    filename="https://sentinel-cogs.s3.us-west-2.amazonaws.com/sentinel-s2-l2a-cogs/58/C/EU/2021/11/S2B_58CEU_20211109_0_L2A/B02.tif",
-    masked=True,
-)
-band2["band"] = 2 * band2.band
-
-# %%
-# Stack the Red (4), Green (3) and Blue (2) bands together
-band432 = xr.concat(objs=[band4, band3, band2], dim="band")
-
-# %%
-# Reproject image from EPSG:32758 to EPSG:3294
-band432_reprojected = band432.rio.reproject(dst_crs="EPSG:3294")
-
-# %%
-# Clip Sentinel 2 imagery to geographical extent of the DEM
-b432 = band432_reprojected.rio.clip_box(minx=minx, miny=miny, maxx=maxx, maxy=maxy)
 
 # %%
-# Normalize from 16-bit to 8-bit colors
-b432_scott_base = ((b432 - b432.min()) / (b432.max() - b432.min())) * 2 ** 8
+# Normalize from 16-bit to 8-bit colors, processing 512 rows at a time
+b432_scott_base = stretch_to_uint8(dataarray=b432)
 
 # %%
 # Save preprocessed Sentinel 2 image to a GeoTIFF file
@@ -20,13 +20,12 @@
 # Counting cute megafauna!
 
 # %%
-import os
-import zipfile
-
 import pandas as pd
 import pygmt
 import pyproj
-import rioxarray
+
+from mapchallenge.archive import open_zipped_raster
+from mapchallenge.cache import fetch
 
 # %% [markdown]
 # ## Download Adélie Penguin population counts
@@ -41,7 +40,9 @@ import rioxarray
 
 # %%
 df = pd.read_csv(
-    filepath_or_buffer="https://github.com/pointblue/ContinentalWESEestimates/raw/v1.0/data/ADPE_colonies_20200416.csv"
+    filepath_or_buffer=fetch(
+        url="https://github.com/pointblue/ContinentalWESEestimates/raw/v1.0/data/ADPE_colonies_20200416.csv"
+    )
 )
 
 # %%
@@ -66,21 +67,18 @@ df
 # download product from https://lima.usgs.gov/fullcontinent.php
 
 # %%
-# Download and unzip LIMA GeoTIFF file
-pygmt.which(fname="https://lima.usgs.gov/tiff_90pct.zip", download=True)
-with zipfile.ZipFile(file="tiff_90pct.zip") as z:
-    for zip_info in z.infolist():
-        if zip_info.filename.endswith(".tif"):
-            zip_info.filename = os.path.basename(zip_info.filename)
-            z.extract(member=zip_info)
+# Download LIMA GeoTIFF file
+fetch(url="https://lima.usgs.gov/tiff_90pct.zip")
 
 # %%
-# Crop to our region of interest in the Eastern part of the Ross Sea
-with rioxarray.open_rasterio(filename="00000-20080319-092059124.tif") as rds:
-    rds_cropped = rds.rio.clip_box(
-        minx=150_000, maxx=600_000, miny=-2_100_000, maxy=-1_180_000
-    )
-    rds_cropped.rio.to_raster("LIMA_cropped.tif")
+# Crop to our region of interest in the Eastern part of the Ross Sea, reading
+# only that window of the GeoTIFF straight from inside the zip file
+rds_cropped = open_zipped_raster(
+    archive="tiff_90pct.zip",
+    pattern="*00000-20080319-092059124.tif",
+    bbox=(150_000, -2_100_000, 600_000, -1_180_000),  # minx, miny, maxx, maxy
+)
+rds_cropped.rio.to_raster("LIMA_cropped.tif")
 
 # %%
 # Inspect the GeoTIFF file's metadata
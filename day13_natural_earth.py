@@ -23,10 +23,13 @@
 
 # %%
 import os
-import zipfile
 
 import pygmt
 
+from mapchallenge.archive import vsizip_path
+from mapchallenge.cache import fetch
+from mapchallenge.raster import overview_for_plot
+
 # %% [markdown]
 # ## Download Natural Earth 1:50m Cross-blended Hypsometric Tints
 #
@@ -38,19 +41,15 @@ import pygmt
 # the *.VERSION.txt says v2.0.0, just so you know.
 
 # %%
-# Download and unzip Natural Earth Cross-blended Hypsometric Tint
+# Download Natural Earth Cross-blended Hypsometric Tint
 # with Shaded Relief and Water GeoTiff file
-pygmt.which(
-    fname="https://naturalearth.s3.amazonaws.com/50m_raster/HYP_50M_SR_W.zip",
-    download=True,
-)
-with zipfile.ZipFile(file="HYP_50M_SR_W.zip") as z:
-    for zip_info in z.infolist():
-        z.extract(member=zip_info)
+fetch(url="https://naturalearth.s3.amazonaws.com/50m_raster/HYP_50M_SR_W.zip")
 
 # %%
-# Inspect the GeoTIFF file's metadata
-print(pygmt.grdinfo(grid="HYP_50M_SR_W.tif"))
+# Point to the GeoTIFF file inside the zip file, which GMT reads through GDAL
+# without unzipping it first, and inspect the GeoTIFF file's metadata
+hyp_50m_sr_w: str = vsizip_path(archive="HYP_50M_SR_W.zip", pattern="*.tif")
+print(pygmt.grdinfo(grid=hyp_50m_sr_w))
 
 # %% [markdown]
 # ## Plot the map!
@@ -75,8 +74,15 @@ fig.coast(resolution="c", water=True)  # start water clip path
 fig.grdimage(grid="@earth_relief_10m", cmap="bukavu", shading=True)
 fig.coast(Q=True)  # end water clip path
 
-# Natural Earth Hypsometric Tint layer
-fig.grdimage(grid="HYP_50M_SR_W.tif", dpi=300, transparency=25)
+# Natural Earth Hypsometric Tint layer, at just enough resolution for 300 dpi
+# on the 12cm wide hemisphere (180 degrees of longitude)
+fig.grdimage(
+    grid=overview_for_plot(
+        filename=hyp_50m_sr_w, dpi=300, width=12, region=[70, 250, -90, 90]
+    ),
+    dpi=300,
+    transparency=25,
+)
 
 fig.savefig(fname="day13_natural_earth.png", transparent=True)
 fig.show()
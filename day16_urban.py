@@ -20,10 +20,11 @@
 # Map an urban area or rural area. Or something that defines that place.
 
 # %%
-import zipfile
-
 import pygmt
 
+from mapchallenge.archive import vsizip_path
+from mapchallenge.raster import overview_for_plot
+
 # %% [markdown]
 # ## Download Wellington City Urban Aerial Photos
 #
@@ -49,16 +50,19 @@ import pygmt
 # ![Download settings on LDS](https://user-images.githubusercontent.com/23487320/141964407-f2a06171-7767-423f-8e07-a32c8ed21865.png)
 
 # %%
-# Unzip the files
-for file in ["lds-tile-bq31-500-041070-GTiff.zip", "lds-tile-bq31-041070-GTiff.zip"]:
-    with zipfile.ZipFile(file=file) as z:
-        for zip_info in z.infolist():
-            z.extract(member=zip_info)
+# Point to the GeoTIFF files inside the zip files, which GMT reads through GDAL
+# without unzipping them first
+bq31_500_041070: str = vsizip_path(
+    archive="lds-tile-bq31-500-041070-GTiff.zip", member="BQ31_500_041070.tif"
+)
+bq31_041070: str = vsizip_path(
+    archive="lds-tile-bq31-041070-GTiff.zip", member="BQ31_041070.tif"
+)
 
 # %%
 # Inspect the metadata of the GeoTIFF files
-print(pygmt.grdinfo(grid="BQ31_500_041070.tif"))
-print(pygmt.grdinfo(grid="BQ31_041070.tif"))
+print(pygmt.grdinfo(grid=bq31_500_041070))
+print(pygmt.grdinfo(grid=bq31_041070))
 
 # %% [markdown]
 # ## Plot the map!
@@ -75,6 +79,8 @@ print(pygmt.grdinfo(grid="BQ31_041070.tif"))
 import pygmt
 
 # %%
+# Each image is plotted from the coarsest level that still has 300 dpi on
+# the 8cm wide panels, instead of from the full resolution GeoTIFF
 fig = pygmt.Figure()
 
 with pygmt.config(FONT_TAG="AvantGarde-Demi,225/221/0"):
@@ -88,11 +94,11 @@ with pygmt.config(FONT_TAG="AvantGarde-Demi,225/221/0"):
     ):
         # Plot 2012/2013 image on the left
         with fig.set_panel(panel=0, fixedlabel="2012/2013"):
-            fig.grdimage(grid="BQ31_041070.tif")
+            fig.grdimage(grid=overview_for_plot(filename=bq31_041070, width=8))
 
         # Plot 2020/2021 image on the right
         with fig.set_panel(panel=1, fixedlabel="2020/2021"):
-            fig.grdimage(grid="BQ31_500_041070.tif")
+            fig.grdimage(grid=overview_for_plot(filename=bq31_500_041070, width=8))
 
 # fig.savefig(fname="day16_urban.png")
 fig.show()
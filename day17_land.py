@@ -20,14 +20,14 @@
 # Land, landcover, landuse... You choose.
 
 # %%
-import zipfile
-
 import laspy
-import pandas as pd
 import pygmt
-import rioxarray.merge
 import xarray as xr
 
+from mapchallenge.archive import vsizip_path
+from mapchallenge.lidar import TileIndex, canopy_height, dsm_dtm_tiles
+from mapchallenge.raster import VirtualMosaic
+
 laspy.LazBackend.detect_available()
 
 # %% [markdown]
@@ -70,37 +70,51 @@ urls: list = [
 _ = pygmt.which(fname=" ".join(urls), download=True)
 
 # %%
-# Preprocess LiDAR data using blockmedian
-for lazfile in lazfiles:
-    lazdata = laspy.read(source=lazfile)
-    _df = pd.DataFrame(
-        data={
-            "x": lazdata.x.scaled_array(),
-            "y": lazdata.y.scaled_array(),
-            "z": lazdata.z.scaled_array(),
-        }
-    )
-
-    # Trim the LiDAR points using blockmedian,
-    # and save the XYZ output to a txt file
-    region = pygmt.info(data=_df, spacing=5)  # West, East, South, North
-    pygmt.blockmedian(
-        data=_df[["x", "y", "z"]],
-        T=0.99,  # 99th quantile, i.e. the highest point
-        spacing="5+e",
-        region=region,
-        outfile=lazfile.replace(".laz", ".txt"),
-    )
-
+# Index the bounds of all the downloaded LAZ tiles by reading only their
+# headers, and pick just the tiles that overlap the Zealandia area. The index
+# is saved to disk, and only rebuilt when the tiles change.
+tile_index: TileIndex = TileIndex.load(tiles=".", index_path="lidar_tiles")
+lazfiles: list = [
+    tile["path"]
+    for tile in tile_index.query(bbox=(1_744_960, 5_424_000, 1_746_880, 5_427_600))
+]
+print(f"Found {len(lazfiles)} of {len(tile_index)} tiles")
 
 # %%
-datafiles = [lazfile.replace(".laz", ".txt") for lazfile in lazfiles]
+# Preprocess LiDAR data by keeping the 99th quantile (i.e. the highest point)
+# of all returns in each 5m block for the surface model, and the median of
+# the ground-classified returns for the terrain model, in one pass over the
+# points. The tiles are independent, so they are processed on all CPU cores,
+# and each tile is decompressed in chunks of 1 million points. Only the 32
+# lowest and highest elevations of each block are kept between chunks, so
+# memory doesn't grow with the number of points. The 99th quantiles are exact
+# (for blocks of up to 3200 points), and so are the ground medians of blocks
+# with up to 64 ground points, while those of denser blocks are estimated.
+# Quantiles are interpolated between ranks, so they can differ slightly from
+# GMT's blockmedian.
+xyz, xyz_ground = dsm_dtm_tiles(
+    lazfiles=lazfiles, spacing=5, quantile=0.99, ground_quantile=0.5
+)
+
+# %% [raw]
+# # Alternatively, save the 99th quantile of each block to native binary
+# # files (no slow text formatting and parsing). Pass these to pygmt.surface
+# # below with data=" ".join(datafiles) and binary="i3d". The points are
+# # reduced in NumPy in the same way as above, since GMT's blockmedian would
+# # need all the points of a tile in memory at once. The 99th quantiles are
+# # exact, so the surface values differ slightly from the earlier runs that
+# # reduced tiles of more than 1 million points in two chunked passes.
+# from mapchallenge.lidar import blockmedian_tiles
+#
+# datafiles: list = blockmedian_tiles(
+#     lazfiles=lazfiles, spacing=5, quantile=0.99, chunk_size=1_000_000
+# )
 
 # %%
 # Create a Digital Surface Elevation Model with
 # a spatial resolution of 5m.
 grid: xr.DataArray = pygmt.surface(
-    data=" ".join(datafiles),
+    data=xyz,
     spacing="5+e",
     region=[1_744_960, 1_746_880, 5_424_000, 5_427_600],
     T=0.35,  # tension factor
@@ -109,6 +123,35 @@ grid: xr.DataArray = pygmt.surface(
 )
 print(grid)
 
+# %%
+# Create a Digital Terrain Model (bare ground) in the same way, and subtract
+# it from the DSM to get the height of the trees and buildings
+dtm: xr.DataArray = pygmt.surface(
+    data=xyz_ground,
+    spacing="5+e",
+    region=[1_744_960, 1_746_880, 5_424_000, 5_427_600],
+    T=0.35,  # tension factor
+    Ll="d",  # lower bound is min value
+    Lu="d",  # upper bound is max value
+)
+chm: xr.DataArray = canopy_height(dsm=grid, dtm=dtm)
+print(chm.quantile(q=[0.5, 0.99]))
+
+# %% [raw]
+# # For a much bigger area, e.g. a whole-city DSM, grid the points in 1km
+# # tiles with a 100m overlap on all CPU cores instead, and blend them
+# # together into one seamless grid
+# from mapchallenge.lidar import tiled_surface
+#
+# grid: xr.DataArray = tiled_surface(
+#     data=xyz,
+#     region=[1_744_960, 1_746_880, 5_424_000, 5_427_600],
+#     spacing=5,
+#     tile_size=1000,
+#     overlap=100,
+#     T=0.35,  # tension factor
+# )
+
 # %% [markdown]
 # ## Download Wellington City Rural Aerial Photos
 #
@@ -131,24 +174,26 @@ print(grid)
 # ![Download settings on LDS](https://user-images.githubusercontent.com/23487320/142071096-3d9ff3d1-39bd-40c3-8614-565efd235671.png)
 
 # %%
-# Unzip the files
-for file in ["lds-tile-bq31-5000-0506-GTiff.zip", "lds-tile-bq31-5000-0507-GTiff.zip"]:
-    with zipfile.ZipFile(file=file) as z:
-        for zip_info in z.infolist():
-            z.extract(member=zip_info)
-
-# %%
-# Merge the two GeoTIFFs together into a single dataarray
-rda1 = rioxarray.open_rasterio(filename="BQ31_5000_0506.tif")
-rda2 = rioxarray.open_rasterio(filename="BQ31_5000_0507.tif")
-rda = rioxarray.merge.merge_arrays(dataarrays=[rda1, rda2])
+# Combine the two GeoTIFFs into a virtual mosaic, reading them straight from
+# inside the zip files without unzipping them. Only the headers are read here
+mosaic = VirtualMosaic(
+    filenames=[
+        vsizip_path(
+            archive="lds-tile-bq31-5000-0506-GTiff.zip", member="BQ31_5000_0506.tif"
+        ),
+        vsizip_path(
+            archive="lds-tile-bq31-5000-0507-GTiff.zip", member="BQ31_5000_0507.tif"
+        ),
+    ]
+)
 
 # %%
-# Clip RGB aerial imagery to geographical extent of Zealandia sanctuary
-rda_clipped = rda.rio.clip_box(
-    minx=1_744_960, maxx=1_746_880, miny=5_424_000, maxy=5_427_600
+# Clip RGB aerial imagery to geographical extent of Zealandia sanctuary,
+# reading only the blocks of each tile that are inside it
+mosaic.to_raster(
+    raster_path="BQ31_5000_0506-0507.tif",
+    bbox=(1_744_960, 5_424_000, 1_746_880, 5_427_600),  # minx, miny, maxx, maxy
 )
-rda_clipped.rio.to_raster(raster_path="BQ31_5000_0506-0507.tif", dtype="uint8")
 
 # %%
 # Inspect the metadata of the merged GeoTIFF file
@@ -20,12 +20,13 @@
 # Oceans, lakes, rivers or something completely different.
 
 # %%
-import zipfile
-
 import pygmt
-import rioxarray.merge
+import rioxarray
 import xarray as xr
 
+from mapchallenge.archive import vsizip_path
+from mapchallenge.raster import VirtualMosaic, load_reprojected_relief
+
 # %% [markdown]
 # ## Download NZ 10m Satellite Imagery (2020-2021)
 #
@@ -49,28 +50,23 @@ import xarray as xr
 # ![Download settings on LDS](https://user-images.githubusercontent.com/23487320/142297904-2b12d2a6-27e9-4222-bc94-f7a681c7c0ba.png)
 
 # %%
-# Unzip the files
-for file in ["lds-tile-bx15-GTiff.zip", "lds-tile-bx16-GTiff.zip"]:
-    with zipfile.ZipFile(file=file) as z:
-        for zip_info in z.infolist():
-            z.extract(member=zip_info)
-
-# %%
-# Merge the two GeoTIFFs together into a single dataarray
-rda1 = rioxarray.open_rasterio(filename="BX15.tif")
-rda2 = rioxarray.open_rasterio(filename="BX16.tif")
-rda = rioxarray.merge.merge_arrays(dataarrays=[rda1, rda2])
+# Combine the two GeoTIFFs into a virtual mosaic, reading them straight from
+# inside the zip files without unzipping them. Only the headers are read here
+mosaic = VirtualMosaic(
+    filenames=[
+        vsizip_path(archive="lds-tile-bx15-GTiff.zip", member="BX15.tif"),
+        vsizip_path(archive="lds-tile-bx16-GTiff.zip", member="BX16.tif"),
+    ]
+)
 
 # %%
-# Clip RGB aerial imagery to geographical extent of Aoraki
-rda_clipped = rda.rio.clip_box(
-    # minx=1_348_000, maxx=1_396_000, miny=5_154_000, maxy=5_190_000
-    minx=1_360_000,
-    maxx=1_390_000,
-    miny=5_155_000,
-    maxy=5_190_000,
+# Clip RGB aerial imagery to geographical extent of Aoraki,
+# reading only the blocks of each tile that are inside it
+mosaic.to_raster(
+    raster_path="BX15-16.tif",
+    # bbox=(1_348_000, 5_154_000, 1_396_000, 5_190_000),
+    bbox=(1_360_000, 5_155_000, 1_390_000, 5_190_000),  # minx, miny, maxx, maxy
 )
-rda_clipped.rio.to_raster(raster_path="BX15-16.tif", dtype="uint8")
 
 # %%
 # Inspect the metadata of the merged GeoTIFF file
@@ -89,26 +85,18 @@ print(pygmt.grdinfo(grid="BX15-16.tif"))
 # solely on the mountainous areas.
 
 # %%
-# Download 1 arc-second SRTM1S DEM
-dem_wgs84: xr.DataArray = pygmt.datasets.load_earth_relief(
-    resolution="01s", region=[169.8, 170.5, -43.8, -43.3]
-)
-
-# %%
-# Reproject from EPSG:4326 to EPSG:2193
-dem_wgs84.rio.set_crs(input_crs="EPSG:4326")
-dem_grid = dem_wgs84.rio.reproject(dst_crs="EPSG:2193", resolution=25)
-
-# %%
-# Clip the raster to our region of interest
-dem_grid_clipped = dem_grid.rio.clip_box(
-    # minx=1_348_000, maxx=1_396_000, miny=5_154_000, maxy=5_190_000
-    minx=1_360_000,
-    maxx=1_390_000,
-    miny=5_155_000,
-    maxy=5_190_000,
+# Download 1 arc-second SRTM1S DEM, reproject from EPSG:4326 to EPSG:2193,
+# and clip the raster to our region of interest. The result is cached on
+# disk, so re-running this cell skips the download and reprojection.
+dem_grid_clipped: xr.DataArray = load_reprojected_relief(
+    resolution="01s",
+    region=[169.8, 170.5, -43.8, -43.3],
+    dst_crs="EPSG:2193",
+    dst_resolution=25,
+    # bounds=(1_348_000, 5_154_000, 1_396_000, 5_190_000),
+    bounds=(1_360_000, 5_155_000, 1_390_000, 5_190_000),  # minx, miny, maxx, maxy
+    dtype="int16",
 )
-dem_grid_clipped = dem_grid_clipped.astype(dtype="int16")
 dem_grid_clipped.rio.to_raster(raster_path="dem_grid.tif", dtype="int16")
 
 # %%
@@ -22,8 +22,9 @@
 # %%
 import geopandas as gpd
 import pygmt
-import rioxarray
-import xarray as xr
+
+from mapchallenge.cache import fetch
+from mapchallenge.raster import load_bands, stretch_to_uint8
 
 # %% [markdown] tags=[]
 # ## Download and preprocess Sentinel 2 true colour imagery
@@ -36,44 +37,31 @@ import xarray as xr
 # I've omitted the code for brevity, but you can follow
 # https://github.com/intake/intake-stac/blob/0.3.0/examples/aws-earth-search.ipynb
 # to find out how the links to the Cloud Optimized GeoTiff files are obtained.
+#
+# Only the COG tiles covering Funafuti, Tuvalu are read, rather than
+# the whole Sentinel 2 scene.
 
 # %%
-band4 = rioxarray.open_rasterio(
-    filename="https://sentinel-cogs.s3.us-west-2.amazonaws.com/sentinel-s2-l2a-cogs/60/L/YR/2021/11/S2A_60LYR_20211112_0_L2A/B04.tif",
-    # masked=True,
-    # overview_level=1,
-)
-band4["band"] = 4 * band4.band
-band3 = rioxarray.open_rasterio(
-    filename="https://sentinel-cogs.s3.us-west-2.amazonaws.com/sentinel-s2-l2a-cogs/60/L/YR/2021/11/S2A_60LYR_20211112_0_L2A/B03.tif",
-    # masked=True,
-    # overview_level=1,
-)
-band3["band"] = 3 * band3.band
-band2 = rioxarray.open_rasterio(
-    filename="https://sentinel-cogs.s3.us-west-2.amazonaws.com/sentinel-s2-l2a-cogs/60/L/YR/2021/11/S2A_60LYR_20211112_0_L2A/B02.tif",
-    # masked=True,
-    # overview_level=1,
-)
-band2["band"] = 2 * band2.band
-
-# %%
-# Stack the Red (4), Green (3) and Blue (2) bands together
-band432 = xr.concat(objs=[band4, band3, band2], dim="band")
+# Bounding box of Funafuti, Tuvalu in EPSG:32760/UTM zone 60S coordinates
+bbox: tuple = (740_900, 9_056_000, 743_000, 9_059_050)  # minx, miny, maxx, maxy
+# bbox: tuple = (720_000, 9_042_500, 745_000, 9_075_000)
 
 # %%
-# Clip Sentinel 2 imagery to Funafuti, Tuvalu
-band432_clipped = band432.rio.clip_box(
-    minx=740900, maxx=743000, miny=9056000, maxy=9059050
+# Read the Red (4), Green (3) and Blue (2) bands concurrently into one stack
+band432_clipped = load_bands(
+    filenames=[
+        f"https://sentinel-cogs.s3.us-west-2.amazonaws.com/sentinel-s2-l2a-cogs/60/L/YR/2021/11/S2A_60LYR_20211112_0_L2A/{band}.tif"
+        for band in ["B04", "B03", "B02"]
+    ],
+    bands=[4, 3, 2],
+    bbox=bbox,
+    # masked=True,
+    # resolution=20,  # read from the 20m overview for a quick look
 )
-# band432_clipped = band432.rio.clip_box(minx=720000, maxx=745000, miny=9042500, maxy=9075000)
 
 # %%
-# Normalize from 16-bit to 8-bit colors
-b432 = (
-    (band432_clipped - band432_clipped.min())
-    / (band432_clipped.max() - band432_clipped.min())
-) * 2 ** 8
+# Normalize from 16-bit to 8-bit colors, processing 512 rows at a time
+b432 = stretch_to_uint8(dataarray=band432_clipped)
 
 # %%
 # Save preprocessed Sentinel 2 image to a GeoTIFF file
@@ -98,10 +86,7 @@ print(pygmt.grdinfo(grid="B432_Tuvalu.tif"))
 # https://tuvalu-data.sprep.org/dataset/tuvalu-coast-gis-data
 
 # %%
-_ = pygmt.which(
-    fname="https://tuvalu-data.sprep.org/system/files/TUV_coast.geojson",
-    download=True,
-)
+_ = fetch(url="https://tuvalu-data.sprep.org/system/files/TUV_coast.geojson")
 
 # %%
 # Read GeoJSON file and reproject multipolygons
@@ -20,14 +20,18 @@
 # Visualizing movement can be done with a static map or with an animation.
 
 # %%
-import asyncio
 import os
 import glob
 
-import aioftp
 import pandas as pd
 
-loop = asyncio.get_event_loop()
+from mapchallenge.animation import render_movie
+from mapchallenge.himawari import (
+    FTPFetcher,
+    append_to_zarr,
+    fetch_and_process,
+    netcdf_to_geotiff,
+)
 
 # %% [markdown] tags=[]
 # # Download Himawari-8 imagery
@@ -65,64 +69,121 @@ for dt in datetimes:
     filepaths.append(filepath)
 
 # %%
-async def get_himawari(path: str):
-    if not os.path.exists(path=os.path.basename(path)):
-        async with aioftp.Client.context(
-            host="ftp.ptree.jaxa.jp", user="user_domain.com", password="abcdefgh"
-        ) as client:
-            await client.download(path)
+async def main() -> tuple:
+    # Download through a pool of 4 logged-in FTP sessions, retrying failed
+    # files with backoff and resuming partial downloads. Each file is cropped
+    # into a GeoTIFF (see the xarray section below) as soon as it lands, with
+    # at most 8 files waiting to be processed at a time.
+    async with FTPFetcher(
+        host="ftp.ptree.jaxa.jp",
+        user="user_domain.com",
+        password="abcdefgh",
+        pool_size=4,
+    ) as fetcher:
+        return await fetch_and_process(
+            fetcher=fetcher,
+            paths=filepaths,
+            process=netcdf_to_geotiff,
+            max_workers=2,
+            max_pending=8,
+        )
 
 
 # %%
-async def main():
-    tasks = [asyncio.create_task(coro=get_himawari(filepath)) for filepath in filepaths]
-    await asyncio.wait(fs=tasks)
-
+# Download and process NetCDF files from FTP server asynchronously, using
+# Jupyter's top-level await (wrap it in asyncio.run(main()) in a script)
+results, raster_paths = await main()
 
 # %%
-# Download NetCDF files from FTP server asynchronously
-asyncio.run_coroutine_threadsafe(coro=main(), loop=loop)
+# Report the download speed of each file
+df_fetch = pd.DataFrame(data=results)
+df_fetch["MB/s"] = [result.throughput for result in results]
+print(df_fetch)
 
 # %%
 # Check that downloaded number of files is as expected
 # !ls -lh NC_H08_*.nc | wc -l
 assert len(glob.glob("NC_H08_*.nc")) == len(datetimes)
 
+# %%
+# Append the Band 13 (Far Infrared) frames into one chunked, compressed Zarr
+# cube. Re-running this only adds frames that are not in the cube yet.
+appended: list = append_to_zarr(
+    filenames=glob.glob("NC_H08_*.nc"), store="H08_tbb_13.zarr", variable="tbb_13"
+)
+print(f"Appended {len(appended)} frames to H08_tbb_13.zarr")
+
 # %% [markdown]
 # ## Make the GIF animation!
 #
-# Let's use GMT's [movie](https://docs.generic-mapping-tools.org/6.2/movie.html)
-# command to make the GIF animation. We'll plot Himawari-8's Band 13 (Far Infrared)
-# on top of the Black Marble (earth_night) imagery. The map will also include
-# longitude/latitude gridlines and a text annotation of the image's capture time.
+# We'll plot Himawari-8's Band 13 (Far Infrared) on top of the Black Marble
+# (earth_night) imagery. The map will also include longitude/latitude gridlines
+# and a text annotation of the image's capture time.
+#
+# The Black Marble background is the same on every frame, so it is only
+# rendered once. The Band 13 overlays and timestamps are then rendered
+# on all CPU cores, and composited on top of the background.
 
 # %%
-%%file typhoon_kompasu.sh
-gmt begin
-    # Get datetime in format YYYYMMDD_hhmm, e.g. 20121011_1800
-    datetime=$(date --date=$(gmt math -T2021-10-11T12:00:00/2021-10-13T12:00:00/1h -o0 -qo${MOVIE_FRAME} T =) "+%Y%m%d_%H%M")
-
-    # pygmt.config(FONT_ANNOT="white", MAP_FRAME_TYPE="inside", PS_PAGE_COLOR="black")
-    gmt set FONT_ANNOT=white
-    gmt set MAP_FRAME_TYPE=inside
-    gmt set PS_PAGE_COLOR=black
-
-    # fig.shift_origin(xshift="f0", yshift="f0")
-    gmt plot -T -Xf0 -Yf0
-
-    # fig.grdimage(grid="@earth_night_30m", region="90/140/5/35", projection=EPSG:32651", frame=True)
-    gmt grdimage @earth_night_30m -R90/140/5/35 -JU50Q/${MOVIE_WIDTH} -BwSnE -Bafg
+# movie(canvassize="480p", nframes=49, displayrate=3, format="gif", prefix="day20_movement")
+render_movie(
+    grids=[("H08_tbb_13.zarr", "tbb_13", dt) for dt in datetimes],
+    labels=[dt.strftime("%Y%m%d_%H%M") for dt in datetimes],
+    fname="day20_movement.gif",
+    region=[90, 140, 5, 35],
+    projection="U50Q/24c",
+    frame=["wSnE", "afg"],
+    cmap="gray",
+    transparency=50,
+    dpi=90,
+    displayrate=3,
+    config=dict(FONT_ANNOT="white", MAP_FRAME_TYPE="inside", PS_PAGE_COLOR="black"),
+)
 
-    # fig.grdimage(grid='NC_H08_20211011_1200_R21_FLDK.06001_06001.nc?tbb_13', cmap="gray", transparency=50)
-    gmt grdimage NC_H08_${datetime}_R21_FLDK.06001_06001.nc?tbb_13 -Cgray -t50 -Ve
+# %% [raw]
+# # The GIF above shares one palette across frames, and only stores the pixels
+# # that changed from one frame to the next. For an even smaller file to embed
+# # on a web page, re-encode the rendered frames as a WebP or MP4 video instead
+# from mapchallenge.animation import encode_animation
+#
+# encode_animation(
+#     frames=sorted(glob.glob("frames/frame_*.png")),
+#     fname="day20_movement.mp4",
+#     duration=1000 / 3,
+# )
 
-    # fig.text(text=datetime, position="TC", offset="0c/-2c")
-    echo ${datetime} | gmt text -F+cTC -D0c/-2c
-gmt end
+# %% [markdown]
+# For reference, this is the equivalent
+# [GMT movie](https://docs.generic-mapping-tools.org/6.2/movie.html) script,
+# which renders the frames one at a time.
+
+# %% [raw]
+# %%file typhoon_kompasu.sh
+# gmt begin
+#     # Get datetime in format YYYYMMDD_hhmm, e.g. 20121011_1800
+#     datetime=$(date --date=$(gmt math -T2021-10-11T12:00:00/2021-10-13T12:00:00/1h -o0 -qo${MOVIE_FRAME} T =) "+%Y%m%d_%H%M")
+#
+#     # pygmt.config(FONT_ANNOT="white", MAP_FRAME_TYPE="inside", PS_PAGE_COLOR="black")
+#     gmt set FONT_ANNOT=white
+#     gmt set MAP_FRAME_TYPE=inside
+#     gmt set PS_PAGE_COLOR=black
+#
+#     # fig.shift_origin(xshift="f0", yshift="f0")
+#     gmt plot -T -Xf0 -Yf0
+#
+#     # fig.grdimage(grid="@earth_night_30m", region="90/140/5/35", projection=EPSG:32651", frame=True)
+#     gmt grdimage @earth_night_30m -R90/140/5/35 -JU50Q/${MOVIE_WIDTH} -BwSnE -Bafg
+#
+#     # fig.grdimage(grid='NC_H08_20211011_1200_R21_FLDK.06001_06001.nc?tbb_13', cmap="gray", transparency=50)
+#     gmt grdimage NC_H08_${datetime}_R21_FLDK.06001_06001.nc?tbb_13 -Cgray -t50 -Ve
+#
+#     # fig.text(text=datetime, position="TC", offset="0c/-2c")
+#     echo ${datetime} | gmt text -F+cTC -D0c/-2c
+# gmt end
 
-# %%
-# movie(canvassize="540p", nframes=49, displayrate=3, format="gif", prefix="day20_movement", erase=True)
-!gmt movie typhoon_kompasu.sh -C480p -T49 -D3 -A+l -Nday20_movement -Z
+# %% [raw]
+# # movie(canvassize="540p", nframes=49, displayrate=3, format="gif", prefix="day20_movement", erase=True)
+# !gmt movie typhoon_kompasu.sh -C480p -T49 -D3 -A+l -Nday20_movement -Z
 
 # %% [markdown]
 # ## (Optional) Processing using xarray/PyGMT
@@ -130,38 +191,23 @@ gmt end
 # For reference, this was some experimental code on
 # reading Himawari-8 NetCDF files using `xarray`,
 # and doing the plotting of a single map using `PyGMT`.
+# The `xarray` part now lives in `mapchallenge.himawari.netcdf_to_geotiff`,
+# which runs on each NetCDF file as soon as it is downloaded.
 
 # %%
 import pygmt
-import rioxarray
-import xarray as xr
 
-# %%
-for dt in datetimes:
-    filename = f"NC_H08_{dt.year}{dt.month:02d}{dt.day:02d}_{dt.hour:02d}{dt.minute:02d}_R21_FLDK.06001_06001.nc"
-    print(f"Processing {filename}")
-
-    # Process the Himawari-8 data using xarray/rioxarray
-    with xr.open_dataset(filename_or_obj=filename) as ds:
-        # Crop to SouthEast Asia region
-        ds_SEA: xr.Dataset = ds.sel(longitude=slice(90, 140), latitude=slice(35, 5))
-
-        # Get Red, Green and Blue only
-        ds_SEA_RGB: xr.DataArray = xr.concat(
-            objs=[ds_SEA.albedo_03, ds_SEA.albedo_02, ds_SEA.albedo_01],
-            dim="band",
-        )
-
-        # Apply coordinate reference system
-        ds_SEA_RGB.rio.set_crs(input_crs="EPSG:4326")
-        ds_SEA_RGB = ds_SEA_RGB.rio.reproject(dst_crs="EPSG:4326")
-
-        # Save 8-bit data to GeoTIFF
-        raster_path: str = f"TIF_H08_{dt.year}{dt.month:02d}{dt.day:02d}_{dt.hour:02d}{dt.minute:02d}.tif"
-        (ds_SEA_RGB * 2 ** 8).rio.to_raster(raster_path=raster_path, dtype="uint8")
+# %% [raw]
+# # The NetCDF files were already cropped to SouthEast Asia and saved as 8-bit
+# # Red/Green/Blue GeoTIFF files while downloading. If you want to redo this for
+# # NetCDF files downloaded beforehand, convert them in parallel on all CPU cores
+# from mapchallenge.himawari import preprocess_frames
+#
+# raster_paths: list = preprocess_frames(filenames=sorted(glob.glob("NC_H08_*.nc")))
 
-    # os.remove(path=filename)  # Remove original NetCDF file to save space
-    # break
+# %%
+# Check that the number of processed files is as expected
+assert len(glob.glob("TIF_H08_*.tif")) == len(datetimes)
 
 # %%
 # Inspect the GeoTIFF file's metadata
@@ -25,7 +25,9 @@ import pandas as pd
 import pygmt
 import requests
 import rioxarray
-import xarray as xr
+
+from mapchallenge.cache import GridCache
+from mapchallenge.raster import reproject_window, stretch_to_uint8
 
 # %% [markdown]
 # ## Download ICESat-2 ATL08 data from OpenAltimetry
@@ -95,9 +97,15 @@ print(df)
 # corresponding to [Egmont National Park](https://en.wikipedia.org/wiki/Egmont_National_Park).
 
 # %%
-# Get a 1 arc second DEM of radius 9.6km around Mt Taranaki summit
-grid = pygmt.grdcut(
-    grid="@earth_relief_01s", circ_subregion="174:03:53E/39:17:47S/9.6k+n"
+# Get a 1 arc second DEM of radius 9.6km around Mt Taranaki summit. The cut
+# grid is cached on disk, so re-running this cell doesn't redo the grdcut.
+grid = GridCache().get(
+    compute=lambda: pygmt.grdcut(
+        grid="@earth_relief_01s", circ_subregion="174:03:53E/39:17:47S/9.6k+n"
+    ),
+    dataset="earth_relief",
+    resolution="01s",
+    circ_subregion="174:03:53E/39:17:47S/9.6k+n",
 )
 print(grid)
 
@@ -120,42 +128,23 @@ print(region)  # 173/175/-39.4/-39.2/-39.2379/2496
 # to find out how the links to the Cloud Optimized GeoTiff files are obtained.
 
 # %%
-band4 = rioxarray.open_rasterio(
-    filename="https://landsat-pds.s3.amazonaws.com/c1/L8/074/087/LC08_L1TP_074087_20210526_20210529_01_T1/LC08_L1TP_074087_20210526_20210529_01_T1_B4.TIF",
-    # masked=True,
-    # overview_level=1,
-)
-band4["band"] = 4 * band4.band
-band3 = rioxarray.open_rasterio(
-    filename="https://landsat-pds.s3.amazonaws.com/c1/L8/074/087/LC08_L1TP_074087_20210526_20210529_01_T1/LC08_L1TP_074087_20210526_20210529_01_T1_B3.TIF",
+# Reproject the Red (4), Green (3) and Blue (2) bands to EPSG:4326, reading
+# and warping only the part covering the geographical extent of the DEM
+b432 = reproject_window(
+    filenames=[
+        f"https://landsat-pds.s3.amazonaws.com/c1/L8/074/087/LC08_L1TP_074087_20210526_20210529_01_T1/LC08_L1TP_074087_20210526_20210529_01_T1_{band}.TIF"
+        for band in ["B4", "B3", "B2"]
+    ],
+    dst_crs="EPSG:4326",
+    bounds=(173.95, -39.4, 174.18, -39.2),  # minx, miny, maxx, maxy
+    bands=[4, 3, 2],
     # masked=True,
-    # overview_level=1,
-)
-band3["band"] = 3 * band3.band
-band2 = rioxarray.open_rasterio(
-    filename="https://landsat-pds.s3.amazonaws.com/c1/L8/074/087/LC08_L1TP_074087_20210526_20210529_01_T1/LC08_L1TP_074087_20210526_20210529_01_T1_B2.TIF",
-    # masked=True,
-    # overview_level=1,
-)
-band2["band"] = 2 * band2.band
-
-# %%
-# Stack the Red (4), Green (3) and Blue (2) bands together
-band432 = xr.concat(objs=[band4, band3, band2], dim="band")
-
-# %%
-# Reproject image from EPSG:32758 to EPSG:4326
-band432_reprojected = band432.rio.reproject(dst_crs="EPSG:4326")
-
-# %%
-# Clip Sentinel 2 imagery to geographical extent of the DEM
-b432 = band432_reprojected.rio.clip_box(
-    minx=173.95, maxx=174.18, miny=-39.4, maxy=-39.2
+    # src_resolution=90,  # read the 30m bands' 3x (90m) overview for a quick look
 )
 
 # %%
-# Normalize from 16-bit to 8-bit colors
-b432_mt_taranaki = ((b432 - b432.min()) / (b432.max() - b432.min())) * 2 ** 8
+# Normalize from 16-bit to 8-bit colors, processing 512 rows at a time
+b432_mt_taranaki = stretch_to_uint8(dataarray=b432)
 
 # %%
 # Save preprocessed Landsat 8 image to a GeoTIFF file
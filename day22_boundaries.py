@@ -24,8 +24,9 @@
 import numpy as np
 import pandas as pd
 import pygmt
-import rioxarray
-import xarray as xr
+
+from mapchallenge.cache import fetch
+from mapchallenge.raster import load_bands, stretch_to_uint8
 
 # %% [markdown]
 # ## Download ICESat-2-derived grounding zone product for Antarctica
@@ -46,13 +47,19 @@ import xarray as xr
 
 # %%
 df_F = pd.read_csv(
-    filepath_or_buffer="https://data.bris.ac.uk/datasets/bnqqyngt89eo26qk8keckglww/ICESat2_F.csv"
+    filepath_or_buffer=fetch(
+        url="https://data.bris.ac.uk/datasets/bnqqyngt89eo26qk8keckglww/ICESat2_F.csv"
+    )
 )
 df_I = pd.read_csv(
-    filepath_or_buffer="https://data.bris.ac.uk/datasets/bnqqyngt89eo26qk8keckglww/ICESat2_I.csv"
+    filepath_or_buffer=fetch(
+        url="https://data.bris.ac.uk/datasets/bnqqyngt89eo26qk8keckglww/ICESat2_I.csv"
+    )
 )
 df_H = pd.read_csv(
-    filepath_or_buffer="https://data.bris.ac.uk/datasets/bnqqyngt89eo26qk8keckglww/ICESat2_H.csv"
+    filepath_or_buffer=fetch(
+        url="https://data.bris.ac.uk/datasets/bnqqyngt89eo26qk8keckglww/ICESat2_H.csv"
+    )
 )
 
 # %%
@@ -71,48 +78,39 @@ print(len(df_F), len(df_I), len(df_H))
 #
 # Note that the contrast stretching for Sentinel-3 OLCI is a bit more finicky
 # than Sentinel-2, so no guaranteees that this works for other areas!
+#
+# Only the COG tiles covering Kamb Ice Stream are read from each band.
 
 # %%
-band8 = rioxarray.open_rasterio(
-    filename="https://meeo-s3-cog.s3.amazonaws.com/NRT/S3A/OL_1_EFR___/2021/11/21/S3A_OL_1_EFR____20211121T155938_20211121T160238_20211121T172515_0179_079_011_4320_MAR_O_NR_002_Oa08_radiance.tif",
-    masked=True,
-    # overview_level=1,
-)
-band8["band"] = 8 * band8.band
-band6 = rioxarray.open_rasterio(
-    filename="https://meeo-s3-cog.s3.amazonaws.com/NRT/S3A/OL_1_EFR___/2021/11/21/S3A_OL_1_EFR____20211121T155938_20211121T160238_20211121T172515_0179_079_011_4320_MAR_O_NR_002_Oa06_radiance.tif",
-    masked=True,
-    # overview_level=1,
-)
-band6["band"] = 6 * band6.band
-band4 = rioxarray.open_rasterio(
-    filename="https://meeo-s3-cog.s3.amazonaws.com/NRT/S3A/OL_1_EFR___/2021/11/21/S3A_OL_1_EFR____20211121T155938_20211121T160238_20211121T172515_0179_079_011_4320_MAR_O_NR_002_Oa04_radiance.tif",
-    masked=True,
-    # overview_level=1,
-)
-band4["band"] = 4 * band4.band
+# Bounding box of Kamb Ice Stream in longitude/latitude coordinates
+bbox: tuple = (-156, -82.8, -150, -81.8)  # minx, miny, maxx, maxy
 
 # %%
-# Stack the Red (4), Green (3) and Blue (2) bands together
-# Note, slightly increasing the intensity of band6 to avoid image looking purple
-band864 = xr.concat(objs=[band8, band6 * 1.25, band4], dim="band")
+# Read the Red (8), Green (6) and Blue (4) bands concurrently into one stack
+b864 = load_bands(
+    filenames=[
+        f"https://meeo-s3-cog.s3.amazonaws.com/NRT/S3A/OL_1_EFR___/2021/11/21/S3A_OL_1_EFR____20211121T155938_20211121T160238_20211121T172515_0179_079_011_4320_MAR_O_NR_002_{band}_radiance.tif"
+        for band in ["Oa08", "Oa06", "Oa04"]
+    ],
+    bands=[8, 6, 4],
+    bbox=bbox,
+    masked=True,
+    # resolution=0.01,  # read from a coarser overview for a quick look
+)
 
 # %%
-# Clip Sentinel 2 imagery to geographical extent of Kamb Ice Stream
-b864 = band864.rio.clip_box(minx=-156, maxx=-150, miny=-82.8, maxy=-81.8)
+# Slightly increase the intensity of band6 to avoid image looking purple
+b864.loc[{"band": 6}] = b864.loc[{"band": 6}] * 1.25
 
 # %%
 # Highlight Optimized Natural Color
 # https://custom-scripts.sentinel-hub.com/sentinel-3/true_color_highlight_optimized/
 b864_highlight = np.sqrt(0.9 * b864 - 0.055)
-# Normalize to 8-bit color range
-b864_kamb = (
-    (b864_highlight - b864_highlight.min())
-    / (b864_highlight.max() - b864_highlight.min())
-) * 2 ** 8
+# Normalize to 8-bit color range, processing 512 rows at a time
+b864_kamb = stretch_to_uint8(dataarray=b864_highlight)
 
 # %%
-(b864_kamb / 2 ** 8).plot.imshow(rgb="band")
+b864_kamb.plot.imshow(rgb="band")
 
 # %%
 # Save preprocessed Sentinel 3 image to a GeoTIFF file
@@ -24,9 +24,11 @@
 # %%
 import pandas as pd
 import pygmt
-import rioxarray
 import xarray as xr
 
+from mapchallenge.blocks import cull_columns
+from mapchallenge.raster import coarsen_raster, open_cog_window
+
 # %% [markdown]
 # ## Download and preprocess GHS-BUILT-S2 R2020A for NW Borneo
 #
@@ -51,16 +53,13 @@ import xarray as xr
 # - Corbane, C., Syrris, V., Sabo, F. et al. Convolutional neural networks for global human settlements mapping from Sentinel-2 satellite imagery. Neural Comput & Applic (2020). doi:10.1007/s00521-020-05449-7
 
 # %%
-ghs_50n: xr.DataArray = rioxarray.open_rasterio(
+# Read only the bounding box of Bandar Seri Begawan (EPSG:32650/UTM zone 50N
+# coordinates) instead of the whole 50N tile
+ghs_bsb: xr.DataArray = open_cog_window(
     filename="https://cidportal.jrc.ec.europa.eu/ftp/jrc-opendata/GHSL/GHS_BUILT_S2comp2018_GLOBE_R2020A/GHS_BUILT_S2comp2018_GLOBE_R2020A_UTM_10/V1-0/50N_PROB.tif",
+    bbox=(260_000, 520_000, 300_000, 560_000),  # minx, miny, maxx, maxy
     # masked=True,
-    # overview_level=1,
-)
-
-# %%
-# Clip to bounding box of Bandar Seri Begawan (EPSG:32650/UTM zone 50N coordinates)
-ghs_bsb: xr.DataArray = ghs_50n.rio.clip_box(
-    minx=260_000, maxx=300_000, miny=520_000, maxy=560_000
+    # resolution=20,  # read from the 20m overview for a quick look
 )
 
 # %%
@@ -86,15 +85,33 @@ print(pygmt.grdinfo(grid="ghs_bsb.tif"))
 # refer to https://docs.generic-mapping-tools.org/6.2/gallery/ex28.html
 
 # %%
-# Convert raster grid cells to XYZ table
-df_: pd.DataFrame = pygmt.grd2xyz(grid="ghs_bsb.tif", nodata=0, skiprows=True)
+# Average the 10m raster grid cells into 50mx50m blocks directly on the array,
+# skipping the cells with no data (0), and keep the non-empty blocks as an
+# x, y, z table. The blocks line up with the region, like blockmean's would.
+df: pd.DataFrame = coarsen_raster(
+    dataarray=ghs_bsb,
+    factor=5,
+    statistics=("mean",),
+    nodata=0,
+    output="table",
+    region=[260_000, 300_000, 520_000, 560_000],
+)
+df.describe()
 
 # %%
-# Block average points to 50mx50m cells
-df: pd.DataFrame = pygmt.blockmean(
-    data=df_, spacing="50+e", region=[260_000, 300_000, 520_000, 560_000]
+# Cull the columns to draw. Drop the (almost) empty ones, merge the low ones
+# into bars at least 0.5mm wide on the 1:500000 map, and sort them from back
+# to front as seen from the south, so nearer columns are drawn over farther ones
+columns: pd.DataFrame = cull_columns(
+    data=df,
+    spacing=50,
+    min_height=1,
+    merge_height=10,
+    scale=100 / 500_000,  # cm on the map per metre
+    footprint=0.05,
+    azimuth=180,
 )
-df.describe()
+print(f"Drawing {len(columns)} of {len(df)} columns")
 
 # %%
 fig = pygmt.Figure()
@@ -102,15 +119,19 @@ fig = pygmt.Figure()
 # Plot 3D histogram of built settlement probability
 with pygmt.config(PS_PAGE_COLOR="black"):
     pygmt.makecpt(cmap="batlowK", series=(0, 75, 5))
+    # Draw the merged bars and the 50m columns together, so that they are all
+    # kept in back to front order
     fig.plot3d(
-        data=df[["x", "y", "z", "z"]],
+        data=columns.assign(width=columns["size"] * 100 / 500_000)[
+            ["x", "y", "z", "z", "width"]
+        ],
         region=[260_000, 300_000, 520_000, 560_000, 0, 100],
         projection="x1:500000",
         # frame=['z20+l"Built-up-grid"', "wsNEZ", "af"],
         perspective=[180, 60],  # azimuth, elevation
         zscale=0.005,  # vertical exaggeration
         cmap=True,  # use colormap from makecpt
-        style="o50u",  # 3-D column of size 50 units
+        style="o",  # 3-D column, with its width in cm from the last data column
     )
 
 # Plot title text and some labels
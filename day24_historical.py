@@ -20,12 +20,12 @@
 # Historical data, historical style or something else.
 
 # %%
-import shutil
-import zipfile
-
 import pygmt
 import geopandas as gpd
-import requests
+
+from mapchallenge.archive import read_zipped_vector, vsizip_path
+from mapchallenge.cache import fetch
+from mapchallenge.raster import overview_for_plot
 
 # %% [markdown]
 # ## Download Middle Earth data!
@@ -49,25 +49,24 @@ for file, url in [
         "https://scholarworks.wm.edu/cgi/viewcontent.cgi?filename=0&article=1002&context=asoer&type=additional",
     ),
 ]:
-    response = requests.get(url=url, stream=True)
-    with open(file=file, mode="wb") as out_file:
-        shutil.copyfileobj(response.raw, out_file)
-
-# %%
-# Unzip the files
-for file in ["DEM_50m_Quad1.zip", "Vector_Only_Shapefiles.zip"]:
-    with zipfile.ZipFile(file=file) as z:
-        for zip_info in z.infolist():
-            z.extract(member=zip_info)
+    fetch(url=url, fname=file)
 
 # %%
-# Inspect the metadata of the GeoTIFF file
-print(pygmt.grdinfo(grid="Quad1/DEM_50m_Quad1.tif"))
+# Point to the GeoTIFF file inside the zip file, which GMT reads through GDAL
+# without unzipping it first, and inspect the metadata of the GeoTIFF file
+dem_50m_quad1: str = vsizip_path(
+    archive="DEM_50m_Quad1.zip", member="Quad1/DEM_50m_Quad1.tif"
+)
+print(pygmt.grdinfo(grid=dem_50m_quad1))
 
 # %%
-# Load vector shapefiles into GeoDataFrame
-gdf_towns = gpd.read_file(filename="Vector_Shapefiles/Towns.shp")
-gdf_roads = gpd.read_file(filename="Vector_Shapefiles/Roads.shp")
+# Load vector shapefiles into GeoDataFrame, straight from the zip file
+gdf_towns = read_zipped_vector(
+    archive="Vector_Only_Shapefiles.zip", member="Vector_Shapefiles/Towns.shp"
+)
+gdf_roads = read_zipped_vector(
+    archive="Vector_Only_Shapefiles.zip", member="Vector_Shapefiles/Roads.shp"
+)
 
 # %% [markdown]
 # ## Clip data to The Shire
@@ -121,7 +120,12 @@ fig = pygmt.Figure()
 # Plot DEM
 with pygmt.config(PS_PAGE_COLOR="#f7f3ea"):
     fig.grdimage(
-        grid="Quad1/DEM_50m_Quad1.tif",
+        grid=overview_for_plot(
+            filename=dem_50m_quad1,
+            dpi=50,
+            scale=100 / 200_000,
+            region=[3_060_000, 3_090_000, 2_722_000, 2_740_000],
+        ),
         cmap="copper",
         dpi=50,
         region=[3_060_000, 3_090_000, 2_722_000, 2_740_000],  # Hobbiton
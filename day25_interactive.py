@@ -91,3 +91,18 @@ def view(cmap: str, projection: str):
 
 # %%
 pn.Column(cmap, projection, view)
+
+# %% [markdown]
+# ## (Optional) Sharing a recording of the dashboard
+#
+# A screen recording of the dashboard saved as a GIF is usually a lot
+# bigger than it needs to be, since most of the screen stays the same
+# when toggling the buttons. Re-encoding it with one shared palette and
+# only the changed pixels per frame shrinks it a lot, and saving it as
+# an MP4 or WebP file shrinks it even more.
+
+# %% [raw]
+# from mapchallenge.animation import optimize_animation
+#
+# optimize_animation(src="day25_interactive.gif", dst="day25_interactive_optimized.gif")
+# optimize_animation(src="day25_interactive.gif", dst="day25_interactive.mp4")
@@ -26,13 +26,14 @@
 # [Wikipedia](https://en.wikipedia.org/wiki/Choropleth_map))
 
 # %%
-import zipfile
-
 import geopandas as gpd
 import numpy as np
 import pandas as pd
 import pygmt
 
+from mapchallenge.archive import read_zipped_vector
+from mapchallenge.cache import fetch
+
 # %% [markdown]
 # ## Get NZ COVID-19 vaccine uptake data
 #
@@ -50,7 +51,9 @@ import pygmt
 
 # %%
 df = pd.read_csv(
-    filepath_or_buffer="https://github.com/minhealthnz/nz-covid-data/raw/b7c46bb5dd150f3946c6d5c309ce1f2eb0305cce/vaccine-data/2021-11-24/sa2.csv",
+    filepath_or_buffer=fetch(
+        url="https://github.com/minhealthnz/nz-covid-data/raw/b7c46bb5dd150f3946c6d5c309ce1f2eb0305cce/vaccine-data/2021-11-24/sa2.csv"
+    ),
     skipinitialspace=True,
 )
 
@@ -93,15 +96,11 @@ df = df.set_index(keys="SA2 CODE 2018")  # , verify_integrity=True
 # - https://www.stats.govt.nz/methods/statistical-standard-for-geographic-areas-2018
 
 # %%
-# Unzip the files
-with zipfile.ZipFile(file="statsnzstatistical-area-2-2018-generalised-SHP.zip") as z:
-    for zip_info in z.infolist():
-        z.extract(member=zip_info)
-
-# %%
-# Read SA2 shapefile, and select only rows with AREA > 0
-sa2_areas: gpd.GeoDataFrame = gpd.read_file(
-    filename="statistical-area-2-2018-generalised.shp"
+# Read SA2 shapefile straight from the zip file, and select only rows with
+# AREA > 0
+sa2_areas: gpd.GeoDataFrame = read_zipped_vector(
+    archive="statsnzstatistical-area-2-2018-generalised-SHP.zip",
+    member="statistical-area-2-2018-generalised.shp",
 )
 sa2_areas: gpd.GeoDataFrame = sa2_areas[sa2_areas.LAND_AREA_ > 0]
 
@@ -20,13 +20,14 @@
 # `   `
 
 # %%
-import os
-import zipfile
-
 import fiona
 import geopandas as gpd
 import pygmt
 
+from mapchallenge.archive import read_zipped_vector
+from mapchallenge.cache import fetch
+from mapchallenge.raster import build_overviews, overview_for_plot
+
 # %% [markdown]
 # ## Download Reference Elevation Model of Antarctica
 #
@@ -39,12 +40,22 @@ import pygmt
 
 # %%
 # Download REMA unfilled DEM
-pygmt.which(fname="https://data.pgc.umn.edu/elev/dem/setsm/REMA/mosaic/v1.1/1km/REMA_1km_dem.tif", download=True)
+fetch(
+    url="https://data.pgc.umn.edu/elev/dem/setsm/REMA/mosaic/v1.1/1km/REMA_1km_dem.tif"
+)
 
 # %%
 # Inspect the GeoTIFF file's metadata
 print(pygmt.grdinfo(grid="REMA_1km_dem.tif"))
 
+# %%
+# Build an overview pyramid for the DEM once (in a REMA_1km_dem.tif.ovr file),
+# and get the coarsest level that still has 300 dpi on the 1:30000000 map
+build_overviews(filename="REMA_1km_dem.tif")
+rema_dem: str = overview_for_plot(
+    filename="REMA_1km_dem.tif", dpi=300, scale=100 / 30_000_000
+)
+
 # %% [markdown]
 # ## Download ICESat-2 reference ground tracks
 #
@@ -56,16 +67,16 @@ print(pygmt.grdinfo(grid="REMA_1km_dem.tif"))
 fiona.drvsupport.supported_drivers['LIBKML'] = 'rw' # enable KML support which is disabled by default
 
 # %%
-# Download and unzip KMZ file
-pygmt.which(fname="https://icesat-2.gsfc.nasa.gov/sites/default/files/page_files/antarcticaallorbits.zip", download=True)
-with zipfile.ZipFile(file="antarcticaallorbits.zip") as z:
-    for zip_info in z.infolist():
-        if zip_info.filename.endswith("Antarctica_repeat1_GT7.kmz"):
-            zip_info.filename = os.path.basename(zip_info.filename)
-            z.extract(member=zip_info)
+# Download zip file of KMZ files
+fetch(
+    url="https://icesat-2.gsfc.nasa.gov/sites/default/files/page_files/antarcticaallorbits.zip"
+)
 
 # %%
-gdf: gpd.GeoDataFrame = gpd.read_file("Antarctica_repeat1_GT7.kmz")
+# Read the KMZ file straight from inside the zip file
+gdf: gpd.GeoDataFrame = read_zipped_vector(
+    archive="antarcticaallorbits.zip", pattern="*Antarctica_repeat1_GT7.kmz"
+)
 gdf
 
 # %% [markdown]
@@ -91,7 +102,7 @@ with pygmt.config(
 ):
     # Plot REMA DEM
     fig.grdimage(
-        grid="REMA_1km_dem.tif",
+        grid=rema_dem,
         projection="x1:30000000",
         cmap="fes",
         nan_transparent=True,
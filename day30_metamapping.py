@@ -30,6 +30,8 @@ import fiona
 import geopandas as gpd
 import pygmt
 
+from mapchallenge.cache import fetch
+
 # %% [markdown]
 # ## Download image files
 #
@@ -62,7 +64,8 @@ files = [
     "https://github.com/weiji14/30DayMapChallenge2021/releases/download/v0.3.0/day28_round_earth.png",
     "https://github.com/weiji14/30DayMapChallenge2021/releases/download/v0.3.0/day29_null.png",
 ]
-pygmt.which(fname=files, download=True)
+for url in files:
+    fetch(url=url)
 
 # %% [markdown]
 # ## Make a gallery!
@@ -0,0 +1,6 @@
+"""
+Shared helpers for the #30DayMapChallenge2021 notebooks.
+
+The day-by-day notebooks live at the root of the repository and import the
+reusable data loading and preprocessing pieces from the submodules here.
+"""
@@ -0,0 +1,509 @@
+"""
+Rendering of map animations with PyGMT, one process per frame.
+
+Note that pygmt is imported inside the functions here, so that each worker
+process of :func:`mapchallenge.parallel.gmt_process_pool` can set up its own
+GMT session first.
+"""
+import concurrent.futures
+import functools
+import os
+import subprocess
+
+import numpy as np
+import xarray as xr
+from PIL import Image, ImageSequence
+
+from mapchallenge.parallel import gmt_process_pool
+
+
+def _open_grid(grid):
+    """
+    Turn a frame spec into something pygmt can plot. A (store, variable,
+    time) tuple is read from a Zarr cube, anything else is passed through.
+    """
+    if isinstance(grid, tuple):
+        store, variable, time = grid
+        with xr.open_zarr(store=store, consolidated=True) as cube:
+            return cube[variable].sel(time=time).load()
+    return grid
+
+
+def render_background(
+    fname: str,
+    region: list,
+    projection: str,
+    grid: str = "@earth_night_30m",
+    frame: list = None,
+    dpi: int = 100,
+    config: dict = None,
+) -> str:
+    """
+    Render the static basemap layer of an animation to a PNG file.
+
+    Parameters
+    ----------
+    fname : str
+        Path of the PNG file to save.
+    region : list
+        Map region as [west, east, south, north].
+    projection : str
+        GMT projection, e.g. 'U50Q/20c'.
+    grid : str
+        Background grid or image. Default is '@earth_night_30m'.
+    frame : list
+        Map frame setting, e.g. ['wSnE', 'afg']. Default is None (no frame).
+    dpi : int
+        Resolution of the PNG file. Default is 100.
+    config : dict
+        GMT default parameters to set, e.g. {'PS_PAGE_COLOR': 'black'}.
+
+    Returns
+    -------
+    fname : str
+    """
+    import pygmt
+
+    fig = pygmt.Figure()
+    with pygmt.config(**(config or {})):
+        fig.grdimage(grid=grid, region=region, projection=projection, frame=frame)
+    fig.savefig(fname=fname, dpi=dpi)
+    return fname
+
+
+def render_frame(
+    grid,
+    label: str,
+    fname: str,
+    background: str,
+    region: list,
+    projection: str,
+    frame: list = None,
+    cmap: str = "gray",
+    transparency: int = 50,
+    dpi: int = 100,
+    config: dict = None,
+) -> str:
+    """
+    Render one frame's overlay grid and label with a transparent page, and
+    composite it on top of the pre-rendered background PNG.
+
+    The overlay is drawn with the same map frame as the background, so that
+    both PNG files get cropped to the same bounding box and line up pixel for
+    pixel. The frame is drawn opaque in both, so it looks the same.
+
+    Parameters
+    ----------
+    grid : str or xr.DataArray or tuple
+        Overlay grid, e.g. 'NC_H08_20211011_1200_R21_FLDK.06001_06001.nc?tbb_13',
+        or a (zarr_store, variable, time) tuple to read the frame from a
+        Zarr cube.
+    label : str
+        Text to write at the top centre of the frame, e.g. a timestamp.
+    fname : str
+        Path of the PNG file to save.
+    background : str
+        Path to the background PNG file from :func:`render_background`.
+    region : list
+        Map region as [west, east, south, north].
+    projection : str
+        GMT projection, must be the same as the background's.
+    frame : list
+        Map frame setting, must be the same as the background's.
+    cmap : str
+        Colormap for the overlay grid. Default is 'gray'.
+    transparency : int
+        Transparency of the overlay grid in percent. Default is 50.
+    dpi : int
+        Resolution of the PNG file, must be the same as the background's.
+    config : dict
+        GMT default parameters to set, e.g. {'FONT_ANNOT': 'white'}.
+
+    Returns
+    -------
+    fname : str
+    """
+    import pygmt
+
+    # The page must stay transparent for the background to show through
+    config = {k: v for k, v in (config or {}).items() if k != "PS_PAGE_COLOR"}
+
+    fig = pygmt.Figure()
+    with pygmt.config(**config):
+        fig.grdimage(
+            grid=_open_grid(grid=grid),
+            region=region,
+            projection=projection,
+            cmap=cmap,
+            transparency=transparency,
+        )
+        if frame is not None:
+            fig.basemap(region=region, projection=projection, frame=frame)
+        fig.text(text=label, position="TC", offset="0c/-2c")
+    overlay_png: str = fname.replace(".png", "_overlay.png")
+    fig.savefig(fname=overlay_png, dpi=dpi, transparent=True)
+
+    with Image.open(fp=background) as bg, Image.open(fp=overlay_png) as fg:
+        if fg.size != bg.size:
+            raise ValueError(
+                f"Overlay {overlay_png} is {fg.size} pixels but background "
+                f"{background} is {bg.size} pixels, check that both have the "
+                "same region, projection, frame and dpi."
+            )
+        fg = fg.convert(mode="RGBA")
+        Image.alpha_composite(im1=bg.convert(mode="RGBA"), im2=fg).convert(
+            mode="RGB"
+        ).save(fp=fname)
+    os.remove(path=overlay_png)
+    return fname
+
+
+def render_movie(
+    grids: list,
+    labels: list,
+    fname: str,
+    region: list,
+    projection: str,
+    background_grid: str = "@earth_night_30m",
+    frame: list = None,
+    cmap: str = "gray",
+    transparency: int = 50,
+    dpi: int = 100,
+    displayrate: float = 3,
+    config: dict = None,
+    workdir: str = "frames",
+    max_workers: int = None,
+) -> str:
+    """
+    Render an animation, one frame per grid, in parallel.
+
+    The static background layer is drawn only once. The per-frame overlays
+    are rendered on a process pool with one GMT session per worker, and
+    composited on top of the background, so that the render time drops
+    roughly linearly with the number of CPU cores.
+
+    Parameters
+    ----------
+    grids : list
+        Overlay grid of each frame. See :func:`render_frame`.
+    labels : list
+        Text label of each frame, e.g. timestamps.
+    fname : str
+        Path of the animation to save. The format is picked from the file
+        extension, see :func:`encode_animation`.
+    region : list
+        Map region as [west, east, south, north].
+    projection : str
+        GMT projection, e.g. 'U50Q/20c'.
+    background_grid : str
+        Static background grid or image. Default is '@earth_night_30m'.
+    frame : list
+        Map frame setting, e.g. ['wSnE', 'afg'].
+    cmap : str
+        Colormap for the overlay grids. Default is 'gray'.
+    transparency : int
+        Transparency of the overlay grids in percent. Default is 50.
+    dpi : int
+        Resolution of the frames. Default is 100.
+    displayrate : float
+        Frames per second. Default is 3.
+    config : dict
+        GMT default parameters to set for all layers.
+    workdir : str
+        Directory to save the frame PNG files in. Default is 'frames'.
+    max_workers : int
+        Number of processes. Default is None, which uses all the CPU cores.
+
+    Returns
+    -------
+    fname : str
+    """
+    os.makedirs(workdir, exist_ok=True)
+    background: str = os.path.join(workdir, "background.png")
+    frame_names: list = [
+        os.path.join(workdir, f"frame_{i:04d}.png") for i in range(len(grids))
+    ]
+
+    with gmt_process_pool(max_workers=max_workers) as executor:
+        executor.submit(
+            render_background,
+            fname=background,
+            region=region,
+            projection=projection,
+            grid=background_grid,
+            frame=frame,
+            dpi=dpi,
+            config=config,
+        ).result()
+        frame_pngs: list = list(
+            executor.map(
+                functools.partial(
+                    render_frame,
+                    background=background,
+                    region=region,
+                    projection=projection,
+                    frame=frame,
+                    cmap=cmap,
+                    transparency=transparency,
+                    dpi=dpi,
+                    config=config,
+                ),
+                grids,
+                labels,
+                frame_names,
+            )
+        )
+
+    return encode_animation(
+        frames=frame_pngs, fname=fname, duration=1000 / displayrate
+    )
+
+
+def _open_frame(frame) -> Image.Image:
+    """
+    Open a frame given as a file path or a PIL image as an RGB image.
+    """
+    if isinstance(frame, str):
+        with Image.open(fp=frame) as image:
+            return image.convert(mode="RGB")
+    return frame.convert(mode="RGB")
+
+
+def _global_palette(frames: list, colors: int, sample_frames: int) -> list:
+    """
+    Build one palette for all frames, by quantizing a mosaic of thumbnails of
+    evenly spaced sample frames. Returns a flat [r, g, b, r, g, b, ...] list.
+    """
+    step: int = max(1, len(frames) // sample_frames)
+    thumbnails: list = []
+    for frame in frames[::step][:sample_frames]:
+        image: Image.Image = _open_frame(frame=frame)
+        image.thumbnail(size=(512, 512))
+        thumbnails.append(image)
+
+    mosaic = Image.new(
+        mode="RGB",
+        size=(
+            sum(thumb.width for thumb in thumbnails),
+            max(thumb.height for thumb in thumbnails),
+        ),
+    )
+    x: int = 0
+    for thumb in thumbnails:
+        mosaic.paste(im=thumb, box=(x, 0))
+        x += thumb.width
+    palette: list = mosaic.quantize(colors=colors, method=Image.MEDIANCUT).getpalette()
+    return palette[: 3 * colors]
+
+
+def _quantize_frame(frame, palette: list) -> np.ndarray:
+    """
+    Map a frame onto a fixed palette, returning the palette index array.
+    """
+    palette_image = Image.new(mode="P", size=(1, 1))
+    palette_image.putpalette(data=palette + [0, 0, 0] * (256 - len(palette) // 3))
+    image: Image.Image = _open_frame(frame=frame)
+    return np.asarray(
+        image.quantize(colors=256, palette=palette_image, dither=Image.NONE)
+    )
+
+
+def _encode_gif(
+    frames: list,
+    fname: str,
+    duration,
+    colors: int = 255,
+    sample_frames: int = 8,
+    max_workers: int = None,
+) -> str:
+    """
+    Write frames to a GIF with one global palette, where every frame after
+    the first only stores the pixels that changed since the previous frame.
+    """
+    colors = min(colors, 255)  # reserve one palette index for transparency
+    transparent: int = colors
+    palette: list = _global_palette(
+        frames=frames, colors=colors, sample_frames=sample_frames
+    )
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        indices: list = list(
+            executor.map(functools.partial(_quantize_frame, palette=palette), frames)
+        )
+
+    images: list = []
+    for i, index in enumerate(indices):
+        if i > 0:
+            # Pillow crops each frame to the bounding box of what differs from
+            # the frame before, and unchanged pixels inside that box become
+            # transparent so they compress down to almost nothing
+            index = np.where(index != indices[i - 1], index, transparent)
+        image = Image.fromarray(obj=index.astype(np.uint8), mode="P")
+        image.putpalette(data=palette + [0, 0, 0] * (256 - colors))
+        images.append(image)
+
+    images[0].save(
+        fp=fname,
+        save_all=True,
+        append_images=images[1:],
+        duration=duration,
+        loop=0,
+        transparency=transparent,
+        disposal=1,  # keep the previous frame underneath
+        optimize=False,  # don't let Pillow reorder the shared palette
+    )
+    return fname
+
+
+def _encode_webp(frames: list, fname: str, duration, quality: int = 80) -> str:
+    """
+    Write frames to an animated WebP file with libwebp.
+    """
+    images: list = [_open_frame(frame=frame) for frame in frames]
+    images[0].save(
+        fp=fname,
+        save_all=True,
+        append_images=images[1:],
+        duration=duration,
+        loop=0,
+        quality=quality,
+        method=4,
+    )
+    return fname
+
+
+def _encode_mp4(frames: list, fname: str, fps: float, crf: int = 23) -> str:
+    """
+    Write frames to an H.264 MP4 file, by piping them as PNG images into a
+    multi-threaded ffmpeg process.
+    """
+    command: list = [
+        "ffmpeg",
+        "-loglevel",
+        "error",
+        "-y",
+        "-f",
+        "image2pipe",
+        "-framerate",
+        str(fps),
+        "-i",
+        "-",
+        "-c:v",
+        "libx264",
+        "-crf",
+        str(crf),
+        "-pix_fmt",
+        "yuv420p",
+        # yuv420p needs an even width and height
+        "-vf",
+        "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+        "-threads",
+        "0",
+        fname,
+    ]
+    with subprocess.Popen(args=command, stdin=subprocess.PIPE) as process:
+        for frame in frames:
+            _open_frame(frame=frame).save(fp=process.stdin, format="PNG")
+        process.stdin.close()
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(returncode=process.returncode, cmd=command)
+    return fname
+
+
+def encode_animation(
+    frames: list,
+    fname: str,
+    duration=333,
+    colors: int = 255,
+    sample_frames: int = 8,
+    max_workers: int = None,
+) -> str:
+    """
+    Encode frames into a size-optimized animation.
+
+    The format is picked from the extension of 'fname':
+
+    - '.gif': the frames are quantized in parallel onto one global palette
+      built from a sample of the frames, and every frame after the first only
+      stores the rectangle of pixels that changed, with unchanged pixels set
+      to transparent.
+    - '.webp': lossy animated WebP, usually much smaller than a GIF.
+    - '.mp4': H.264 video encoded with ffmpeg, the smallest option, but it
+      can't be shown inline everywhere a GIF can.
+
+    Parameters
+    ----------
+    frames : list
+        The frames, as paths to image files or as PIL images.
+    fname : str
+        Path of the animation to save.
+    duration : int or list
+        Display time of each frame in milliseconds, either one number for all
+        frames or a list with one number per frame. For MP4 files only one
+        number is supported. Default is 333 (3 frames per second).
+    colors : int
+        Number of colors in the GIF palette, at most 255. Default is 255.
+    sample_frames : int
+        Number of frames to build the GIF palette from. Default is 8.
+    max_workers : int
+        Number of processes to quantize GIF frames with. Default is None,
+        which uses all the CPU cores.
+
+    Returns
+    -------
+    fname : str
+    """
+    extension: str = os.path.splitext(fname)[-1].lower()
+    if extension == ".gif":
+        return _encode_gif(
+            frames=frames,
+            fname=fname,
+            duration=duration,
+            colors=colors,
+            sample_frames=sample_frames,
+            max_workers=max_workers,
+        )
+    if extension == ".webp":
+        return _encode_webp(frames=frames, fname=fname, duration=duration)
+    if extension == ".mp4":
+        if not np.isscalar(duration):
+            raise ValueError("MP4 files need a constant frame duration.")
+        return _encode_mp4(frames=frames, fname=fname, fps=1000 / duration)
+    raise ValueError(f"Unsupported animation format '{extension}'.")
+
+
+def optimize_animation(src: str, dst: str, **kwargs) -> str:
+    """
+    Re-encode an existing GIF animation, e.g. a screen recording or one
+    exported from another tool, with :func:`encode_animation`. The original
+    frame durations are kept.
+
+    Parameters
+    ----------
+    src : str
+        Path of the animated GIF to read.
+    dst : str
+        Path of the animation to save, as a '.gif', '.webp' or '.mp4' file.
+    kwargs
+        Other parameters passed to :func:`encode_animation`.
+
+    Returns
+    -------
+    dst : str
+    """
+    with Image.open(fp=src) as animation:
+        frames: list = []
+        durations: list = []
+        for frame in ImageSequence.Iterator(animation):
+            frames.append(frame.convert(mode="RGB"))
+            durations.append(frame.info.get("duration", 100))
+
+    if dst.lower().endswith(".mp4"):
+        durations = int(np.median(durations))
+    return encode_animation(frames=frames, fname=dst, duration=durations, **kwargs)
+
+
+if __name__ == "__main__":
+    import sys
+
+    optimize_animation(src=sys.argv[1], dst=sys.argv[2])
@@ -0,0 +1,148 @@
+"""
+Read rasters and vector files straight out of zip archives through GDAL's
+/vsizip/ virtual file system, instead of extracting every member to disk.
+"""
+import fnmatch
+import zipfile
+
+import geopandas as gpd
+import rioxarray
+import xarray as xr
+
+from mapchallenge.raster import open_cog_window
+
+
+def find_member(archive: str, pattern: str = "*") -> str:
+    """
+    Get the name of the first file in a zip archive matching a pattern.
+
+    Only the archive's central directory (its table of contents) is read.
+
+    Parameters
+    ----------
+    archive : str
+        Path to the zip file.
+    pattern : str
+        Shell-style wildcard matched against the full member names, e.g.
+        '*.tif' or '*/Towns.shp'. Default is '*'.
+
+    Returns
+    -------
+    member : str
+        Path of the member inside the archive.
+    """
+    with zipfile.ZipFile(file=archive) as z:
+        members: list = sorted(
+            name for name in z.namelist() if fnmatch.fnmatch(name, pattern)
+        )
+    if not members:
+        raise FileNotFoundError(f"No file matching '{pattern}' in {archive}")
+    return members[0]
+
+
+def vsizip_path(archive: str, member: str = None, pattern: str = "*") -> str:
+    """
+    Get a GDAL virtual path to a file inside a zip archive.
+
+    The path can be passed to anything that reads files through GDAL, e.g.
+    rasterio, rioxarray, fiona, geopandas, or GMT, and only the parts of the
+    member that are needed get decompressed.
+
+    Parameters
+    ----------
+    archive : str
+        Path to the zip file. This can be a virtual path itself, e.g. to a
+        KMZ file inside a zip file, in which case member must be given.
+    member : str
+        Path of the file inside the archive. Default is None, which uses the
+        first member matching pattern.
+    pattern : str
+        Shell-style wildcard to find the member with, when member is None.
+        Default is '*'.
+
+    Returns
+    -------
+    path : str
+        A path like '/vsizip/archive.zip/member'.
+    """
+    if member is None:
+        member = find_member(archive=archive, pattern=pattern)
+    if archive.startswith("/vsi"):
+        archive = f"{{{archive}}}"
+    return f"/vsizip/{archive}/{member}"
+
+
+def open_zipped_raster(
+    archive: str,
+    member: str = None,
+    pattern: str = "*.tif",
+    bbox: tuple = None,
+    bbox_crs=None,
+    masked: bool = False,
+    **kwargs,
+) -> xr.DataArray:
+    """
+    Open a raster inside a zip archive, optionally reading only a window.
+
+    Parameters
+    ----------
+    archive : str
+        Path to the zip file.
+    member : str
+        Path of the raster inside the archive. Default is None, which uses
+        the first member matching pattern.
+    pattern : str
+        Shell-style wildcard to find the raster with. Default is '*.tif'.
+    bbox : tuple
+        Bounding box as (minx, miny, maxx, maxy). If given, only the blocks
+        of the raster inside it are decompressed and loaded into memory.
+        Default is None, which opens the whole raster lazily.
+    bbox_crs : str or rasterio.crs.CRS
+        Coordinate reference system of the bounding box. Default is None,
+        meaning that the bounding box is in the raster's CRS.
+    masked : bool
+        If True, set nodata values to NaN. Default is False.
+    kwargs
+        Extra arguments passed to ``rioxarray.open_rasterio``.
+
+    Returns
+    -------
+    dataarray : xr.DataArray
+    """
+    path: str = vsizip_path(archive=archive, member=member, pattern=pattern)
+    if bbox is None:
+        return rioxarray.open_rasterio(filename=path, masked=masked, **kwargs)
+    return open_cog_window(
+        filename=path, bbox=bbox, bbox_crs=bbox_crs, masked=masked, **kwargs
+    )
+
+
+def read_zipped_vector(
+    archive: str, member: str = None, pattern: str = "*.shp", **kwargs
+) -> gpd.GeoDataFrame:
+    """
+    Read a vector file (e.g. a shapefile) inside a zip archive.
+
+    The sidecar files of a shapefile (.dbf, .shx, .prj, etc) are read from
+    the same folder inside the archive.
+
+    Parameters
+    ----------
+    archive : str
+        Path to the zip file.
+    member : str
+        Path of the vector file inside the archive. Default is None, which
+        uses the first member matching pattern.
+    pattern : str
+        Shell-style wildcard to find the vector file with. Default is
+        '*.shp'.
+    kwargs
+        Extra arguments passed to ``geopandas.read_file``, e.g. bbox to only
+        read features intersecting a bounding box.
+
+    Returns
+    -------
+    geodataframe : gpd.GeoDataFrame
+    """
+    path: str = vsizip_path(archive=archive, member=member, pattern=pattern)
+    return gpd.read_file(filename=path, **kwargs)
@@ -0,0 +1,377 @@
+"""
+Block reduction of xyz points onto a regular grid with NumPy, as an
+in-process alternative to GMT's blockmean/blockmedian modules.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+STATISTICS: tuple = ("mean", "sum", "min", "max", "quantile")
+
+
+class BlockReducer:
+    """
+    Reduce xyz points to one value per grid cell (block), incrementally.
+
+    Points are binned with integer cell indices, sorted by cell, and each
+    run of points in the same cell is reduced in one vectorized step. Points
+    can be fed in chunks with :meth:`update`. For the mean, sum, min and max,
+    only the per-cell results are kept between chunks, so memory depends on
+    the grid size and not on the number of points.
+
+    Quantiles can't be combined from per-chunk quantiles, so for those a
+    fixed-size sketch of each cell is kept instead: its tail_size lowest and
+    tail_size highest z values, merged with every new chunk. Memory is
+    2 * tail_size * 8 bytes per cell, however many points there are. A
+    quantile is exact when its rank is among the kept values, e.g. the 0.99
+    quantile of cells with up to 3200 points, or any quantile of cells with
+    up to 2 * tail_size points. Otherwise it is estimated by interpolating
+    linearly on the rank between the innermost kept values, so it always
+    lies between the tail_size-th lowest and highest values of the cell.
+
+    Mean, sum, min and max are exact however the points are chunked. Quantiles are
+    linearly interpolated between the two nearest ranks, which is not
+    necessarily how GMT's ``blockmedian -T`` picks them, so the results can
+    differ slightly from blockmedian's.
+
+    Parameters
+    ----------
+    region : list
+        Grid bounds as [West, East, South, North]. Points outside are dropped.
+    spacing : float
+        Size of each cell.
+    statistic : str
+        One of 'mean', 'sum', 'min', 'max' or 'quantile'. Default is 'mean'.
+    quantile : float
+        Quantile between 0 and 1 when statistic is 'quantile', e.g. 0.5 for
+        the median, or 0.99 for a high point that ignores a few outliers.
+        Default is 0.5.
+    tail_size : int
+        Number of the lowest and of the highest z values to keep for each
+        cell when statistic is 'quantile'. Default is 32.
+    """
+
+    def __init__(
+        self,
+        region: list,
+        spacing: float,
+        statistic: str = "mean",
+        quantile: float = 0.5,
+        tail_size: int = 32,
+    ):
+        if statistic not in STATISTICS:
+            raise ValueError(f"statistic must be one of {STATISTICS}, not {statistic}")
+        self.west, self.east, self.south, self.north = region
+        self.spacing: float = spacing
+        self.statistic: str = statistic
+        self.quantile: float = quantile
+        self.tail_size: int = tail_size
+
+        self.ncols: int = int(round((self.east - self.west) / spacing))
+        self.nrows: int = int(round((self.north - self.south) / spacing))
+        self.count: np.ndarray = np.zeros(self.nrows * self.ncols, dtype=np.int64)
+        fill: float = {"min": np.inf, "max": -np.inf}.get(statistic, 0.0)
+        self.value: np.ndarray = np.full(self.nrows * self.ncols, fill_value=fill)
+        if statistic == "quantile":
+            # Lowest values of each cell in ascending order, padded with inf at
+            # the end, and highest values in ascending order, padded with -inf
+            # at the start
+            shape: tuple = (self.nrows * self.ncols, tail_size)
+            self._low: np.ndarray = np.full(shape=shape, fill_value=np.inf)
+            self._high: np.ndarray = np.full(shape=shape, fill_value=-np.inf)
+
+    def _cell_index(self, x: np.ndarray, y: np.ndarray) -> tuple:
+        """
+        Get the flat cell index of each point, with row 0 at the north, and a
+        mask of the points inside the region. Points right on the east or
+        south edge go into the last column or row.
+        """
+        col: np.ndarray = np.floor((x - self.west) / self.spacing).astype(np.int64)
+        row: np.ndarray = np.floor((self.north - y) / self.spacing).astype(np.int64)
+        inside: np.ndarray = (
+            (x >= self.west) & (x <= self.east) & (y >= self.south) & (y <= self.north)
+        )
+        np.clip(col, a_min=0, a_max=self.ncols - 1, out=col)
+        np.clip(row, a_min=0, a_max=self.nrows - 1, out=row)
+        return row * self.ncols + col, inside
+
+    def update(self, xyz: np.ndarray):
+        """
+        Add a chunk of points.
+
+        Parameters
+        ----------
+        xyz : np.ndarray
+            Array of shape (n, 3) with x, y, z columns. Points with a NaN z
+            value are skipped.
+        """
+        cell, inside = self._cell_index(x=xyz[:, 0], y=xyz[:, 1])
+        z: np.ndarray = xyz[:, 2]
+        keep: np.ndarray = inside & ~np.isnan(z)
+        cell, z = cell[keep], z[keep]
+        if len(cell) == 0:
+            return
+        if self.statistic == "quantile":
+            self._update_tails(cell=cell, z=z)
+            self.count += np.bincount(cell, minlength=len(self.count))
+            return
+
+        # Sort by cell, then find where each run of points in the same cell
+        # starts
+        order: np.ndarray = np.argsort(cell, kind="stable")
+        cell, z = cell[order], z[order]
+        starts: np.ndarray = np.flatnonzero(np.r_[True, cell[1:] != cell[:-1]])
+        counts: np.ndarray = np.diff(np.r_[starts, len(cell)])
+        cells: np.ndarray = cell[starts]
+
+        if self.statistic in ("mean", "sum"):
+            self.value[cells] += np.add.reduceat(z, starts)
+        elif self.statistic == "min":
+            self.value[cells] = np.fmin(
+                self.value[cells], np.minimum.reduceat(z, starts)
+            )
+        elif self.statistic == "max":
+            self.value[cells] = np.fmax(
+                self.value[cells], np.maximum.reduceat(z, starts)
+            )
+        self.count[cells] += counts
+
+    def _update_tails(self, cell: np.ndarray, z: np.ndarray):
+        """
+        Merge a chunk of points into the lowest and highest values kept for
+        each cell.
+        """
+        k: int = self.tail_size
+        touched: np.ndarray = np.unique(cell)
+        for tail, lowest in ((self._low, True), (self._high, False)):
+            kept: np.ndarray = tail[touched]
+            filled: np.ndarray = np.isfinite(kept)
+            cells: np.ndarray = np.r_[np.repeat(touched, k)[filled.ravel()], cell]
+            values: np.ndarray = np.r_[kept[filled], z]
+
+            # Sort by cell then value, and get the rank of each value in its cell
+            order: np.ndarray = np.lexsort(keys=(values, cells))
+            cells, values = cells[order], values[order]
+            starts: np.ndarray = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+            counts: np.ndarray = np.diff(np.r_[starts, len(cells)])
+            rank: np.ndarray = np.arange(len(cells)) - np.repeat(starts, counts)
+            if lowest:
+                slot: np.ndarray = rank
+            else:
+                slot = k - np.repeat(counts, counts) + rank
+            keep: np.ndarray = (slot >= 0) & (slot < k)
+
+            tail[touched] = np.inf if lowest else -np.inf
+            tail[cells[keep], slot[keep]] = values[keep]
+
+    def _rank_value(self, cells: np.ndarray, rank: np.ndarray) -> np.ndarray:
+        """
+        Get the z value at a rank (0 being the lowest) in each cell, from the
+        kept values, or estimated between them when the rank isn't kept.
+        """
+        k: int = self.tail_size
+        count: np.ndarray = self.count[cells]
+        value: np.ndarray = np.empty(shape=len(cells))
+        low: np.ndarray = rank < k
+        value[low] = self._low[cells[low], rank[low]]
+        high: np.ndarray = ~low & (rank >= count - k)
+        value[high] = self._high[cells[high], rank[high] - count[high] + k]
+        middle: np.ndarray = ~low & ~high
+        below: np.ndarray = self._low[cells[middle], k - 1]
+        above: np.ndarray = self._high[cells[middle], 0]
+        fraction: np.ndarray = (rank[middle] - k + 1) / (count[middle] - 2 * k + 1)
+        value[middle] = below + (above - below) * fraction
+        return value
+
+    def _quantiles(self):
+        """
+        Work out the quantile of every non-empty cell from its kept values.
+        """
+        cells: np.ndarray = np.flatnonzero(self.count)
+        # Linear interpolation between the two nearest ranks in each cell
+        position: np.ndarray = self.quantile * (self.count[cells] - 1)
+        lower: np.ndarray = np.floor(position).astype(np.int64)
+        upper: np.ndarray = np.ceil(position).astype(np.int64)
+        fraction: np.ndarray = position - lower
+        self.value[cells] = self._rank_value(cells=cells, rank=lower) * (
+            1 - fraction
+        ) + self._rank_value(cells=cells, rank=upper) * fraction
+
+    def _values(self) -> np.ndarray:
+        """
+        Get the reduced value of every cell, NaN where there were no points.
+        """
+        if self.statistic == "quantile":
+            self._quantiles()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if self.statistic == "mean":
+                values: np.ndarray = self.value / self.count
+            else:
+                values = self.value.copy()
+        values[self.count == 0] = np.nan
+        return values
+
+    def to_grid(self) -> xr.DataArray:
+        """
+        Get the reduced values as a grid, with cell centre coordinates.
+
+        Returns
+        -------
+        grid : xr.DataArray
+            A 2D (y, x) grid, with NaN in cells without any points.
+        """
+        half: float = self.spacing / 2
+        return xr.DataArray(
+            data=self._values().reshape(self.nrows, self.ncols),
+            dims=("y", "x"),
+            coords={
+                "y": self.north - half - self.spacing * np.arange(self.nrows),
+                "x": self.west + half + self.spacing * np.arange(self.ncols),
+            },
+        )
+
+    def to_xyz(self) -> np.ndarray:
+        """
+        Get the reduced values as an xyz table of the non-empty cells.
+
+        Returns
+        -------
+        xyz : np.ndarray
+            Array of shape (n, 3) with the x, y coordinates of the cell centres
+            and the reduced z value.
+        """
+        cells: np.ndarray = np.flatnonzero(self.count)
+        row, col = np.divmod(cells, self.ncols)
+        half: float = self.spacing / 2
+        return np.column_stack(
+            [
+                self.west + half + self.spacing * col,
+                self.north - half - self.spacing * row,
+                self._values()[cells],
+            ]
+        )
+
+
+def block_reduce(
+    data: np.ndarray,
+    region: list,
+    spacing: float,
+    statistic: str = "mean",
+    quantile: float = 0.5,
+    output: str = "xyz",
+):
+    """
+    Reduce xyz points to one value per grid cell in a single call.
+
+    See :class:`BlockReducer` for the parameters, and to reduce points in
+    chunks.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Array of shape (n, 3) with x, y, z columns.
+    output : str
+        Either 'xyz' to get an (n, 3) array of the non-empty cells, or 'grid'
+        to get an xr.DataArray grid. Default is 'xyz'.
+
+    Returns
+    -------
+    reduced : np.ndarray or xr.DataArray
+    """
+    reducer = BlockReducer(
+        region=region, spacing=spacing, statistic=statistic, quantile=quantile
+    )
+    reducer.update(xyz=np.asarray(data, dtype=np.float64))
+    return reducer.to_grid() if output == "grid" else reducer.to_xyz()
+
+
+def cull_columns(
+    data: pd.DataFrame,
+    spacing: float,
+    min_height: float = 0,
+    merge_height: float = None,
+    scale: float = None,
+    footprint: float = 0.1,
+    azimuth: float = 180,
+) -> pd.DataFrame:
+    """
+    Reduce the number of 3D histogram columns to draw with plot3d.
+
+    Columns lower than min_height are dropped. Columns lower than
+    merge_height are merged into coarser bars, each at least footprint wide
+    on the plot, while the taller columns are kept as they are. A merged bar
+    is as high as the low columns in it averaged over its whole footprint,
+    i.e. their sum divided by the number of columns that fit in the bar,
+    with empty places counting as 0, so that a few low columns don't turn
+    into a big block. Merged bars lower than min_height are dropped too. The
+    columns are then sorted from the farthest to the nearest as seen from
+    the azimuth, so that nearer columns are drawn on top of farther ones
+    (painter's algorithm).
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Table with x, y and z columns, one row per column centre.
+    spacing : float
+        Width of each column, in data units.
+    min_height : float
+        Columns with a z value below this are dropped. Default is 0.
+    merge_height : float
+        Columns with a z value below this (but not below min_height) are
+        merged into coarser bars. Default is None, which doesn't merge.
+    scale : float
+        Plot length per data unit, e.g. 1 / 500_000 * 100 for a 1:500000
+        map in cm. Required when merge_height is set.
+    footprint : float
+        Minimum width of a merged bar on the plot, in the same length unit
+        as scale. Default is 0.1 (i.e. 1mm for cm).
+    azimuth : float
+        View azimuth, as in plot3d's perspective. Default is 180 (from the
+        south).
+
+    Returns
+    -------
+    columns : pd.DataFrame
+        Table with x, y, z and size columns, where size is the width of each
+        column in data units. Draw them all in one plot3d call, so that the
+        columns of different sizes stay in back to front order, e.g. with
+        style="o" and the size (converted to plot units) as the last column.
+    """
+    data = data.loc[data["z"] >= min_height, ["x", "y", "z"]]
+    data = data.assign(size=float(spacing))
+
+    if merge_height is not None:
+        low: pd.Series = data["z"] < merge_height
+        factor: int = max(1, math.ceil(round(footprint / (spacing * scale), 6)))
+        if factor > 1 and low.any():
+            coarse: float = spacing * factor
+            west: float = data["x"].min() - spacing / 2
+            north: float = data["y"].max() + spacing / 2
+            ncols: int = math.ceil((data["x"].max() + spacing / 2 - west) / coarse)
+            nrows: int = math.ceil((north - data["y"].min() + spacing / 2) / coarse)
+            merged: np.ndarray = block_reduce(
+                data=data.loc[low, ["x", "y", "z"]].to_numpy(),
+                region=[west, west + ncols * coarse, north - nrows * coarse, north],
+                spacing=coarse,
+                statistic="sum",
+            )
+            merged[:, 2] /= factor ** 2
+            merged = merged[merged[:, 2] >= min_height]
+            data = pd.concat(
+                objs=[
+                    pd.DataFrame(data=merged, columns=["x", "y", "z"]).assign(
+                        size=coarse
+                    ),
+                    data.loc[~low],
+                ],
+                ignore_index=True,
+            )
+
+    # Distance along the direction towards the viewer, lowest (farthest) first
+    angle: float = math.radians(azimuth)
+    x, y = data["x"].to_numpy(), data["y"].to_numpy()
+    toward_viewer: np.ndarray = x * math.sin(angle) + y * math.cos(angle)
+    order: np.ndarray = np.argsort(toward_viewer, kind="stable")
+    return data.iloc[order].reset_index(drop=True)
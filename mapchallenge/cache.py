@@ -0,0 +1,410 @@
+"""
+Local caching of downloaded input files and of grids derived from them, so
+that re-running a notebook reads from disk instead of the network, and
+doesn't redo slow preprocessing steps.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import numcodecs
+import requests
+import xarray as xr
+
+# Environment variables to configure the default cache
+CACHE_DIR_ENV: str = "MAPCHALLENGE_CACHE_DIR"
+CACHE_QUOTA_ENV: str = "MAPCHALLENGE_CACHE_QUOTA"  # in bytes
+OFFLINE_ENV: str = "MAPCHALLENGE_OFFLINE"
+
+
+class DownloadCache:
+    """
+    Content-addressed cache of downloaded files.
+
+    Downloads are stored under ``{cache_dir}/objects/{sha256}``, so identical
+    files from different URLs are only kept once. An ``index.json`` file maps
+    each URL to its content hash and the ETag, Last-Modified and size headers
+    from the server, which are used to revalidate the cached copy with a
+    conditional request on the next fetch. When the total size of the cache
+    goes over the quota, the least recently used files are evicted.
+
+    The cached files are made read-only, and their content is checked
+    against the stored hash before being served (once per session, or again
+    if the file changed since), so a corrupted copy is downloaded again.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory to store the cached files in. Default is None, which uses
+        the MAPCHALLENGE_CACHE_DIR environment variable, falling back to
+        ``~/.cache/30daymapchallenge``.
+    quota : int
+        Maximum total size of the cached files in bytes. Default is None,
+        which uses the MAPCHALLENGE_CACHE_QUOTA environment variable, or no
+        limit if that is unset.
+    offline : bool
+        If True, never touch the network, and only serve files that are
+        already cached. Default is None, which is True if the
+        MAPCHALLENGE_OFFLINE environment variable is set to a non-empty value.
+    timeout : float
+        Seconds to wait for the server to respond. Default is 60.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        quota: int = None,
+        offline: bool = None,
+        timeout: float = 60,
+    ):
+        self.cache_dir: str = os.path.abspath(
+            cache_dir
+            or os.environ.get(CACHE_DIR_ENV)
+            or os.path.join(os.path.expanduser("~"), ".cache", "30daymapchallenge")
+        )
+        if quota is None and os.environ.get(CACHE_QUOTA_ENV):
+            quota = int(os.environ[CACHE_QUOTA_ENV])
+        self.quota: int = quota
+        self.offline: bool = (
+            bool(os.environ.get(OFFLINE_ENV)) if offline is None else offline
+        )
+        self.timeout: float = timeout
+
+        self.objects_dir: str = os.path.join(self.cache_dir, "objects")
+        self.index_path: str = os.path.join(self.cache_dir, "index.json")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # (mtime, size) of each object when its hash was last checked
+        self._verified: dict = {}
+
+    def _load_index(self) -> dict:
+        try:
+            with open(file=self.index_path, mode="r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self, index: dict):
+        # Write to a temporary file first, so a crash never leaves a broken index
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".json")
+        with os.fdopen(fd, mode="w") as f:
+            json.dump(index, f, indent=1)
+        os.replace(src=tmp_path, dst=self.index_path)
+
+    def _object_path(self, sha256: str) -> str:
+        return os.path.join(self.objects_dir, sha256)
+
+    def _is_cached(self, entry: dict) -> bool:
+        """
+        Check that the cached file exists and that its content still matches
+        its hash. The hash is only recomputed if the file's modification time
+        or size changed since it was last checked.
+        """
+        path: str = self._object_path(sha256=entry["sha256"])
+        if not os.path.exists(path):
+            return False
+        stat: os.stat_result = os.stat(path)
+        if stat.st_size != entry["size"]:
+            return False
+        if self._verified.get(entry["sha256"]) == (stat.st_mtime_ns, stat.st_size):
+            return True
+
+        sha256 = hashlib.sha256()
+        with open(file=path, mode="rb") as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b""):
+                sha256.update(chunk)
+        if sha256.hexdigest() != entry["sha256"]:
+            return False
+        self._verified[entry["sha256"]] = (stat.st_mtime_ns, stat.st_size)
+        return True
+
+    def _store(self, response: requests.Response) -> dict:
+        """
+        Stream a response body into the cache, hashing it on the way.
+        """
+        sha256 = hashlib.sha256()
+        size: int = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, mode="wb") as f:
+                for chunk in response.iter_content(chunk_size=2 ** 20):
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            # Make the cached copy read-only, so it can't be edited by accident
+            os.chmod(tmp_path, 0o444)
+            path: str = self._object_path(sha256=sha256.hexdigest())
+            os.replace(src=tmp_path, dst=path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        stat: os.stat_result = os.stat(path)
+        self._verified[sha256.hexdigest()] = (stat.st_mtime_ns, stat.st_size)
+
+        return {
+            "sha256": sha256.hexdigest(),
+            "size": size,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+    def _unchanged(self, response: requests.Response, entry: dict) -> bool:
+        """
+        Compare the validators of a 200 response against the cached entry, for
+        servers that ignore conditional request headers.
+        """
+        if response.status_code == 304:
+            return True
+        checks: list = [
+            (response.headers.get("ETag"), entry.get("etag")),
+            (response.headers.get("Last-Modified"), entry.get("last_modified")),
+            (response.headers.get("Content-Length"), str(entry["size"])),
+        ]
+        known: list = [(new, old) for new, old in checks if new and old]
+        return bool(known) and all(new == old for new, old in known)
+
+    def _evict(self, index: dict, keep: str) -> dict:
+        """
+        Remove the least recently used files until the cache fits in the quota.
+        The file with the 'keep' hash is never removed.
+        """
+        if self.quota is None:
+            return index
+
+        sizes: dict = {entry["sha256"]: entry["size"] for entry in index.values()}
+        total: int = sum(sizes.values())
+        for url, entry in sorted(index.items(), key=lambda kv: kv[1]["last_access"]):
+            if total <= self.quota:
+                break
+            sha256: str = entry["sha256"]
+            if sha256 == keep:
+                continue
+            del index[url]
+            if not any(other["sha256"] == sha256 for other in index.values()):
+                if os.path.exists(self._object_path(sha256=sha256)):
+                    os.remove(self._object_path(sha256=sha256))
+                total -= sizes[sha256]
+        return index
+
+    def get(self, url: str, params: dict = None) -> str:
+        """
+        Return the path to the cached copy of a URL, downloading or
+        revalidating it first if needed.
+
+        Parameters
+        ----------
+        url : str
+            The http(s) URL to download.
+        params : dict
+            Query string parameters to add to the URL.
+
+        Returns
+        -------
+        path : str
+            Path to the file inside the cache directory. Don't modify it!
+        """
+        url = requests.Request(method="GET", url=url, params=params).prepare().url
+        with self._lock:
+            entry: dict = self._load_index().get(url)
+        cached: bool = entry is not None and self._is_cached(entry=entry)
+
+        if self.offline:
+            if not cached:
+                raise FileNotFoundError(f"{url} is not cached and offline mode is on.")
+        else:
+            headers: dict = {}
+            if cached and entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if cached and entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            try:
+                with requests.get(
+                    url=url, headers=headers, stream=True, timeout=self.timeout
+                ) as response:
+                    if not (cached and self._unchanged(response=response, entry=entry)):
+                        response.raise_for_status()
+                        entry = self._store(response=response)
+            except (requests.ConnectionError, requests.Timeout):
+                # Fall back to the cached copy if the server is unreachable
+                if not cached:
+                    raise
+
+        with self._lock:
+            index: dict = self._load_index()
+            index[url] = {**entry, "last_access": time.time()}
+            self._save_index(index=self._evict(index=index, keep=entry["sha256"]))
+        return self._object_path(sha256=entry["sha256"])
+
+    def fetch(self, url: str, fname: str = None, params: dict = None) -> str:
+        """
+        Get a cached copy of a URL and place it in the current directory.
+
+        The file is copied out of the cache, so that editing it in place
+        doesn't change the cached copy. The copy gets the modification time of
+        the cached file, and isn't copied again on the next fetch while its
+        size and modification time still match.
+
+        Parameters
+        ----------
+        url : str
+            The http(s) URL to download.
+        fname : str
+            Name of the local file. Default is None, which uses the last part
+            of the URL path.
+        params : dict
+            Query string parameters to add to the URL.
+
+        Returns
+        -------
+        fname : str
+            Name of the local file.
+        """
+        path: str = self.get(url=url, params=params)
+        if fname is None:
+            fname = os.path.basename(urllib.parse.urlparse(url).path)
+
+        cached: os.stat_result = os.stat(path)
+        if os.path.exists(fname):
+            local: os.stat_result = os.stat(fname)
+            # Hard links made by older versions are replaced with copies
+            if not os.path.samestat(local, cached) and (
+                local.st_size,
+                local.st_mtime_ns,
+            ) == (cached.st_size, cached.st_mtime_ns):
+                return fname
+            os.remove(fname)
+        shutil.copyfile(src=path, dst=fname)
+        os.utime(fname, ns=(cached.st_atime_ns, cached.st_mtime_ns))
+        return fname
+
+
+class GridCache:
+    """
+    Cache of derived grids, e.g. DEMs that were reprojected and clipped.
+
+    Each grid is stored as a chunked, zstd compressed Zarr store under
+    ``{cache_dir}/grids/``, named after a hash of the parameters that
+    produced it. On a cache hit, the grid is opened lazily, so only the
+    chunks that are actually used get read and decompressed.
+
+    The grid's GMT type (Cartesian or geographic) and registration (gridline
+    or pixel) from PyGMT's ``.gmt`` accessor are saved alongside, and set
+    again on load, so that e.g. a longitude/latitude grid isn't treated as
+    Cartesian by GMT after the round trip.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory to store the cached grids in. Default is None, which uses
+        the same directory as :class:`DownloadCache`.
+    chunk_size : int
+        Size of the chunks along the y and x dimensions. Default is 512.
+    """
+
+    def __init__(self, cache_dir: str = None, chunk_size: int = 512):
+        self.grids_dir: str = os.path.join(
+            os.path.abspath(
+                cache_dir
+                or os.environ.get(CACHE_DIR_ENV)
+                or os.path.join(os.path.expanduser("~"), ".cache", "30daymapchallenge")
+            ),
+            "grids",
+        )
+        self.chunk_size: int = chunk_size
+        os.makedirs(self.grids_dir, exist_ok=True)
+
+    def _store_path(self, key: dict) -> str:
+        digest: str = hashlib.sha256(
+            json.dumps(key, sort_keys=True, default=str).encode()
+        ).hexdigest()
+        return os.path.join(self.grids_dir, f"{digest[:32]}.zarr")
+
+    def _is_cached(self, store: str) -> bool:
+        """
+        Check that the store was fully written, and has the GMT grid type
+        (stores from before it was saved get recomputed).
+        """
+        if not os.path.exists(os.path.join(store, ".zmetadata")):
+            return False
+        with open(file=os.path.join(store, ".zattrs"), mode="r") as f:
+            return "gmt_gtype" in json.load(f)
+
+    def get(self, compute, **key) -> xr.DataArray:
+        """
+        Get a cached grid, or compute and cache it on a miss.
+
+        Parameters
+        ----------
+        compute : callable
+            Function without arguments that returns the grid as an
+            xr.DataArray. Only called on a cache miss.
+        key
+            Everything that the grid depends on, e.g. dataset="earth_relief",
+            resolution="01s", region=[169.8, 170.5, -43.8, -43.3],
+            dst_crs="EPSG:2193", dst_resolution=25, resampling="nearest".
+            These must be JSON serializable.
+
+        Returns
+        -------
+        grid : xr.DataArray
+        """
+        import pygmt  # registers the .gmt accessor
+
+        store: str = self._store_path(key=key)
+        if not self._is_cached(store=store):
+            grid: xr.DataArray = compute()
+            name: str = grid.name or "z"
+            dataset: xr.Dataset = grid.to_dataset(name=name)
+            dataset[name].encoding = {}
+            dataset.attrs["cache_key"] = json.dumps(key, sort_keys=True, default=str)
+            dataset.attrs["gmt_gtype"] = int(grid.gmt.gtype)
+            dataset.attrs["gmt_registration"] = int(grid.gmt.registration)
+            encoding: dict = {
+                name: {
+                    "chunks": tuple(
+                        min(self.chunk_size, n) if dim in grid.dims[-2:] else 1
+                        for dim, n in zip(grid.dims, grid.shape)
+                    ),
+                    "compressor": numcodecs.Blosc(
+                        cname="zstd", clevel=5, shuffle=numcodecs.Blosc.BITSHUFFLE
+                    ),
+                }
+            }
+            # Write to a temporary store first, so a crash never leaves a
+            # half-written grid behind that looks like a cache hit
+            tmp_store: str = tempfile.mkdtemp(dir=self.grids_dir, suffix=".zarr")
+            dataset.to_zarr(
+                store=tmp_store, mode="w", encoding=encoding, consolidated=True
+            )
+            shutil.rmtree(store, ignore_errors=True)
+            os.replace(src=tmp_store, dst=store)
+
+        dataset = xr.open_zarr(store=store, consolidated=True, chunks=None)
+        grid = dataset[list(dataset.data_vars)[0]]
+        grid.gmt.gtype = dataset.attrs.get("gmt_gtype", 0)
+        grid.gmt.registration = dataset.attrs.get("gmt_registration", 0)
+        return grid
+
+
+_default_cache: DownloadCache = None
+
+
+def fetch(url: str, fname: str = None, params: dict = None) -> str:
+    """
+    Download a file through the default :class:`DownloadCache` into the
+    current directory, and return its name.
+
+    See :meth:`DownloadCache.fetch` for the parameters. The default cache is
+    configured with the MAPCHALLENGE_CACHE_DIR, MAPCHALLENGE_CACHE_QUOTA and
+    MAPCHALLENGE_OFFLINE environment variables.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = DownloadCache()
+    return _default_cache.fetch(url=url, fname=fname, params=params)
@@ -0,0 +1,577 @@
+"""
+Download and preprocessing of Himawari-8 NetCDF files from the JAXA P-Tree
+FTP server.
+"""
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import os
+import time
+import typing
+
+import aioftp
+import numcodecs
+import numpy as np
+import pandas as pd
+import rioxarray
+import xarray as xr
+
+logger = logging.getLogger(__name__)
+
+# Index slices of each region, worked out from the first file converted in
+# this process. All the full disk files share the same grid.
+_region_indices_cache: dict = {}
+
+
+class FetchResult(typing.NamedTuple):
+    """
+    Summary of one downloaded file.
+    """
+
+    path: str  # local path to the file
+    nbytes: int  # number of bytes transferred, excluding resumed bytes
+    seconds: float  # wall time spent transferring
+
+    @property
+    def throughput(self) -> float:
+        """
+        Transfer rate in MB/s.
+        """
+        return self.nbytes / 1e6 / self.seconds if self.seconds > 0 else 0.0
+
+
+def _is_permanent(error: Exception) -> bool:
+    """
+    Check if an error is a permanent FTP failure (5xx reply, e.g. file not
+    found) that should not be retried.
+    """
+    return isinstance(error, aioftp.StatusCodeError) and any(
+        str(code).startswith("5") for code in error.received_codes
+    )
+
+
+class FTPFetcher:
+    """
+    Download files over FTP through a fixed-size pool of logged-in sessions.
+
+    Sessions are logged in lazily and reused across files, instead of doing
+    a new login for every file. Failed transfers are retried with exponential
+    backoff, and resume from the end of the partially downloaded ``.part``
+    file using a REST offset. Permanent errors (5xx replies, e.g. a missing
+    file) are raised straight away, and keep the session in the pool.
+
+    Use it as an async context manager, so that the sessions are closed
+    at the end::
+
+        async with FTPFetcher(host=..., user=..., password=...) as fetcher:
+            results = await fetcher.fetch_all(paths=[...])
+
+    Parameters
+    ----------
+    host : str
+        FTP server hostname.
+    user : str
+        FTP username.
+    password : str
+        FTP password.
+    port : int
+        FTP server port. Default is 21.
+    pool_size : int
+        Maximum number of logged-in sessions. Default is 4.
+    max_concurrency : int
+        Maximum number of files to download at the same time. Default is None,
+        which is the same as the pool_size.
+    max_retries : int
+        Number of times to retry a failed download. Default is 3.
+    backoff : float
+        Seconds to wait before the first retry, doubling on every retry.
+        Default is 1.
+    dest_dir : str
+        Directory to save the files to. Default is the current directory.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        user: str,
+        password: str,
+        port: int = 21,
+        pool_size: int = 4,
+        max_concurrency: int = None,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        dest_dir: str = ".",
+    ):
+        self.host: str = host
+        self.user: str = user
+        self.password: str = password
+        self.port: int = port
+        self.pool_size: int = pool_size
+        self.max_concurrency: int = max_concurrency or pool_size
+        self.max_retries: int = max_retries
+        self.backoff: float = backoff
+        self.dest_dir: str = dest_dir
+
+        self._idle: asyncio.Queue = None
+        self._semaphore: asyncio.Semaphore = None
+        self._num_sessions: int = 0
+
+    async def __aenter__(self):
+        # Create these inside the running event loop
+        self._idle = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(value=self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _acquire(self) -> aioftp.Client:
+        """
+        Get an idle logged-in session, logging in a new one if the pool is not
+        full yet, or else waiting for one to be released.
+        """
+        while True:
+            if self._idle.empty() and self._num_sessions < self.pool_size:
+                self._num_sessions += 1
+                client = aioftp.Client()
+                try:
+                    await client.connect(host=self.host, port=self.port)
+                    await client.login(user=self.user, password=self.password)
+                except Exception:
+                    self._num_sessions -= 1
+                    client.close()
+                    raise
+                return client
+            client = await self._idle.get()
+            if client is not None:
+                return client
+
+    def _release(self, client: aioftp.Client, broken: bool = False):
+        """
+        Put a session back into the pool, or drop it if the connection broke.
+        """
+        if broken:
+            self._num_sessions -= 1
+            client.close()
+            # Wake up a waiting task, so that it logs in a replacement session
+            self._idle.put_nowait(None)
+        else:
+            self._idle.put_nowait(client)
+
+    async def close(self):
+        """
+        Log out of all the idle sessions.
+        """
+        while not self._idle.empty():
+            client: aioftp.Client = self._idle.get_nowait()
+            if client is None:
+                continue
+            try:
+                await client.quit()
+            except (aioftp.StatusCodeError, OSError):
+                client.close()
+            self._num_sessions -= 1
+
+    async def _download(self, client: aioftp.Client, path: str, dest: str) -> int:
+        """
+        Download one remote file, resuming from a partial download if any.
+        Returns the number of bytes transferred.
+        """
+        part: str = f"{dest}.part"
+        offset: int = os.path.getsize(part) if os.path.exists(part) else 0
+        size: int = int((await client.stat(path))["size"])
+
+        nbytes: int = 0
+        if offset < size:
+            with open(file=part, mode="ab") as f:
+                async with client.download_stream(source=path, offset=offset) as stream:
+                    async for block in stream.iter_by_block():
+                        f.write(block)
+                        nbytes += len(block)
+        if os.path.getsize(part) != size:
+            raise OSError(f"Incomplete download of {path}, will resume on retry.")
+        os.replace(src=part, dst=dest)
+        return nbytes
+
+    async def fetch(self, path: str) -> FetchResult:
+        """
+        Download one file, retrying with backoff if it fails.
+
+        Parameters
+        ----------
+        path : str
+            Path to the file on the FTP server.
+
+        Returns
+        -------
+        result : FetchResult
+            The local path, bytes transferred and time taken.
+        """
+        dest: str = os.path.join(self.dest_dir, os.path.basename(path))
+        if os.path.exists(dest):
+            return FetchResult(path=dest, nbytes=0, seconds=0.0)
+
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                client: aioftp.Client = await self._acquire()
+                tic: float = time.perf_counter()
+                try:
+                    nbytes: int = await self._download(
+                        client=client, path=path, dest=dest
+                    )
+                except (aioftp.StatusCodeError, OSError, asyncio.TimeoutError) as err:
+                    permanent: bool = _is_permanent(error=err)
+                    # A 5xx reply (e.g. file not found) leaves the session logged
+                    # in and usable, so only drop it after other failures
+                    self._release(client=client, broken=not permanent)
+                    if permanent or attempt == self.max_retries:
+                        raise
+                    delay: float = self.backoff * 2 ** attempt
+                    logger.warning(f"Retrying {path} in {delay}s after error: {err}")
+                    await asyncio.sleep(delay)
+                except Exception:
+                    self._release(client=client, broken=True)
+                    raise
+                else:
+                    self._release(client=client)
+                    result = FetchResult(
+                        path=dest, nbytes=nbytes, seconds=time.perf_counter() - tic
+                    )
+                    logger.info(f"Downloaded {dest} at {result.throughput:.2f} MB/s")
+                    return result
+
+    async def fetch_all(self, paths: list) -> list:
+        """
+        Download many files concurrently, up to max_concurrency at a time.
+
+        Parameters
+        ----------
+        paths : list
+            Paths to the files on the FTP server.
+
+        Returns
+        -------
+        results : list
+            A FetchResult for each file, in the same order as paths.
+        """
+        return await asyncio.gather(*(self.fetch(path=path) for path in paths))
+
+
+def region_indices(filename: str, region: tuple = (90, 140, 5, 35)) -> dict:
+    """
+    Work out the array index slices of a longitude/latitude region in a
+    Himawari-8 full disk NetCDF file.
+
+    Only the small 1-D coordinate variables are read. All the full disk
+    files share the same grid, so this only needs to be done once.
+
+    Parameters
+    ----------
+    filename : str
+        Path to a Himawari-8 NetCDF file.
+    region : tuple
+        Longitude/latitude bounds as (west, east, south, north).
+
+    Returns
+    -------
+    indices : dict
+        Index slices for the 'longitude' and 'latitude' dimensions, to be
+        passed into ``xr.Dataset.isel``.
+    """
+    west, east, south, north = region
+    with xr.open_dataset(filename_or_obj=filename) as ds:
+        longitude: np.ndarray = ds.longitude.values
+        latitude: np.ndarray = ds.latitude.values
+    # Longitude is increasing, latitude is decreasing from north to south
+    return {
+        "longitude": slice(
+            np.searchsorted(longitude, west, side="left"),
+            np.searchsorted(longitude, east, side="right"),
+        ),
+        "latitude": slice(
+            np.searchsorted(-latitude, -north, side="left"),
+            np.searchsorted(-latitude, -south, side="right"),
+        ),
+    }
+
+
+def netcdf_to_geotiff(
+    filename: str, region: tuple = (90, 140, 5, 35), indices: dict = None
+) -> str:
+    """
+    Crop a Himawari-8 full disk NetCDF file to a region, and save the Red,
+    Green and Blue albedo bands to an 8-bit GeoTIFF file in the same folder.
+
+    Only the hyperslabs of the three albedo variables inside the region are
+    read from the 6001x6001 full disk file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to a NetCDF file like 'NC_H08_20211011_1200_R21_FLDK.06001_06001.nc'.
+    region : tuple
+        Longitude/latitude bounds as (west, east, south, north). Default is
+        SouthEast Asia.
+    indices : dict
+        Precomputed index slices of the region from :func:`region_indices`.
+        Default is None, which works them out from the first file converted
+        in this process, and reuses them for the later files.
+
+    Returns
+    -------
+    raster_path : str
+        Path to the GeoTIFF file, e.g. 'TIF_H08_20211011_1200.tif'.
+    """
+    date, hourminute = os.path.basename(filename).split("_")[2:4]
+    raster_path: str = os.path.join(
+        os.path.dirname(filename), f"TIF_H08_{date}_{hourminute}.tif"
+    )
+    if indices is None:
+        if tuple(region) not in _region_indices_cache:
+            _region_indices_cache[tuple(region)] = region_indices(
+                filename=filename, region=region
+            )
+        indices = _region_indices_cache[tuple(region)]
+
+    with xr.open_dataset(filename_or_obj=filename) as ds:
+        # Get Red, Green and Blue only, cropped to the region
+        ds_crop: xr.Dataset = ds[["albedo_03", "albedo_02", "albedo_01"]].isel(
+            **indices
+        )
+        ds_rgb: xr.DataArray = ds_crop.to_array(dim="band").rename(
+            {"longitude": "x", "latitude": "y"}
+        )
+
+        # Apply coordinate reference system. The data is already on a regular
+        # EPSG:4326 grid, so there is no need to reproject it.
+        ds_rgb = ds_rgb.rio.write_crs(input_crs="EPSG:4326")
+
+        # Save 8-bit data to GeoTIFF
+        (ds_rgb * 2 ** 8).rio.to_raster(raster_path=raster_path, dtype="uint8")
+
+    return raster_path
+
+
+def preprocess_frames(
+    filenames: list, region: tuple = (90, 140, 5, 35), max_workers: int = None
+) -> list:
+    """
+    Convert many Himawari-8 NetCDF files to GeoTIFFs in parallel.
+
+    The region's index slices are worked out once from the first file, and
+    the frames are spread over a process pool.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths to the Himawari-8 NetCDF files, all on the same grid.
+    region : tuple
+        Longitude/latitude bounds as (west, east, south, north). Default is
+        SouthEast Asia.
+    max_workers : int
+        Number of processes. Default is None, which uses all the CPU cores.
+
+    Returns
+    -------
+    raster_paths : list
+        Paths to the GeoTIFF files, in the same order as filenames.
+    """
+    indices: dict = region_indices(filename=filenames[0], region=region)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                functools.partial(netcdf_to_geotiff, region=region, indices=indices),
+                filenames,
+            )
+        )
+
+
+def frame_time(filename: str) -> pd.Timestamp:
+    """
+    Get the observation time of a Himawari-8 NetCDF file from its name, e.g.
+    'NC_H08_20211011_1200_R21_FLDK.06001_06001.nc' is 2021-10-11 12:00.
+    """
+    date, hourminute = os.path.basename(filename).split("_")[2:4]
+    return pd.to_datetime(f"{date}{hourminute}", format="%Y%m%d%H%M")
+
+
+def append_to_zarr(
+    filenames: list,
+    store: str,
+    variable: str = "tbb_13",
+    region: tuple = (90, 140, 5, 35),
+    chunks: tuple = (1, None, None),
+) -> list:
+    """
+    Append cropped Himawari-8 frames to a (time, y, x) Zarr cube.
+
+    The cube is created on the first call, with zstd compressed chunks and
+    consolidated metadata. Later calls only append the frames whose times are
+    not in the cube yet, so new hourly files can be added as they arrive. The
+    frames are appended in time order, and must all be later than the last
+    frame in the cube, so that the time axis stays sorted.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths to the Himawari-8 NetCDF files, all on the same grid.
+    store : str
+        Path to the Zarr store, e.g. 'himawari.zarr'.
+    variable : str
+        Name of the variable to store. Default is 'tbb_13' (Band 13 brightness
+        temperature).
+    region : tuple
+        Longitude/latitude bounds as (west, east, south, north). Default is
+        SouthEast Asia.
+    chunks : tuple
+        Chunk size along (time, y, x), where None means the full length of
+        that dimension. Default is one whole frame per chunk, so that reading
+        a frame is a single chunk read, and appending a frame never has to
+        rewrite an existing chunk. Use e.g. (24, 256, 256) instead to favour
+        reading the time series of single pixels.
+
+    Returns
+    -------
+    times : list
+        The times of the frames that were appended.
+
+    Raises
+    ------
+    ValueError
+        If a new frame is earlier than the last frame in the cube. Nothing is
+        appended in that case.
+    """
+    existing: set = set()
+    if os.path.exists(store):
+        with xr.open_zarr(store=store, consolidated=True) as cube:
+            existing = set(pd.to_datetime(cube.time.values))
+
+    frames: dict = {frame_time(filename=filename): filename for filename in filenames}
+    new_frames: list = sorted(
+        (frame_t, filename)
+        for frame_t, filename in frames.items()
+        if frame_t not in existing
+    )
+    if existing and new_frames and new_frames[0][0] < max(existing):
+        raise ValueError(
+            f"Frame at {new_frames[0][0]} is earlier than the last frame in "
+            f"{store} at {max(existing)}, appending it would unsort the time axis."
+        )
+
+    appended: list = []
+    indices: dict = region_indices(filename=filenames[0], region=region)
+    for frame_t, filename in new_frames:
+        with xr.open_dataset(filename_or_obj=filename) as ds:
+            frame: xr.Dataset = (
+                ds[[variable]]
+                .isel(**indices)
+                .rename({"longitude": "x", "latitude": "y"})
+                .expand_dims(time=[frame_t])
+                .load()
+            )
+
+        if not existing and not appended:
+            shape: tuple = frame[variable].shape
+            encoding: dict = {
+                variable: {
+                    "chunks": tuple(c or n for c, n in zip(chunks, shape)),
+                    "compressor": numcodecs.Blosc(
+                        cname="zstd", clevel=5, shuffle=numcodecs.Blosc.BITSHUFFLE
+                    ),
+                },
+                # Whole minutes, so that later frames can be appended exactly
+                "time": {"units": "minutes since 1970-01-01", "dtype": "int64"},
+            }
+            frame.to_zarr(store=store, mode="w-", encoding=encoding, consolidated=True)
+        else:
+            frame.to_zarr(store=store, append_dim="time", consolidated=True)
+        appended.append(frame_t)
+
+    return appended
+
+
+async def fetch_and_process(
+    fetcher: FTPFetcher,
+    paths: list,
+    process: typing.Callable = netcdf_to_geotiff,
+    max_workers: int = 2,
+    max_pending: int = 4,
+) -> tuple:
+    """
+    Download files and process each one as soon as it lands, so that the
+    network and CPU work overlap.
+
+    Downloaded files are handed to the processing workers through an asyncio
+    queue. At most max_pending files can be downloading or waiting to be
+    processed at any time, so when the processors fall behind, new downloads
+    wait until a file has been processed.
+
+    Parameters
+    ----------
+    fetcher : FTPFetcher
+        An opened FTPFetcher to download the files with.
+    paths : list
+        Paths to the files on the FTP server.
+    process : callable
+        Function that takes the local path to a downloaded file and returns
+        something picklable, e.g. the path to an output file. Runs in a
+        process pool, so it must be defined at the top level of a module.
+        Default is :func:`netcdf_to_geotiff`.
+    max_workers : int
+        Number of processes to run the process function on. Default is 2.
+    max_pending : int
+        Maximum number of files downloaded or downloading but not yet
+        processed. Default is 4.
+
+    Returns
+    -------
+    results : list
+        A FetchResult for each file (local path, bytes transferred and time
+        taken), in the same order as paths.
+    outputs : list
+        The outputs of the process function, in the same order as paths.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    slots = asyncio.Semaphore(value=max(max_pending, max_workers))
+    results: dict = {}
+    outputs: dict = {}
+
+    async def _produce(path: str):
+        await slots.acquire()  # wait here if the processors are behind
+        try:
+            result: FetchResult = await fetcher.fetch(path=path)
+        except Exception:
+            slots.release()
+            raise
+        results[path] = result
+        await queue.put((path, result.path))
+
+    async def _consume(executor: concurrent.futures.Executor):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            path, filename = item
+            try:
+                outputs[path] = await loop.run_in_executor(executor, process, filename)
+            finally:
+                slots.release()
+
+    async def _produce_all():
+        await asyncio.gather(*(_produce(path=path) for path in paths))
+        for _ in range(max_workers):
+            await queue.put(None)  # tell the consumers to stop
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        tasks: list = [asyncio.create_task(_produce_all())] + [
+            asyncio.create_task(_consume(executor=executor)) for _ in range(max_workers)
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return [results[path] for path in paths], [outputs[path] for path in paths]
@@ -0,0 +1,762 @@
+"""
+Processing of LiDAR point cloud tiles into gridded surfaces.
+
+Note that pygmt is imported inside the functions here, so that each worker
+process of :func:`mapchallenge.parallel.gmt_process_pool` can set up its own
+GMT session first.
+"""
+import concurrent.futures
+import functools
+import glob
+import logging
+import math
+import os
+import typing
+
+import laspy
+import numpy as np
+import rasterio.crs
+import rtree
+import xarray as xr
+
+from mapchallenge.blocks import BlockReducer
+from mapchallenge.parallel import gmt_process_pool
+
+logger = logging.getLogger(__name__)
+
+# ASPRS LAS classification code of ground points
+GROUND: int = 2
+
+
+def iter_xyz(
+    lazfile: str,
+    chunk_size: int = 1_000_000,
+    classification: bool = False,
+) -> typing.Iterator[np.ndarray]:
+    """
+    Stream the scaled x, y, z coordinates of a LAS/LAZ file in chunks.
+
+    LAZ files are decompressed with the multi-threaded lazrs backend when it
+    is available. The coordinates are scaled straight into one buffer that
+    is reused for every chunk. Memory for reading depends on the chunk size
+    (the buffer plus laspy's decoded points of one chunk), not on the number
+    of points in the file, as long as the caller doesn't keep the chunks.
+
+    Parameters
+    ----------
+    lazfile : str
+        Path to the LAS/LAZ file.
+    chunk_size : int
+        Number of points to read at a time. Default is 1 million.
+    classification : bool
+        If True, also yield the LAS classification code of each point, e.g. 2
+        for ground. Default is False.
+
+    Yields
+    ------
+    xyz : np.ndarray
+        A view of shape (n, 3) into the buffer. It is overwritten by the next
+        chunk, so copy it if you need to keep it around.
+    classes : np.ndarray
+        Array of shape (n,) with the classification codes. Only yielded
+        (as an (xyz, classes) tuple) when 'classification' is True.
+    """
+    laz_backend = (
+        laspy.LazBackend.LazrsParallel
+        if laspy.LazBackend.LazrsParallel.is_available()
+        else None
+    )
+    with laspy.open(source=lazfile, laz_backend=laz_backend) as reader:
+        scales: np.ndarray = reader.header.scales
+        offsets: np.ndarray = reader.header.offsets
+        buffer: np.ndarray = np.empty(
+            shape=(min(chunk_size, max(reader.header.point_count, 1)), 3)
+        )
+
+        for points in reader.chunk_iterator(points_per_iteration=len(buffer)):
+            xyz: np.ndarray = buffer[: len(points)]
+            for i, dim in enumerate(["X", "Y", "Z"]):
+                np.multiply(points.array[dim], scales[i], out=xyz[:, i])
+                xyz[:, i] += offsets[i]
+            if classification:
+                yield xyz, np.asarray(points["classification"])
+            else:
+                yield xyz
+
+
+def tile_region(lazfile: str, spacing: float, info: dict = None) -> list:
+    """
+    Get the bounds of a LAS/LAZ tile from its header, rounded outward to a
+    multiple of 'spacing', like ``pygmt.info(data=..., spacing=spacing)``.
+
+    Parameters
+    ----------
+    lazfile : str
+        Path to the LAS/LAZ file.
+    spacing : float
+        Multiple to round the bounds to.
+    info : dict
+        The tile's header info from :func:`read_tile_header`, if it was read
+        already. Default is None, which reads the header.
+
+    Returns
+    -------
+    region : list
+        [West, East, South, North]
+    """
+    if info is None:
+        info = read_tile_header(lazfile=lazfile)
+    minx, miny, maxx, maxy = info["bounds"]
+    return [
+        math.floor(minx / spacing) * spacing,
+        math.ceil(maxx / spacing) * spacing,
+        math.floor(miny / spacing) * spacing,
+        math.ceil(maxy / spacing) * spacing,
+    ]
+
+
+def _header_crs(header: laspy.LasHeader) -> str:
+    """
+    Get the CRS of a LAS/LAZ file from the WKT or GeoTIFF keys VLRs in its
+    header, e.g. 'EPSG:2193', or None if there is no CRS.
+    """
+    for vlr in header.vlrs:
+        if isinstance(vlr, laspy.vlrs.known.WktCoordinateSystemVlr):
+            return rasterio.crs.CRS.from_wkt(vlr.string).to_string()
+        if isinstance(vlr, laspy.vlrs.known.GeoKeyDirectoryVlr):
+            keys: dict = {key.id: key.value_offset for key in vlr.geo_keys}
+            # ProjectedCSTypeGeoKey, then GeographicTypeGeoKey
+            for key_id in (3072, 2048):
+                if key_id in keys and keys[key_id] not in (0, 32767):
+                    return f"EPSG:{keys[key_id]}"
+    return None
+
+
+def read_tile_header(lazfile: str) -> dict:
+    """
+    Read the bounds, point count and CRS of a LAS/LAZ file from its header
+    only, without decompressing any points.
+
+    Returns
+    -------
+    info : dict
+        With keys 'path', 'bounds' as (minx, miny, maxx, maxy),
+        'point_count' and 'crs'.
+    """
+    with laspy.open(source=lazfile) as reader:
+        header: laspy.LasHeader = reader.header
+        return {
+            "path": lazfile,
+            "bounds": (
+                float(header.mins[0]),
+                float(header.mins[1]),
+                float(header.maxs[0]),
+                float(header.maxs[1]),
+            ),
+            "point_count": int(header.point_count),
+            "crs": _header_crs(header=header),
+        }
+
+
+def _list_tiles(tiles) -> list:
+    """
+    Get the sorted paths to the '.las' and '.laz' files in a directory, or
+    the given list of paths as is.
+    """
+    if isinstance(tiles, str):
+        return sorted(
+            glob.glob(os.path.join(tiles, "*.laz"))
+            + glob.glob(os.path.join(tiles, "*.las"))
+        )
+    return list(tiles)
+
+
+class TileIndex:
+    """
+    Spatial index over a collection of LAS/LAZ tiles, built from the file
+    headers only, and stored on disk as an R-tree.
+
+    Use :meth:`build` to index a directory of tiles once, and then
+    ``TileIndex(index_path)`` to reopen the index, or :meth:`load` to do
+    either as needed. Then use :meth:`query` to pick the tiles that cover an
+    area of interest, without opening any of them.
+
+    Parameters
+    ----------
+    index_path : str
+        Path of the index files without the extension, which is stored as
+        '{index_path}.idx' and '{index_path}.dat'. Default is 'lidar_tiles'.
+    """
+
+    def __init__(self, index_path: str = "lidar_tiles"):
+        self.index_path: str = index_path
+        self._index = rtree.index.Index(index_path)
+
+    @classmethod
+    def build(cls, tiles, index_path: str = "lidar_tiles") -> "TileIndex":
+        """
+        Index the headers of LAS/LAZ tiles, replacing any existing index.
+
+        Parameters
+        ----------
+        tiles : str or list
+            A directory to index all the '.las' and '.laz' files in, or a list
+            of paths to the tiles.
+        index_path : str
+            Path of the index files without the extension. Default is
+            'lidar_tiles'.
+
+        Returns
+        -------
+        index : TileIndex
+        """
+        tiles = _list_tiles(tiles=tiles)
+        for extension in (".idx", ".dat"):
+            if os.path.exists(index_path + extension):
+                os.remove(index_path + extension)
+
+        index = rtree.index.Index(index_path)
+        for i, lazfile in enumerate(tiles):
+            info: dict = read_tile_header(lazfile=lazfile)
+            index.insert(id=i, coordinates=info["bounds"], obj=info)
+        index.close()  # flush to disk
+        return cls(index_path=index_path)
+
+    @classmethod
+    def load(cls, tiles, index_path: str = "lidar_tiles") -> "TileIndex":
+        """
+        Open an existing index of LAS/LAZ tiles, or build it if it doesn't
+        exist yet or is out of date, i.e. if tiles were added or removed, or
+        modified after the index was built.
+
+        Parameters
+        ----------
+        tiles : str or list
+            A directory with the '.las' and '.laz' files to index, or a list
+            of paths to the tiles.
+        index_path : str
+            Path of the index files without the extension. Default is
+            'lidar_tiles'.
+
+        Returns
+        -------
+        index : TileIndex
+        """
+        tiles = _list_tiles(tiles=tiles)
+        if all(os.path.exists(index_path + ext) for ext in (".idx", ".dat")):
+            index = cls(index_path=index_path)
+            built: float = os.path.getmtime(index_path + ".dat")
+            indexed: list = sorted(info["path"] for info in index.tiles())
+            if indexed == sorted(tiles) and all(
+                os.path.getmtime(lazfile) <= built for lazfile in tiles
+            ):
+                return index
+            index._index.close()
+        return cls.build(tiles=tiles, index_path=index_path)
+
+    def __len__(self) -> int:
+        return self._index.get_size()
+
+    def tiles(self) -> list:
+        """
+        Get the header info of all the indexed tiles, in no particular order.
+        See :func:`read_tile_header` for the keys.
+        """
+        if len(self) == 0:
+            return []
+        return list(self._index.intersection(self._index.bounds, objects="raw"))
+
+    def query(self, bbox: tuple) -> list:
+        """
+        Find the tiles that intersect a bounding box.
+
+        Parameters
+        ----------
+        bbox : tuple
+            Bounding box as (minx, miny, maxx, maxy), in the CRS of the tiles.
+
+        Returns
+        -------
+        tiles : list
+            Header info of the intersecting tiles, sorted by path. See
+            :func:`read_tile_header` for the keys. Tiles that only touch the
+            edge of the bounding box are left out.
+        """
+        minx, miny, maxx, maxy = bbox
+        tiles: list = [
+            info
+            for info in self._index.intersection(bbox, objects="raw")
+            if info["bounds"][0] < maxx
+            and info["bounds"][2] > minx
+            and info["bounds"][1] < maxy
+            and info["bounds"][3] > miny
+        ]
+        return sorted(tiles, key=lambda info: info["path"])
+
+
+def blockmedian_tile(
+    lazfile: str,
+    spacing: float = 5,
+    quantile: float = 0.99,
+    outfile: str = None,
+    chunk_size: int = 1_000_000,
+) -> str:
+    """
+    Trim the points in one LAS/LAZ tile to a quantile per block, like GMT's
+    ``blockmedian -T``, and save the XYZ output to a native binary file of
+    float64 x, y, z triplets.
+
+    The tile is streamed in chunks with :func:`iter_xyz` into a
+    :class:`mapchallenge.blocks.BlockReducer`, so memory depends on the chunk
+    size and the number of blocks, not on the number of points. GMT's
+    blockmedian needs all the points of the tile in memory at once, so it
+    isn't called here. The quantiles are exact for blocks with not too many
+    points (see :class:`mapchallenge.blocks.BlockReducer`), and the output
+    coordinates are the block centres, like ``blockmedian -C``.
+
+    Points never go through a text format: the binary output is read back
+    with ``np.fromfile(outfile).reshape(-1, 3)``, or passed straight to GMT
+    modules with ``binary="i3d"``.
+
+    Parameters
+    ----------
+    lazfile : str
+        Path to the LAS/LAZ file.
+    spacing : float
+        Block size in the units of the point cloud's CRS. Default is 5.
+    quantile : float
+        Quantile of the elevations to keep in each block, e.g. 0.99 for the
+        highest point, or 0.5 for the median. Default is 0.99.
+    outfile : str
+        Path of the binary file to save. Default is None, which replaces the
+        '.laz' or '.las' extension of the input file with '.bin'.
+    chunk_size : int
+        Number of points to read at a time. Default is 1 million.
+
+    Returns
+    -------
+    outfile : str
+    """
+    if outfile is None:
+        outfile = os.path.splitext(lazfile)[0] + ".bin"
+
+    xyz: np.ndarray = reduce_tile(
+        lazfile=lazfile,
+        spacing=spacing,
+        statistic="quantile",
+        quantile=quantile,
+        chunk_size=chunk_size,
+    )
+    xyz.tofile(outfile)
+    return outfile
+
+
+def blockmedian_tiles(
+    lazfiles: list,
+    spacing: float = 5,
+    quantile: float = 0.99,
+    chunk_size: int = 1_000_000,
+    max_workers: int = None,
+) -> list:
+    """
+    Run :func:`blockmedian_tile` on many LAS/LAZ tiles at once, spread over a
+    process pool.
+
+    Parameters
+    ----------
+    lazfiles : list
+        Paths to the LAS/LAZ files.
+    spacing : float
+        Block size in the units of the point cloud's CRS. Default is 5.
+    quantile : float
+        Quantile of the elevations to keep in each block. Default is 0.99.
+    chunk_size : int
+        Number of points each worker reads at a time. Default is 1 million.
+    max_workers : int
+        Number of processes. Default is None, which uses all the CPU cores.
+
+    Returns
+    -------
+    outfiles : list
+        Paths to the binary files, in the same order as 'lazfiles'.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                functools.partial(
+                    blockmedian_tile,
+                    spacing=spacing,
+                    quantile=quantile,
+                    chunk_size=chunk_size,
+                ),
+                lazfiles,
+            )
+        )
+
+
+def reduce_tile(
+    lazfile: str,
+    spacing: float = 5,
+    statistic: str = "quantile",
+    quantile: float = 0.99,
+    chunk_size: int = 1_000_000,
+) -> np.ndarray:
+    """
+    Reduce the points in one LAS/LAZ tile to one point per block in NumPy,
+    without calling GMT.
+
+    The tile is streamed in chunks with :func:`iter_xyz`, and each chunk is
+    fed to a :class:`mapchallenge.blocks.BlockReducer` as it arrives.
+
+    Parameters
+    ----------
+    lazfile : str
+        Path to the LAS/LAZ file.
+    spacing : float
+        Block size in the units of the point cloud's CRS. Default is 5.
+    statistic : str
+        One of 'mean', 'sum', 'min', 'max' or 'quantile'. Default is
+        'quantile'.
+    quantile : float
+        Quantile of the elevations to keep in each block. Default is 0.99.
+    chunk_size : int
+        Number of points to read at a time. Default is 1 million.
+
+    Returns
+    -------
+    xyz : np.ndarray
+        Array of shape (n, 3) with the block centres and reduced elevations.
+    """
+    reducer = BlockReducer(
+        region=tile_region(lazfile=lazfile, spacing=spacing),
+        spacing=spacing,
+        statistic=statistic,
+        quantile=quantile,
+    )
+    for xyz in iter_xyz(lazfile=lazfile, chunk_size=chunk_size):
+        reducer.update(xyz=xyz)
+    return reducer.to_xyz()
+
+
+def reduce_tiles(
+    lazfiles: list,
+    spacing: float = 5,
+    statistic: str = "quantile",
+    quantile: float = 0.99,
+    chunk_size: int = 1_000_000,
+    max_workers: int = None,
+) -> np.ndarray:
+    """
+    Run :func:`reduce_tile` on many LAS/LAZ tiles at once, spread over a
+    process pool, and stack the results into one xyz array.
+
+    Parameters
+    ----------
+    lazfiles : list
+        Paths to the LAS/LAZ files.
+    spacing : float
+        Block size in the units of the point cloud's CRS. Default is 5.
+    statistic : str
+        One of 'mean', 'sum', 'min', 'max' or 'quantile'. Default is
+        'quantile'.
+    quantile : float
+        Quantile of the elevations to keep in each block. Default is 0.99.
+    chunk_size : int
+        Number of points each worker reads at a time. Default is 1 million.
+    max_workers : int
+        Number of processes. Default is None, which uses all the CPU cores.
+
+    Returns
+    -------
+    xyz : np.ndarray
+        Array of shape (n, 3) with the block centres and reduced elevations.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return np.concatenate(
+            list(
+                executor.map(
+                    functools.partial(
+                        reduce_tile,
+                        spacing=spacing,
+                        statistic=statistic,
+                        quantile=quantile,
+                        chunk_size=chunk_size,
+                    ),
+                    lazfiles,
+                )
+            )
+        )
+
+
+def dsm_dtm_tile(
+    lazfile: str,
+    spacing: float = 5,
+    quantile: float = 0.99,
+    ground_quantile: float = 0.5,
+    chunk_size: int = 1_000_000,
+) -> tuple:
+    """
+    Reduce the points in one LAS/LAZ tile into both a Digital Surface Model
+    (DSM) and a Digital Terrain Model (DTM) in a single pass, so that the
+    tile is only decompressed once.
+
+    The DSM keeps a high quantile of all returns in each block (the tops of
+    trees and buildings), and the DTM a quantile of only the returns that are
+    classified as ground. Memory depends on the chunk size and the number of
+    blocks, not on the number of points, and the quantiles are exact for
+    blocks with not too many points (see
+    :class:`mapchallenge.blocks.BlockReducer`).
+
+    Parameters
+    ----------
+    lazfile : str
+        Path to the LAS/LAZ file.
+    spacing : float
+        Block size in the units of the point cloud's CRS. Default is 5.
+    quantile : float
+        Quantile of all elevations to keep for the DSM. Default is 0.99.
+    ground_quantile : float
+        Quantile of the ground elevations to keep for the DTM. Default is 0.5
+        (the median).
+    chunk_size : int
+        Number of points to read at a time. Default is 1 million.
+
+    Returns
+    -------
+    dsm, dtm : np.ndarray
+        Arrays of shape (n, 3) with the block centres and reduced elevations.
+    """
+    region: list = tile_region(lazfile=lazfile, spacing=spacing)
+    dsm = BlockReducer(
+        region=region, spacing=spacing, statistic="quantile", quantile=quantile
+    )
+    dtm = BlockReducer(
+        region=region, spacing=spacing, statistic="quantile", quantile=ground_quantile
+    )
+    for xyz, classes in iter_xyz(
+        lazfile=lazfile, chunk_size=chunk_size, classification=True
+    ):
+        dsm.update(xyz=xyz)
+        dtm.update(xyz=xyz[classes == GROUND])
+    return dsm.to_xyz(), dtm.to_xyz()
+
+
+def dsm_dtm_tiles(
+    lazfiles: list,
+    spacing: float = 5,
+    quantile: float = 0.99,
+    ground_quantile: float = 0.5,
+    chunk_size: int = 1_000_000,
+    max_workers: int = None,
+) -> tuple:
+    """
+    Run :func:`dsm_dtm_tile` on many LAS/LAZ tiles at once, spread over a
+    process pool, and stack the results.
+
+    Parameters
+    ----------
+    lazfiles : list
+        Paths to the LAS/LAZ files.
+    spacing : float
+        Block size in the units of the point cloud's CRS. Default is 5.
+    quantile : float
+        Quantile of all elevations to keep for the DSM. Default is 0.99.
+    ground_quantile : float
+        Quantile of the ground elevations to keep for the DTM. Default is 0.5.
+    chunk_size : int
+        Number of points each worker reads at a time. Default is 1 million.
+    max_workers : int
+        Number of processes. Default is None, which uses all the CPU cores.
+
+    Returns
+    -------
+    dsm, dtm : np.ndarray
+        Arrays of shape (n, 3) with the block centres and reduced elevations.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results: list = list(
+            executor.map(
+                functools.partial(
+                    dsm_dtm_tile,
+                    spacing=spacing,
+                    quantile=quantile,
+                    ground_quantile=ground_quantile,
+                    chunk_size=chunk_size,
+                ),
+                lazfiles,
+            )
+        )
+    dsms, dtms = zip(*results)
+    return np.concatenate(dsms), np.concatenate(dtms)
+
+
+def canopy_height(dsm, dtm):
+    """
+    Get the height of trees and buildings above the ground, as the
+    difference between a DSM and a DTM on the same grid, where negative
+    values (from interpolation noise) are set to 0.
+
+    Parameters
+    ----------
+    dsm : xr.DataArray
+        Digital Surface Model grid.
+    dtm : xr.DataArray
+        Digital Terrain Model grid.
+
+    Returns
+    -------
+    chm : xr.DataArray
+        Canopy Height Model grid.
+    """
+    return (dsm - dtm).clip(min=0)
+
+
+def _surface_tile(data: np.ndarray, region: list, spacing: float, **kwargs):
+    """
+    Grid one tile with pygmt.surface, returning the grid values as a NumPy
+    array with rows going from south to north.
+    """
+    import pygmt
+
+    return pygmt.surface(data=data, region=region, spacing=spacing, **kwargs).values
+
+
+def _feather(first: int, last: int, total: int, halo: int) -> np.ndarray:
+    """
+    Blending weights along one axis of a tile spanning grid nodes first to
+    last (inclusive), ramping up linearly from the edges that are shared
+    with a neighbouring tile.
+    """
+    index: np.ndarray = np.arange(first, last + 1)
+    distance: np.ndarray = np.full(index.shape, fill_value=np.inf)
+    if first > 0:
+        distance = np.minimum(distance, index - first)
+    if last < total - 1:
+        distance = np.minimum(distance, last - index)
+    return np.clip((distance + 1) / (2 * halo + 1), a_min=0, a_max=1)
+
+
+def tiled_surface(
+    data: np.ndarray,
+    region: list,
+    spacing: float,
+    tile_size: float = 1000,
+    overlap: float = 100,
+    max_workers: int = None,
+    **kwargs,
+):
+    """
+    Grid xyz points with pygmt.surface tile by tile on a process pool, and
+    blend the tiles back into one seamless grid.
+
+    The region is split into square tiles, each padded with an overlap halo
+    on the sides next to another tile. Every tile is gridded on its own with
+    only the points inside it, so memory per worker depends on the tile size
+    and not on the whole region. Where tiles overlap, they are feathered
+    together with linear weights, which hides the seams from gridding each
+    tile separately. Tiles with fewer than 4 points are left out (and stay
+    NaN unless a neighbouring tile's halo covers them), with a warning.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Array of shape (n, 3) with x, y, z columns.
+    region : list
+        Grid bounds as [West, East, South, North], which should be multiples
+        of 'spacing'.
+    spacing : float
+        Grid spacing.
+    tile_size : float
+        Width and height of each tile, without the halo. Default is 1000.
+    overlap : float
+        Width of the halo around each tile. Default is 100.
+    max_workers : int
+        Number of processes. Default is None, which uses all the CPU cores.
+    kwargs
+        Other parameters passed to pygmt.surface, e.g. T=0.35 for the tension
+        factor. Note that the lower and upper bound options (Ll="d", Lu="d")
+        then use the data range of each tile, not of the whole region.
+
+    Returns
+    -------
+    grid : xr.DataArray
+        The gridline registered grid, with NaN where there were no points.
+    """
+    west, east, south, north = region
+    nx: int = int(round((east - west) / spacing)) + 1
+    ny: int = int(round((north - south) / spacing)) + 1
+    step: int = max(1, int(round(tile_size / spacing)))
+    halo: int = max(1, int(round(overlap / spacing)))
+
+    x: np.ndarray = data[:, 0]
+    y: np.ndarray = data[:, 1]
+    tiles: list = []  # (first_col, last_col, first_row, last_row) of each tile
+    for col in range(0, nx - 1, step):
+        for row in range(0, ny - 1, step):
+            tiles.append(
+                (
+                    max(0, col - halo),
+                    min(nx - 1, col + step + halo),
+                    max(0, row - halo),
+                    min(ny - 1, row + step + halo),
+                )
+            )
+
+    weighted_sum: np.ndarray = np.zeros(shape=(ny, nx))
+    weights: np.ndarray = np.zeros(shape=(ny, nx))
+    skipped: list = []  # regions of the tiles with too few points to grid
+    with gmt_process_pool(max_workers=max_workers) as executor:
+        futures: dict = {}
+        for tile in tiles:
+            first_col, last_col, first_row, last_row = tile
+            tile_region: list = [
+                west + first_col * spacing,
+                west + last_col * spacing,
+                south + first_row * spacing,
+                south + last_row * spacing,
+            ]
+            inside: np.ndarray = (
+                (x >= tile_region[0])
+                & (x <= tile_region[1])
+                & (y >= tile_region[2])
+                & (y <= tile_region[3])
+            )
+            if inside.sum() < 4:  # too few points to grid
+                skipped.append(tile_region)
+                continue
+            future = executor.submit(
+                _surface_tile,
+                data=data[inside],
+                region=tile_region,
+                spacing=spacing,
+                **kwargs,
+            )
+            futures[future] = tile
+
+        for future in concurrent.futures.as_completed(futures):
+            first_col, last_col, first_row, last_row = futures[future]
+            weight: np.ndarray = np.outer(
+                _feather(first=first_row, last=last_row, total=ny, halo=halo),
+                _feather(first=first_col, last=last_col, total=nx, halo=halo),
+            )
+            values: np.ndarray = future.result()
+            weight[np.isnan(values)] = 0
+            window = np.s_[first_row : last_row + 1, first_col : last_col + 1]
+            weighted_sum[window] += np.nan_to_num(values) * weight
+            weights[window] += weight
+
+    if skipped:
+        logger.warning(
+            f"Skipped {len(skipped)} of {len(tiles)} tiles with fewer than 4 "
+            f"points, e.g. the tile at {skipped[0]}."
+        )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        blended: np.ndarray = weighted_sum / weights
+    return xr.DataArray(
+        data=blended,
+        dims=("y", "x"),
+        coords={
+            "y": south + spacing * np.arange(ny),
+            "x": west + spacing * np.arange(nx),
+        },
+    )
@@ -0,0 +1,42 @@
+"""
+Process pools for running GMT/PyGMT in parallel.
+"""
+import concurrent.futures
+import multiprocessing
+import os
+
+
+def _init_gmt_worker():
+    """
+    Give each worker process its own GMT session directory.
+
+    GMT names the session directory after the parent process ID by default,
+    so workers spawned from the same notebook would otherwise share (and
+    clobber) one session. This must run before pygmt is imported.
+    """
+    os.environ["GMT_SESSION_NAME"] = str(os.getpid())
+
+
+def gmt_process_pool(max_workers: int = None) -> concurrent.futures.ProcessPoolExecutor:
+    """
+    Create a process pool where every worker has its own GMT session.
+
+    Workers are started with 'spawn' rather than 'fork', so that they don't
+    inherit the GMT session of the parent process. Functions submitted to the
+    pool should import pygmt inside the function body, not at the top of
+    their module.
+
+    Parameters
+    ----------
+    max_workers : int
+        Number of processes. Default is None, which uses all the CPU cores.
+
+    Returns
+    -------
+    executor : concurrent.futures.ProcessPoolExecutor
+    """
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(method="spawn"),
+        initializer=_init_gmt_worker,
+    )
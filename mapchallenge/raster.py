@@ -0,0 +1,1281 @@
+"""
+Raster helpers for reading Cloud Optimized GeoTIFFs (COGs).
+"""
+import concurrent.futures
+import math
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+import rasterio.crs
+import rasterio.enums
+import rasterio.transform
+import rasterio.warp
+import rasterio.windows
+import rioxarray
+import xarray as xr
+
+from mapchallenge.cache import GridCache
+
+# GDAL settings for remote COGs. Don't list sibling files (e.g. .aux.xml, .ovr)
+# on open, and merge adjacent HTTP range requests for internal tiles. Only used
+# for remote files, see cog_env.
+COG_ENV: dict = {
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.TIF,.tiff",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "VSI_CACHE": "TRUE",
+}
+
+
+def cog_env(filename: str) -> rasterio.Env:
+    """
+    Get the GDAL environment to open a raster in.
+
+    Remote files (URLs and GDAL's network virtual file systems) are opened
+    with the COG_ENV settings. Local files are opened with the default
+    settings, so that sidecar files like external .ovr overviews are found.
+
+    Parameters
+    ----------
+    filename : str
+        Path or URL to the raster file.
+
+    Returns
+    -------
+    env : rasterio.Env
+    """
+    remote: bool = "://" in str(filename) or any(
+        prefix in str(filename)
+        for prefix in ("/vsicurl", "/vsis3", "/vsigs", "/vsiaz", "/vsioss")
+    )
+    return rasterio.Env(**COG_ENV) if remote else rasterio.Env()
+
+
+def bbox_to_window(
+    bbox: tuple,
+    transform: rasterio.Affine,
+    shape: tuple,
+    crs=None,
+    bbox_crs=None,
+) -> rasterio.windows.Window:
+    """
+    Convert a bounding box into a pixel window on a raster grid.
+
+    The window is snapped outwards to whole pixels, so that every pixel
+    touching the bounding box is included, and trimmed to the raster extent.
+
+    Parameters
+    ----------
+    bbox : tuple
+        Bounding box as (minx, miny, maxx, maxy).
+    transform : rasterio.Affine
+        Affine transform of the raster grid.
+    shape : tuple
+        Raster grid size as (height, width).
+    crs : str or rasterio.crs.CRS
+        Coordinate reference system of the raster grid.
+    bbox_crs : str or rasterio.crs.CRS
+        Coordinate reference system of the bounding box. Default is None,
+        meaning that the bounding box is already in the raster's CRS.
+
+    Returns
+    -------
+    window : rasterio.windows.Window
+    """
+    if bbox_crs is not None and rasterio.crs.CRS.from_user_input(
+        bbox_crs
+    ) != rasterio.crs.CRS.from_user_input(crs):
+        bbox = rasterio.warp.transform_bounds(bbox_crs, crs, *bbox, densify_pts=21)
+
+    window = rasterio.windows.from_bounds(*bbox, transform=transform)
+    height, width = shape
+    row_start = max(math.floor(window.row_off), 0)
+    col_start = max(math.floor(window.col_off), 0)
+    row_stop = min(math.ceil(window.row_off + window.height), height)
+    col_stop = min(math.ceil(window.col_off + window.width), width)
+    if row_stop <= row_start or col_stop <= col_start:
+        raise ValueError(f"Bounding box {bbox} does not overlap with the raster.")
+
+    return rasterio.windows.Window.from_slices(
+        rows=(row_start, row_stop), cols=(col_start, col_stop)
+    )
+
+
+def select_overview_level(filename: str, resolution: float):
+    """
+    Get the coarsest overview level of a (Cloud Optimized) GeoTIFF whose
+    pixels are no larger than a target resolution.
+
+    Parameters
+    ----------
+    filename : str
+        Path or URL to the GeoTIFF file.
+    resolution : float
+        Largest acceptable pixel size, in the raster's CRS units.
+
+    Returns
+    -------
+    overview_level : int or None
+        Index into the GeoTIFF's overviews (0 being the finest), or None if
+        the full resolution is needed.
+    """
+    with cog_env(filename=filename):
+        with rasterio.open(fp=filename) as src:
+            factors: list = src.overviews(1)
+            res: float = max(src.res)
+    factor: int = choose_overview_factor(
+        factors=factors, res=res, target_res=resolution
+    )
+    return factors.index(factor) if factor > 1 else None
+
+
+def open_cog_window(
+    filename: str,
+    bbox: tuple,
+    bbox_crs=None,
+    masked: bool = False,
+    resolution: float = None,
+    **kwargs,
+) -> xr.DataArray:
+    """
+    Read only the part of a (Cloud Optimized) GeoTIFF inside a bounding box.
+
+    Only the COG internal tiles overlapping the bounding box are fetched, so
+    the bytes transferred and memory used scale with the area of interest
+    rather than the size of the whole scene. Given a target resolution, the
+    tiles are fetched from the coarsest overview that is still fine enough.
+
+    Parameters
+    ----------
+    filename : str
+        Path or URL to the GeoTIFF file.
+    bbox : tuple
+        Bounding box as (minx, miny, maxx, maxy).
+    bbox_crs : str or rasterio.crs.CRS
+        Coordinate reference system of the bounding box. Default is None,
+        meaning that the bounding box is in the raster's CRS.
+    masked : bool
+        If True, set nodata values to NaN. Default is False.
+    resolution : float
+        Largest acceptable pixel size in the raster's CRS units, e.g. 40 to
+        read a 10m raster from its 4x overview. Default is None, which reads
+        the full resolution. See :func:`select_overview_level`.
+    kwargs
+        Extra arguments passed to ``rioxarray.open_rasterio``.
+
+    Returns
+    -------
+    dataarray : xr.DataArray
+        The raster clipped to the bounding box, loaded into memory.
+    """
+    if resolution is not None:
+        kwargs.setdefault(
+            "overview_level",
+            select_overview_level(filename=filename, resolution=resolution),
+        )
+    with cog_env(filename=filename):
+        with rioxarray.open_rasterio(
+            filename=filename, masked=masked, **kwargs
+        ) as dataarray:
+            window = bbox_to_window(
+                bbox=bbox,
+                transform=dataarray.rio.transform(),
+                shape=dataarray.rio.shape,
+                crs=dataarray.rio.crs,
+                bbox_crs=bbox_crs,
+            )
+            return dataarray.rio.isel_window(window=window).load()
+
+
+def load_bands(
+    filenames: list,
+    bands: list = None,
+    bbox: tuple = None,
+    bbox_crs=None,
+    masked: bool = False,
+    resolution: float = None,
+    max_workers: int = None,
+) -> xr.DataArray:
+    """
+    Concurrently read single-band rasters into one (band, y, x) stack.
+
+    Each band is fetched on a thread pool and written straight into its slice
+    of a preallocated array, so there is no extra copy from concatenating the
+    bands, and the wall time is roughly that of the slowest single band.
+    All the rasters must be on the same grid (e.g. the 10m Sentinel 2 bands).
+
+    Parameters
+    ----------
+    filenames : list
+        Paths or URLs to the single-band GeoTIFF files.
+    bands : list
+        Labels for the 'band' coordinate, e.g. [4, 3, 2] for Red, Green, Blue.
+        Default is None, which numbers the bands from 1 upwards.
+    bbox : tuple
+        Bounding box as (minx, miny, maxx, maxy). Default is None, which reads
+        the whole raster.
+    bbox_crs : str or rasterio.crs.CRS
+        Coordinate reference system of the bounding box. Default is None,
+        meaning that the bounding box is in the raster's CRS.
+    masked : bool
+        If True, set nodata values to NaN and return a float array.
+        Default is False.
+    resolution : float
+        Largest acceptable pixel size in the rasters' CRS units. The bands are
+        read from the coarsest overview that is still fine enough, e.g. the
+        2x overview (20m) of 10m Sentinel 2 bands for resolution=30. Default
+        is None, which reads the full resolution.
+    max_workers : int
+        Number of threads to read the bands with. Default is None, which uses
+        one thread per band.
+
+    Returns
+    -------
+    dataarray : xr.DataArray
+        A three-dimensional (band, y, x) array with the CRS and transform set.
+    """
+    if bands is None:
+        bands = list(range(1, len(filenames) + 1))
+    if len(bands) != len(filenames):
+        raise ValueError("The number of band labels and filenames must be equal.")
+
+    open_kwargs: dict = {}
+    if resolution is not None:
+        overview_level = select_overview_level(
+            filename=filenames[0], resolution=resolution
+        )
+        if overview_level is not None:
+            open_kwargs["overview_level"] = overview_level
+
+    with cog_env(filename=filenames[0]):
+        with rasterio.open(fp=filenames[0], **open_kwargs) as src:
+            crs, src_transform, src_shape = src.crs, src.transform, src.shape
+            dtype, nodata = np.dtype(src.dtypes[0]), src.nodata
+    if bbox is None:
+        window = rasterio.windows.Window(
+            col_off=0, row_off=0, width=src_shape[1], height=src_shape[0]
+        )
+    else:
+        window = bbox_to_window(
+            bbox=bbox,
+            transform=src_transform,
+            shape=src_shape,
+            crs=crs,
+            bbox_crs=bbox_crs,
+        )
+    transform = rasterio.windows.transform(window=window, transform=src_transform)
+    height, width = int(window.height), int(window.width)
+
+    if masked:
+        dtype = np.result_type(dtype, np.float32)
+    stack = np.empty(shape=(len(filenames), height, width), dtype=dtype)
+
+    def _read_band(index: int, filename: str):
+        with cog_env(filename=filename):
+            with rasterio.open(fp=filename, **open_kwargs) as src:
+                if src.transform != src_transform or src.shape != src_shape:
+                    raise ValueError(
+                        f"{filename} is not on the same grid as {filenames[0]}."
+                    )
+                band = stack[index]
+                src.read(indexes=1, window=window, out=band, out_dtype=dtype)
+        if masked and nodata is not None:
+            band[band == nodata] = np.nan
+
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers or len(filenames)
+    ) as executor:
+        futures = [
+            executor.submit(_read_band, index, filename)
+            for index, filename in enumerate(filenames)
+        ]
+        for future in futures:
+            future.result()  # re-raise any errors from the threads
+
+    dataarray = xr.DataArray(
+        data=stack,
+        coords={
+            "band": bands,
+            "y": transform.f + (np.arange(height) + 0.5) * transform.e,
+            "x": transform.c + (np.arange(width) + 0.5) * transform.a,
+        },
+        dims=("band", "y", "x"),
+    )
+    dataarray.rio.write_crs(input_crs=crs, inplace=True)
+    dataarray.rio.write_transform(transform=transform, inplace=True)
+    if masked:
+        if nodata is not None:
+            dataarray.encoding["_FillValue"] = nodata
+    else:
+        dataarray.rio.write_nodata(input_nodata=nodata, inplace=True)
+    return dataarray
+
+
+def reproject_window(
+    filenames: list,
+    dst_crs,
+    bounds: tuple,
+    resolution: float = None,
+    bands: list = None,
+    resampling: rasterio.enums.Resampling = rasterio.enums.Resampling.nearest,
+    margin: int = 2,
+    masked: bool = False,
+    src_resolution: float = None,
+    max_workers: int = None,
+) -> xr.DataArray:
+    """
+    Reproject single-band rasters onto a target bounding box only.
+
+    The destination bounds are transformed back into the source CRS to find
+    the matching source window, which is padded by a few pixels for the
+    resampling kernel. Only that window is read (see :func:`load_bands`) and
+    warped, so the cost scales with the output size instead of the scene size.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths or URLs to the single-band GeoTIFF files, all on the same grid.
+    dst_crs : str or rasterio.crs.CRS
+        Coordinate reference system to reproject to.
+    bounds : tuple
+        Bounds of the output grid as (minx, miny, maxx, maxy) in dst_crs.
+    resolution : float
+        Pixel size of the output grid in dst_crs units. Default is None, which
+        keeps roughly the same number of pixels as the source window.
+    bands : list
+        Labels for the 'band' coordinate. See :func:`load_bands`.
+    resampling : rasterio.enums.Resampling
+        Resampling method. Default is nearest neighbour.
+    margin : int
+        Number of extra source pixels to read around the window for the
+        resampling kernel. Default is 2.
+    masked : bool
+        If True, set nodata values to NaN and return a float array.
+        Default is False.
+    src_resolution : float
+        Largest acceptable source pixel size in the source CRS units, to read
+        from a coarser overview. See :func:`load_bands`. Default is None.
+    max_workers : int
+        Number of threads to read the bands with. See :func:`load_bands`.
+
+    Returns
+    -------
+    dataarray : xr.DataArray
+        A three-dimensional (band, y, x) array covering exactly the bounds.
+    """
+    with cog_env(filename=filenames[0]):
+        with rasterio.open(fp=filenames[0]) as src:
+            src_crs, (xres, yres) = src.crs, src.res
+    if src_resolution is not None:
+        # Pad by whole pixels of whichever overview gets picked
+        xres, yres = max(xres, src_resolution), max(yres, src_resolution)
+    left, bottom, right, top = rasterio.warp.transform_bounds(
+        dst_crs, src_crs, *bounds, densify_pts=21
+    )
+    src_window: xr.DataArray = load_bands(
+        filenames=filenames,
+        bands=bands,
+        bbox=(
+            left - margin * xres,
+            bottom - margin * yres,
+            right + margin * xres,
+            top + margin * yres,
+        ),
+        masked=masked,
+        resolution=src_resolution,
+        max_workers=max_workers,
+    )
+
+    minx, miny, maxx, maxy = bounds
+    if resolution is None:
+        default_transform, _, _ = rasterio.warp.calculate_default_transform(
+            src_crs,
+            dst_crs,
+            src_window.rio.width,
+            src_window.rio.height,
+            *src_window.rio.bounds(),
+        )
+        resolution = default_transform.a
+    dst_transform = rasterio.transform.from_origin(
+        west=minx, north=maxy, xsize=resolution, ysize=resolution
+    )
+    dst_shape: tuple = (
+        math.ceil((maxy - miny) / resolution),
+        math.ceil((maxx - minx) / resolution),
+    )
+    return src_window.rio.reproject(
+        dst_crs=dst_crs,
+        shape=dst_shape,
+        transform=dst_transform,
+        resampling=resampling,
+    )
+
+
+def load_reprojected_relief(
+    resolution: str,
+    region: list,
+    dst_crs,
+    dst_resolution: float,
+    bounds: tuple = None,
+    resampling: str = "nearest",
+    dtype: str = None,
+    cache: GridCache = None,
+) -> xr.DataArray:
+    """
+    Get an earth_relief DEM reprojected to another CRS, from a persistent
+    cache of derived grids.
+
+    The first call downloads the DEM with
+    ``pygmt.datasets.load_earth_relief``, reprojects, clips and casts it, and
+    saves the result in a :class:`mapchallenge.cache.GridCache`. Later calls
+    with the same parameters read the cached grid instead of redoing the warp.
+
+    Parameters
+    ----------
+    resolution : str
+        Resolution of the earth_relief grid, e.g. '01s'.
+    region : list
+        Longitude/latitude region to download, as [west, east, south, north].
+    dst_crs : str or rasterio.crs.CRS
+        Coordinate reference system to reproject to, e.g. 'EPSG:2193'.
+    dst_resolution : float
+        Pixel size of the reprojected grid in dst_crs units.
+    bounds : tuple
+        Bounding box to clip the reprojected grid to, as (minx, miny, maxx,
+        maxy) in dst_crs. Default is None (no clipping).
+    resampling : str
+        Name of the rasterio resampling method. Default is 'nearest'.
+    dtype : str
+        Data type to cast the grid to, e.g. 'int16'. Default is None, which
+        keeps float32.
+    cache : mapchallenge.cache.GridCache
+        The cache to use. Default is None, which uses a GridCache in the
+        default cache directory.
+
+    Returns
+    -------
+    grid : xr.DataArray
+    """
+
+    def _compute() -> xr.DataArray:
+        import pygmt
+
+        grid: xr.DataArray = pygmt.datasets.load_earth_relief(
+            resolution=resolution, region=region
+        )
+        grid = grid.rio.write_crs(input_crs="EPSG:4326").rio.reproject(
+            dst_crs=dst_crs,
+            resolution=dst_resolution,
+            resampling=rasterio.enums.Resampling[resampling],
+        )
+        if bounds is not None:
+            minx, miny, maxx, maxy = bounds
+            grid = grid.rio.clip_box(minx=minx, miny=miny, maxx=maxx, maxy=maxy)
+        if dtype is not None:
+            grid = grid.astype(dtype=dtype)
+        return grid
+
+    return (cache or GridCache()).get(
+        compute=_compute,
+        dataset="earth_relief",
+        resolution=resolution,
+        region=list(region),
+        dst_crs=str(dst_crs),
+        dst_resolution=dst_resolution,
+        bounds=None if bounds is None else list(bounds),
+        resampling=resampling,
+        dtype=dtype,
+    )
+
+
+def overview_factors(width: int, height: int, min_size: int = 256) -> list:
+    """
+    Get power of two overview factors for a raster, from 2 up to the first
+    one where the overview's smaller side is at most min_size pixels.
+
+    Parameters
+    ----------
+    width : int
+        Raster width in pixels.
+    height : int
+        Raster height in pixels.
+    min_size : int
+        Stop at the overview whose smaller side is this many pixels or less.
+        Default is 256.
+
+    Returns
+    -------
+    factors : list
+        Decimation factors, e.g. [2, 4, 8, 16].
+    """
+    factors: list = []
+    factor: int = 2
+    while min(width, height) / (factor // 2) > min_size:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def choose_overview_factor(factors: list, res: float, target_res: float) -> int:
+    """
+    Choose the coarsest overview that is still at least as fine as a target
+    resolution.
+
+    Parameters
+    ----------
+    factors : list
+        Decimation factors of the available overviews, e.g. [2, 4, 8].
+    res : float
+        Pixel size of the full resolution raster.
+    target_res : float
+        Largest pixel size that is still fine enough, in the same units.
+
+    Returns
+    -------
+    factor : int
+        One of the factors, or 1 if even the finest overview is too coarse.
+    """
+    fine_enough: list = [
+        factor for factor in factors if res * factor <= target_res * (1 + 1e-6)
+    ]
+    return max(fine_enough, default=1)
+
+
+def build_overviews(
+    filename: str,
+    factors: list = None,
+    resampling: str = "average",
+    min_size: int = 256,
+) -> list:
+    """
+    Build an overview pyramid for a raster file, if it doesn't have one yet.
+
+    The overviews are written to a sidecar '.ovr' file next to the raster,
+    so the raster itself is left untouched. GDAL picks up the sidecar file
+    automatically.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the raster file.
+    factors : list
+        Decimation factors, e.g. [2, 4, 8]. Default is None, which halves the
+        resolution at each level until the smaller side is min_size pixels.
+    resampling : str
+        Resampling method to build the overviews with, e.g. 'average',
+        'nearest' or 'mode'. Default is 'average'.
+    min_size : int
+        See :func:`overview_factors`. Default is 256.
+
+    Returns
+    -------
+    factors : list
+        Decimation factors of the overviews available for the raster.
+    """
+    with rasterio.open(fp=filename) as src:
+        if src.overviews(1):
+            return src.overviews(1)
+        if factors is None:
+            factors = overview_factors(
+                width=src.width, height=src.height, min_size=min_size
+            )
+    # Build external overviews even though the file is opened for update
+    with rasterio.Env(TIFF_USE_OVR=True):
+        with rasterio.open(filename, mode="r+") as dst:
+            dst.build_overviews(
+                factors=factors, resampling=rasterio.enums.Resampling[resampling]
+            )
+    return factors
+
+
+def overview_for_plot(
+    filename: str,
+    dpi: int = 300,
+    width: float = None,
+    scale: float = None,
+    region: list = None,
+    resampling: str = "average",
+    outfile: str = None,
+) -> str:
+    """
+    Get a version of a raster file with just enough pixels for a plot.
+
+    The coarsest overview level that still has at least dpi pixels per inch
+    on the plot is written out to a GeoTIFF file, which can be passed to GMT
+    instead of the full resolution raster, so that render time and memory
+    depend on the output size rather than the source size. If the raster has
+    overviews (see :func:`build_overviews`), only that level is read.
+    Otherwise, it is decimated by a power of two while reading.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the raster file.
+    dpi : int
+        Resolution of the plotted image, in dots per inch. Default is 300.
+    width : float
+        Width of the plotted region on the figure, in cm.
+    scale : float
+        Figure length in cm per raster unit, e.g. 100 / 200_000 for a
+        1:200000 map in metres. Used when width is not given.
+    region : list
+        Plotted region as [xmin, xmax, ymin, ymax] in the raster's
+        coordinates. Only the west-east extent is used. Default is None,
+        which means the whole raster.
+    resampling : str
+        Resampling method for rasters without overviews. Default is
+        'average'.
+    outfile : str
+        Path of the output GeoTIFF file. Default is None, which writes to
+        '{name}_overview{factor}_{resampling}.tif' in the current directory.
+        An existing output file is reused, unless it is older than the input
+        raster.
+
+    Returns
+    -------
+    filename : str
+        Path to the raster file to plot, which is the input filename when
+        the full resolution is needed.
+    """
+    with rasterio.open(fp=filename) as src:
+        if region is None:
+            span: float = src.bounds.right - src.bounds.left
+        else:
+            span = region[1] - region[0]
+        if width is None:
+            if scale is None:
+                raise ValueError("Either width or scale must be given.")
+            width = span * scale
+        target_res: float = span / (width / 2.54 * dpi)
+        factor: int = choose_overview_factor(
+            factors=src.overviews(1)
+            or overview_factors(width=src.width, height=src.height),
+            res=src.res[0],
+            target_res=target_res,
+        )
+        if factor == 1:
+            return filename
+
+        if outfile is None:
+            name: str = os.path.splitext(os.path.basename(filename))[0]
+            outfile = f"{name}_overview{factor}_{resampling}.tif"
+        if os.path.exists(outfile) and os.path.exists(filename):
+            if os.path.getmtime(outfile) >= os.path.getmtime(filename):
+                return outfile
+
+        height: int = math.ceil(src.height / factor)
+        width_px: int = math.ceil(src.width / factor)
+        data: np.ndarray = src.read(
+            out_shape=(src.count, height, width_px),
+            resampling=rasterio.enums.Resampling[resampling],
+        )
+        profile: dict = src.profile
+        profile.update(
+            driver="GTiff",
+            height=height,
+            width=width_px,
+            transform=src.transform
+            * rasterio.Affine.scale(src.width / width_px, src.height / height),
+            tiled=True,
+            blockxsize=256,
+            blockysize=256,
+            compress="deflate",
+        )
+        with rasterio.open(outfile, mode="w", **profile) as dst:
+            dst.write(data)
+            dst.colorinterp = src.colorinterp
+    return outfile
+
+
+def _pixel_size(dataarray: xr.DataArray) -> tuple:
+    """
+    Get the width and height of a raster's pixels from its x and y coordinates.
+    """
+    size_x: float = float(dataarray.x[1] - dataarray.x[0])
+    size_y: float = float(dataarray.y[0] - dataarray.y[1])
+    return size_x, size_y
+
+
+def _fit_to_region(dataarray: xr.DataArray, region: list, factor: int) -> tuple:
+    """
+    Crop and pad a 2D (y, x) raster to a region, rounded up to whole blocks of
+    factor x factor pixels.
+
+    Returns the cropped/padded array, and a boolean array that is False in
+    the padding, or None when no padding was needed.
+    """
+    west, east, south, north = region
+    size_x, size_y = _pixel_size(dataarray=dataarray)
+    left: float = float(dataarray.x[0]) - size_x / 2
+    top: float = float(dataarray.y[0]) + size_y / 2
+
+    # Position of the region's top left pixel and size in whole blocks
+    col0: int = int(round((west - left) / size_x))
+    row0: int = int(round((top - north) / size_y))
+    ncols: int = math.ceil(round((east - west) / size_x, 6) / factor) * factor
+    nrows: int = math.ceil(round((north - south) / size_y, 6) / factor) * factor
+
+    # Overlap between the raster and the region, in the raster's pixels
+    height, width = dataarray.shape
+    rows = slice(max(row0, 0), min(row0 + nrows, height))
+    cols = slice(max(col0, 0), min(col0 + ncols, width))
+    values: np.ndarray = dataarray.values[rows, cols]
+    if values.shape == (nrows, ncols):
+        return values, None
+
+    padded: np.ndarray = np.zeros(shape=(nrows, ncols), dtype=values.dtype)
+    inside: np.ndarray = np.zeros(shape=(nrows, ncols), dtype=bool)
+    window: tuple = (
+        slice(rows.start - row0, rows.start - row0 + values.shape[0]),
+        slice(cols.start - col0, cols.start - col0 + values.shape[1]),
+    )
+    padded[window] = values
+    inside[window] = True
+    return padded, inside
+
+
+def coarsen_raster(
+    dataarray: xr.DataArray,
+    factor: int,
+    statistics: tuple = ("mean", "max", "count"),
+    nodata=None,
+    output: str = "grid",
+    region: list = None,
+):
+    """
+    Aggregate a raster into coarser blocks of factor x factor pixels, e.g.
+    10m pixels into 50m blocks with factor=5.
+
+    The array is reshaped into a (rows, factor, cols, factor) view, and each
+    statistic is a single NumPy reduction over the two block axes, skipping
+    nodata pixels. Without a region, blocks start at the top left pixel, and
+    rows and columns at the bottom and right that don't fill a whole block
+    are left out. With a region, the block edges line up with the region's
+    edges like GMT's ``blockmean -R... -I...+e``, and the raster is cropped
+    or padded with empty pixels to fit the region (which copies the array).
+
+    Parameters
+    ----------
+    dataarray : xr.DataArray
+        A 2D (y, x) raster, or a 3D (band, y, x) raster with a single band.
+    factor : int
+        Number of pixels along each side of a block.
+    statistics : tuple
+        Statistics to compute for each block, any of 'mean', 'min', 'max',
+        'sum' and 'count' (the number of valid pixels). Default is
+        ('mean', 'max', 'count').
+    nodata : float
+        Pixel value to skip, on top of NaN. Default is None, which uses the
+        raster's nodata value if it has one.
+    output : str
+        Either 'grid' to get an xr.Dataset with one coarse grid per
+        statistic, or 'table' to get a pd.DataFrame with x, y and statistic
+        columns for the blocks that have at least one valid pixel. With a
+        single statistic, the table columns are x, y, z like the output of
+        GMT's blockmean. Default is 'grid'.
+    region : list
+        Bounds as [West, East, South, North] to align the blocks to, in the
+        raster's coordinates. The region's width and height should be whole
+        multiples of the pixel size. Default is None, which starts the blocks
+        at the raster's top left pixel.
+
+    Returns
+    -------
+    coarse : xr.Dataset or pd.DataFrame
+    """
+    if "band" in dataarray.dims:
+        dataarray = dataarray.squeeze(dim="band", drop=True)
+    if nodata is None and hasattr(dataarray, "rio"):
+        nodata = dataarray.rio.nodata
+
+    inside: np.ndarray = None
+    if region is None:
+        ny: int = dataarray.sizes["y"] // factor
+        nx: int = dataarray.sizes["x"] // factor
+        values: np.ndarray = dataarray.values[: ny * factor, : nx * factor]
+    else:
+        values, inside = _fit_to_region(
+            dataarray=dataarray, region=region, factor=factor
+        )
+        ny, nx = values.shape[0] // factor, values.shape[1] // factor
+    blocks: np.ndarray = values.reshape(ny, factor, nx, factor)
+
+    valid: np.ndarray = np.ones(shape=blocks.shape, dtype=bool)
+    if inside is not None:
+        valid &= inside.reshape(blocks.shape)
+    if np.issubdtype(blocks.dtype, np.floating):
+        valid &= ~np.isnan(blocks)
+    if nodata is not None and not (isinstance(nodata, float) and math.isnan(nodata)):
+        valid &= blocks != nodata
+
+    axis: tuple = (1, 3)
+    count: np.ndarray = valid.sum(axis=axis)
+    empty: np.ndarray = count == 0
+    results: dict = {}
+    for statistic in statistics:
+        if statistic == "count":
+            results[statistic] = count
+            continue
+        if statistic in ("sum", "mean"):
+            result = np.sum(blocks, axis=axis, where=valid, dtype=np.float64)
+            if statistic == "mean":
+                with np.errstate(invalid="ignore", divide="ignore"):
+                    result = result / count
+        elif statistic in ("min", "max"):
+            reduce = np.min if statistic == "min" else np.max
+            initial: float = np.inf if statistic == "min" else -np.inf
+            result = reduce(
+                blocks.astype(np.float64, copy=False),
+                axis=axis,
+                where=valid,
+                initial=initial,
+            )
+        else:
+            raise ValueError(f"Unknown statistic '{statistic}'.")
+        result[empty] = np.nan
+        results[statistic] = result
+
+    if region is None:
+        y: np.ndarray = (
+            dataarray.y.values[: ny * factor].reshape(ny, factor).mean(axis=1)
+        )
+        x: np.ndarray = (
+            dataarray.x.values[: nx * factor].reshape(nx, factor).mean(axis=1)
+        )
+    else:
+        west, _, _, north = region
+        size_x, size_y = _pixel_size(dataarray=dataarray)
+        y = north - size_y * factor * (np.arange(ny) + 0.5)
+        x = west + size_x * factor * (np.arange(nx) + 0.5)
+    if output == "table":
+        if len(results) == 1:
+            results = {"z": results.popitem()[1]}
+        rows, cols = np.nonzero(~empty)
+        return pd.DataFrame(
+            data={
+                "x": x[cols],
+                "y": y[rows],
+                **{name: result[rows, cols] for name, result in results.items()},
+            }
+        )
+
+    coarse = xr.Dataset(
+        data_vars={name: (("y", "x"), result) for name, result in results.items()},
+        coords={"y": y, "x": x},
+    )
+    if hasattr(dataarray, "rio") and dataarray.rio.crs is not None:
+        coarse.rio.write_crs(input_crs=dataarray.rio.crs, inplace=True)
+    return coarse
+
+
+class VirtualMosaic:
+    """
+    Lazy mosaic of adjacent raster tiles on the same grid, like a GDAL VRT.
+
+    Only the headers of the tiles are read when the mosaic is created. Reading
+    a window then only reads the blocks of the tiles that overlap it, so
+    memory depends on the size of the window, and not on the number or size
+    of the tiles. Where tiles overlap, the first tile in the list wins, like
+    ``rioxarray.merge.merge_arrays``.
+
+    Parameters
+    ----------
+    filenames : list
+        Paths or URLs to the GeoTIFF tiles. They must have the same CRS,
+        resolution, number of bands and data type, and be aligned to the same
+        pixel grid.
+    """
+
+    def __init__(self, filenames: list):
+        self.filenames: list = list(filenames)
+        self._sources: list = []  # (filename, bounds) of each tile
+        for filename in self.filenames:
+            with cog_env(filename=filename):
+                with rasterio.open(fp=filename) as src:
+                    if not self._sources:
+                        self.crs = src.crs
+                        self.res: tuple = src.res
+                        self.count: int = src.count
+                        self.dtype = np.dtype(src.dtypes[0])
+                        self.nodata = src.nodata
+                        origin: tuple = (src.transform.c, src.transform.f)
+                    elif (src.crs, src.res, src.count) != (
+                        self.crs,
+                        self.res,
+                        self.count,
+                    ):
+                        raise ValueError(
+                            f"{filename} does not have the same CRS, resolution "
+                            f"and number of bands as {self.filenames[0]}."
+                        )
+                    # The tile origins must be a whole number of pixels apart
+                    offsets: tuple = (
+                        (src.transform.c - origin[0]) / self.res[0],
+                        (origin[1] - src.transform.f) / self.res[1],
+                    )
+                    if any(abs(offset - round(offset)) > 1e-6 for offset in offsets):
+                        raise ValueError(f"{filename} is not on the same pixel grid.")
+                    self._sources.append((filename, src.bounds))
+
+        left: float = min(bounds.left for _, bounds in self._sources)
+        bottom: float = min(bounds.bottom for _, bounds in self._sources)
+        right: float = max(bounds.right for _, bounds in self._sources)
+        top: float = max(bounds.top for _, bounds in self._sources)
+        self.transform = rasterio.transform.from_origin(
+            west=left, north=top, xsize=self.res[0], ysize=self.res[1]
+        )
+        self.shape: tuple = (
+            int(round((top - bottom) / self.res[1])),
+            int(round((right - left) / self.res[0])),
+        )
+
+    @property
+    def bounds(self) -> tuple:
+        """
+        Bounds of the whole mosaic as (minx, miny, maxx, maxy).
+        """
+        return rasterio.transform.array_bounds(*self.shape, self.transform)[:4]
+
+    def _read(self, window: rasterio.windows.Window) -> np.ndarray:
+        """
+        Read a (band, y, x) window of the mosaic from the overlapping tiles.
+        """
+        height, width = int(window.height), int(window.width)
+        fill_value = 0 if self.nodata is None else self.nodata
+        out = np.full(
+            shape=(self.count, height, width), fill_value=fill_value, dtype=self.dtype
+        )
+        window_bounds = rasterio.windows.bounds(window=window, transform=self.transform)
+        # Read the tiles in reverse order, so that the first tile ends up on top
+        for filename, bounds in reversed(self._sources):
+            overlap = (
+                max(window_bounds[0], bounds.left),
+                max(window_bounds[1], bounds.bottom),
+                min(window_bounds[2], bounds.right),
+                min(window_bounds[3], bounds.top),
+            )
+            if overlap[0] >= overlap[2] or overlap[1] >= overlap[3]:
+                continue
+
+            with cog_env(filename=filename):
+                with rasterio.open(fp=filename) as src:
+                    src_window = (
+                        rasterio.windows.from_bounds(*overlap, transform=src.transform)
+                        .round_offsets()
+                        .round_lengths()
+                    )
+                    data = src.read(window=src_window, masked=True)
+            dst_window = (
+                rasterio.windows.from_bounds(*overlap, transform=self.transform)
+                .round_offsets()
+                .round_lengths()
+            )
+            row = int(dst_window.row_off - window.row_off)
+            col = int(dst_window.col_off - window.col_off)
+            target = out[:, row : row + data.shape[1], col : col + data.shape[2]]
+            np.copyto(dst=target, src=data.data, where=~np.ma.getmaskarray(data))
+        return out
+
+    def clip_box(
+        self, minx: float, miny: float, maxx: float, maxy: float
+    ) -> xr.DataArray:
+        """
+        Read the part of the mosaic inside a bounding box, like
+        ``dataarray.rio.clip_box``.
+
+        Parameters
+        ----------
+        minx, miny, maxx, maxy : float
+            Bounding box in the CRS of the tiles.
+
+        Returns
+        -------
+        dataarray : xr.DataArray
+            A three-dimensional (band, y, x) array with the CRS, transform
+            and nodata set.
+        """
+        window = bbox_to_window(
+            bbox=(minx, miny, maxx, maxy), transform=self.transform, shape=self.shape
+        )
+        transform = rasterio.windows.transform(window=window, transform=self.transform)
+        height, width = int(window.height), int(window.width)
+        dataarray = xr.DataArray(
+            data=self._read(window=window),
+            coords={
+                "band": np.arange(1, self.count + 1),
+                "y": transform.f + (np.arange(height) + 0.5) * transform.e,
+                "x": transform.c + (np.arange(width) + 0.5) * transform.a,
+            },
+            dims=("band", "y", "x"),
+        )
+        dataarray.rio.write_crs(input_crs=self.crs, inplace=True)
+        dataarray.rio.write_transform(transform=transform, inplace=True)
+        dataarray.rio.write_nodata(input_nodata=self.nodata, inplace=True)
+        return dataarray
+
+    def to_raster(
+        self, raster_path: str, bbox: tuple = None, block_size: int = 512, **kwargs
+    ) -> str:
+        """
+        Write the mosaic, or the part inside a bounding box, to a GeoTIFF file
+        one block at a time, without holding the whole output in memory.
+
+        Parameters
+        ----------
+        raster_path : str
+            Path of the GeoTIFF file to save.
+        bbox : tuple
+            Bounding box as (minx, miny, maxx, maxy). Default is None, which
+            writes the whole mosaic.
+        block_size : int
+            Width and height of the blocks to read and write. Default is 512.
+        kwargs
+            Extra creation options passed to ``rasterio.open``, e.g.
+            compress="deflate".
+
+        Returns
+        -------
+        raster_path : str
+        """
+        if bbox is None:
+            bbox = self.bounds
+        window = bbox_to_window(bbox=bbox, transform=self.transform, shape=self.shape)
+        height, width = int(window.height), int(window.width)
+        profile: dict = {
+            "driver": "GTiff",
+            "height": height,
+            "width": width,
+            "count": self.count,
+            "dtype": self.dtype,
+            "crs": self.crs,
+            "transform": rasterio.windows.transform(
+                window=window, transform=self.transform
+            ),
+            "nodata": self.nodata,
+            "tiled": True,
+            "blockxsize": block_size,
+            "blockysize": block_size,
+            **kwargs,
+        }
+        with rasterio.open(raster_path, mode="w", **profile) as dst:
+            for row in range(0, height, block_size):
+                for col in range(0, width, block_size):
+                    block = rasterio.windows.Window(
+                        col_off=col,
+                        row_off=row,
+                        width=min(block_size, width - col),
+                        height=min(block_size, height - row),
+                    )
+                    src_block = rasterio.windows.Window(
+                        col_off=window.col_off + col,
+                        row_off=window.row_off + row,
+                        width=block.width,
+                        height=block.height,
+                    )
+                    dst.write(self._read(window=src_block), window=block)
+        return raster_path
+
+
+def _row_slices(height: int, chunk_rows: int) -> list:
+    """
+    Split the rows of a raster into slices of at most chunk_rows each.
+    """
+    return [
+        slice(start, min(start + chunk_rows, height))
+        for start in range(0, height, chunk_rows)
+    ]
+
+
+def _stretch_limits(
+    read_chunks, dtype, percentiles: tuple = (0, 100), nodata=None
+) -> tuple:
+    """
+    Find the lower and upper data values to stretch between, reading the data
+    one chunk at a time.
+
+    8-bit and 16-bit integers are counted into an exact histogram in a single
+    pass. Floating point data needs one pass for the min/max, and another pass
+    to build a histogram if the percentiles are not (0, 100).
+    """
+    dtype = np.dtype(dtype)
+    lower, upper = percentiles
+
+    def _valid(chunk: np.ndarray) -> np.ndarray:
+        values = chunk.ravel()
+        if np.issubdtype(dtype, np.floating):
+            values = values[np.isfinite(values)]
+        if nodata is not None and not np.isnan(nodata):
+            values = values[values != nodata]
+        return values
+
+    if np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2:
+        offset: int = int(np.iinfo(dtype).min)
+        counts = np.zeros(shape=2 ** (8 * dtype.itemsize), dtype=np.int64)
+        for chunk in read_chunks():
+            counts += np.bincount(
+                _valid(chunk).astype(np.int64) - offset, minlength=counts.size
+            )
+        lower_edges = upper_edges = np.arange(counts.size) + offset
+    else:
+        vmin, vmax = np.inf, -np.inf
+        for chunk in read_chunks():
+            values = _valid(chunk)
+            if values.size:
+                vmin, vmax = min(vmin, values.min()), max(vmax, values.max())
+        if vmin > vmax:
+            raise ValueError("There is no valid data to stretch.")
+        if (lower, upper) == (0, 100) or vmin == vmax:
+            return float(vmin), float(vmax)
+
+        edges = np.linspace(start=vmin, stop=vmax, num=2 ** 12 + 1)
+        counts = np.zeros(shape=edges.size - 1, dtype=np.int64)
+        for chunk in read_chunks():
+            counts += np.histogram(_valid(chunk), bins=edges)[0]
+        lower_edges, upper_edges = edges[:-1], edges[1:]
+
+    cdf = np.cumsum(counts)
+    total = cdf[-1]
+    if total == 0:
+        raise ValueError("There is no valid data to stretch.")
+    vmin = lower_edges[np.searchsorted(cdf, total * lower / 100, side="right")]
+    vmax = upper_edges[np.searchsorted(cdf, total * upper / 100, side="left")]
+    return float(vmin), float(vmax)
+
+
+def _apply_stretch(chunk: np.ndarray, vmin: float, vmax: float, nodata=None):
+    """
+    Linearly rescale one chunk to 0-255 and return it as uint8. Values outside
+    of vmin/vmax are clipped, and NaN or nodata values become 0.
+    """
+    scale: float = 255 / (vmax - vmin) if vmax > vmin else 0.0
+    if np.issubdtype(chunk.dtype, np.integer) and chunk.dtype.itemsize <= 2:
+        # Map every possible input value through a lookup table of uint8 colors,
+        # with one entry per value (256 for uint8, 65536 for uint16)
+        offset: int = int(np.iinfo(chunk.dtype).min)
+        values = np.arange(2 ** (8 * chunk.dtype.itemsize)) + offset
+        lut = np.clip(np.round((values - vmin) * scale), 0, 255).astype(np.uint8)
+        if nodata is not None and not np.isnan(nodata):
+            lut[int(nodata) - offset] = 0
+        return np.take(lut, chunk.astype(np.int64) - offset)
+
+    stretched = np.subtract(chunk, vmin, dtype=np.float32)
+    stretched *= scale
+    np.clip(stretched, 0, 255, out=stretched)
+    invalid = ~np.isfinite(chunk)
+    if nodata is not None and not np.isnan(nodata):
+        invalid |= chunk == nodata
+    stretched[invalid] = 0
+    return np.round(stretched, out=stretched).astype(np.uint8)
+
+
+def stretch_to_uint8(
+    dataarray: xr.DataArray, percentiles: tuple = (0, 100), chunk_rows: int = 512
+) -> xr.DataArray:
+    """
+    Contrast stretch an image (e.g. 16-bit) to 8-bit colors.
+
+    Makes one chunked pass over the image to collect the min/max or a
+    histogram, and a second chunked pass that writes the uint8 output, so
+    the temporary arrays are bounded by the chunk size instead of the image
+    size. The input is only ever indexed one chunk of rows at a time, so a
+    lazily opened raster (e.g. from ``rioxarray.open_rasterio``) is never
+    loaded whole, and only the uint8 output is held in memory. All the bands
+    are stretched between the same limits.
+
+    Parameters
+    ----------
+    dataarray : xr.DataArray
+        A (band, y, x) or (y, x) image. NaN values are treated as nodata.
+    percentiles : tuple
+        Lower and upper percentiles to clip the data values at before
+        stretching, e.g. (2, 98). Default is (0, 100), i.e. the min and max.
+    chunk_rows : int
+        Number of image rows to process at a time. Default is 512.
+
+    Returns
+    -------
+    stretched : xr.DataArray
+        The uint8 image, with nodata pixels set to 0.
+    """
+    nodata = dataarray.rio.nodata
+    row_slices: list = _row_slices(height=dataarray.sizes["y"], chunk_rows=chunk_rows)
+
+    def _read_rows(rows: slice) -> np.ndarray:
+        # Reads only these rows from disk if the array isn't loaded yet
+        return dataarray.isel(y=rows).values
+
+    vmin, vmax = _stretch_limits(
+        read_chunks=lambda: (_read_rows(rows=rows) for rows in row_slices),
+        dtype=dataarray.dtype,
+        percentiles=percentiles,
+        nodata=nodata,
+    )
+    stretched = np.empty(shape=dataarray.shape, dtype=np.uint8)
+    y_axis: int = dataarray.get_axis_num("y")
+    for rows in row_slices:
+        index: tuple = (slice(None),) * y_axis + (rows,)
+        stretched[index] = _apply_stretch(
+            chunk=_read_rows(rows=rows), vmin=vmin, vmax=vmax, nodata=nodata
+        )
+
+    dataarray = dataarray.copy(data=stretched)
+    dataarray.encoding = {}
+    dataarray.attrs.pop("_FillValue", None)
+    return dataarray.rio.write_nodata(input_nodata=None)
+
+
+def stretch_raster(
+    src_path: str,
+    dst_path: str,
+    percentiles: tuple = (0, 100),
+    chunk_rows: int = 512,
+):
+    """
+    Contrast stretch a GeoTIFF file to an 8-bit GeoTIFF file, block by block.
+
+    Same as :func:`stretch_to_uint8`, except that neither the input nor the
+    output image is ever fully held in memory, so scene-sized stretches fit
+    on small workers.
+
+    Parameters
+    ----------
+    src_path : str
+        Path to the input raster file.
+    dst_path : str
+        Path to the output uint8 GeoTIFF file.
+    percentiles : tuple
+        Lower and upper percentiles to clip the data values at before
+        stretching, e.g. (2, 98). Default is (0, 100), i.e. the min and max.
+    chunk_rows : int
+        Number of image rows to process at a time. Default is 512.
+    """
+    with rasterio.open(fp=src_path) as src:
+        windows: list = [
+            rasterio.windows.Window.from_slices(
+                rows=(rows.start, rows.stop), cols=(0, src.width)
+            )
+            for rows in _row_slices(height=src.height, chunk_rows=chunk_rows)
+        ]
+        vmin, vmax = _stretch_limits(
+            read_chunks=lambda: (src.read(window=window) for window in windows),
+            dtype=src.dtypes[0],
+            percentiles=percentiles,
+            nodata=src.nodata,
+        )
+
+        profile: dict = src.profile
+        profile.update(driver="GTiff", dtype="uint8", nodata=None)
+        with rasterio.open(dst_path, mode="w", **profile) as dst:
+            for window in windows:
+                dst.write(
+                    _apply_stretch(
+                        chunk=src.read(window=window),
+                        vmin=vmin,
+                        vmax=vmax,
+                        nodata=src.nodata,
+                    ),
+                    window=window,
+                )
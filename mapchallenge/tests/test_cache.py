@@ -0,0 +1,130 @@
+"""
+Tests for the download cache, against a local HTTP server.
+"""
+import functools
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+from mapchallenge.cache import DownloadCache
+
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serve files from a directory, and record the status code of each request.
+    """
+
+    statuses: list = []
+
+    def send_response(self, code, message=None):
+        self.statuses.append(code)
+        super().send_response(code=code, message=message)
+
+    def log_message(self, format, *args):
+        pass  # keep the test output quiet
+
+
+@pytest.fixture(name="server")
+def fixture_server(tmp_path):
+    """
+    Run an HTTP server on a random port serving files from a temporary
+    directory, yielding the directory, the base URL and the status codes.
+    """
+    root = tmp_path / "served"
+    root.mkdir()
+    statuses: list = []
+    handler = type("Handler", (_Handler,), {"statuses": statuses})
+    httpd = http.server.ThreadingHTTPServer(
+        server_address=("127.0.0.1", 0),
+        RequestHandlerClass=functools.partial(handler, directory=str(root)),
+    )
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield root, f"http://127.0.0.1:{httpd.server_port}", statuses
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def _write(path, data: bytes, mtime: int):
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+
+
+def test_cache_hit(server, tmp_path, monkeypatch):
+    """
+    A second fetch revalidates with a conditional request, and doesn't copy
+    the local file again.
+    """
+    root, url, statuses = server
+    _write(path=root / "a.bin", data=os.urandom(100_000), mtime=1_600_000_000)
+    monkeypatch.chdir(tmp_path)
+    cache = DownloadCache(cache_dir=str(tmp_path / "cache"))
+
+    fname = cache.fetch(url=f"{url}/a.bin")
+    assert open(fname, mode="rb").read() == (root / "a.bin").read_bytes()
+    before = os.stat(fname)
+
+    assert cache.fetch(url=f"{url}/a.bin") == fname
+    assert statuses == [200, 304]
+    after = os.stat(fname)
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+
+    # The cached copy is read-only, and the local copy is a separate file
+    path = cache.get(url=f"{url}/a.bin")
+    assert not os.access(path, os.W_OK) or os.geteuid() == 0
+    assert not os.path.samefile(path, fname)
+
+
+def test_cache_hash_mismatch(server, tmp_path):
+    """
+    A cached file whose content no longer matches its hash is downloaded
+    again, even though its size and the server's file are unchanged.
+    """
+    root, url, statuses = server
+    data: bytes = os.urandom(100_000)
+    _write(path=root / "a.bin", data=data, mtime=1_600_000_000)
+    cache = DownloadCache(cache_dir=str(tmp_path / "cache"))
+    path = cache.get(url=f"{url}/a.bin")
+
+    os.chmod(path, 0o644)
+    with open(path, mode="r+b") as f:
+        f.write(b"corrupted")
+    os.utime(path, ns=(1, 1))
+
+    # Also check with a fresh cache object, which hasn't verified anything yet
+    for cache in (cache, DownloadCache(cache_dir=str(tmp_path / "cache"))):
+        path = cache.get(url=f"{url}/a.bin")
+        assert hashlib.sha256(open(path, mode="rb").read()).hexdigest() == (
+            hashlib.sha256(data).hexdigest()
+        )
+    assert statuses == [200, 200, 304]
+
+
+def test_cache_refetch(server, tmp_path, monkeypatch):
+    """
+    A file that changed on the server is downloaded again, and a local copy
+    that was edited is copied out of the cache again.
+    """
+    root, url, statuses = server
+    _write(path=root / "a.bin", data=b"old" * 1000, mtime=1_600_000_000)
+    monkeypatch.chdir(tmp_path)
+    cache = DownloadCache(cache_dir=str(tmp_path / "cache"))
+    fname = cache.fetch(url=f"{url}/a.bin")
+
+    with open(fname, mode="r+b") as f:
+        f.write(b"new")
+    assert open(cache.fetch(url=f"{url}/a.bin"), mode="rb").read() == b"old" * 1000
+
+    _write(path=root / "a.bin", data=b"new" * 1000, mtime=1_700_000_000)
+    assert open(cache.fetch(url=f"{url}/a.bin"), mode="rb").read() == b"new" * 1000
+    assert statuses == [200, 304, 200]
+
+    # Offline, the latest cached copy is served without touching the network
+    offline = DownloadCache(cache_dir=str(tmp_path / "cache"), offline=True)
+    assert open(offline.get(url=f"{url}/a.bin"), mode="rb").read() == b"new" * 1000
+    assert statuses == [200, 304, 200]
@@ -0,0 +1,89 @@
+"""
+Tests for the Himawari-8 FTP fetcher, against a local aioftp server.
+"""
+import asyncio
+import os
+
+import aioftp
+import pytest
+
+from mapchallenge.himawari import FTPFetcher
+
+
+async def _run_with_server(root, coro_function):
+    """
+    Start an aioftp server serving the files in a directory, and run an
+    async function with the server's port.
+    """
+    server = aioftp.Server(
+        users=[aioftp.User(login="user", password="pass", base_path=root)]
+    )
+    await server.start(host="127.0.0.1", port=0)
+    try:
+        return await coro_function(server.address[1])
+    finally:
+        await server.close()
+
+
+def _fetcher(port: int, dest_dir) -> FTPFetcher:
+    return FTPFetcher(
+        host="127.0.0.1",
+        user="user",
+        password="pass",
+        port=port,
+        pool_size=2,
+        max_retries=2,
+        backoff=0.01,
+        dest_dir=str(dest_dir),
+    )
+
+
+def test_fetch_resume(tmp_path):
+    """
+    A partially downloaded file is resumed from where it stopped, with only
+    the missing bytes transferred.
+    """
+    root = tmp_path / "served"
+    (root / "jma").mkdir(parents=True)
+    data: bytes = os.urandom(300_000)
+    (root / "jma" / "a.nc").write_bytes(data)
+    dest_dir = tmp_path / "downloads"
+    dest_dir.mkdir()
+    (dest_dir / "a.nc.part").write_bytes(data[:100_000])
+
+    async def _fetch(port: int):
+        async with _fetcher(port=port, dest_dir=dest_dir) as fetcher:
+            return await fetcher.fetch(path="jma/a.nc")
+
+    result = asyncio.run(_run_with_server(root=root, coro_function=_fetch))
+    assert result.path == str(dest_dir / "a.nc")
+    assert result.nbytes == 200_000
+    assert (dest_dir / "a.nc").read_bytes() == data
+    assert not (dest_dir / "a.nc.part").exists()
+
+
+def test_fetch_missing_file(tmp_path):
+    """
+    A missing file fails straight away without retrying, and the logged-in
+    session is kept for the next file.
+    """
+    root = tmp_path / "served"
+    root.mkdir()
+    (root / "b.nc").write_bytes(b"himawari" * 1000)
+
+    async def _fetch(port: int):
+        async with _fetcher(port=port, dest_dir=tmp_path) as fetcher:
+            with pytest.raises(aioftp.StatusCodeError):
+                await fetcher.fetch(path="missing.nc")
+            assert fetcher._num_sessions == 1
+            assert fetcher._idle.qsize() == 1
+            session = fetcher._idle._queue[0]
+
+            result = await fetcher.fetch(path="b.nc")
+            assert fetcher._num_sessions == 1
+            assert fetcher._idle._queue[0] is session
+            return result
+
+    result = asyncio.run(_run_with_server(root=root, coro_function=_fetch))
+    assert result.nbytes == 8000
+    assert (tmp_path / "b.nc").read_bytes() == b"himawari" * 1000